@@ -28,13 +28,8 @@ def non_batched():
 
 
 def batched():
-    arr = easymunk.ffi.new("cpVectArr *", {"num": 0})
-    arr.num = 0
-    arr.max = 0
-    easymunk.cp.cpSpaceGetBodyPositions(s._space, arr)
-    buf = easymunk.ffi.buffer(arr.arr, easymunk.ffi.sizeof("cpVect") * arr.num)
-    mv = memoryview(buf)
-    positions = list(mv.cast("d"))
+    global s
+    positions = s.get_body_states()["position"]
 
 
 if __name__ == "__main__":
@@ -38,6 +38,9 @@ __all__ = [
     "version",
     "chipmunk_version",
     "Space",
+    "SpaceBatch",
+    "SpacePool",
+    "step_parallel",
     "Body",
     "CircleBody",
     "SegmentBody",
@@ -55,20 +58,24 @@ __all__ = [
     "ContactPointSet",
     "Arbiter",
     "CollisionHandler",
+    "CollisionRule",
     "BB",
     "ShapeFilter",
     "Transform",
     "PointQueryInfo",
     "ShapeQueryInfo",
     "SpaceDebugDrawOptions",
+    "StepStats",
+    "CallbackStats",
     "Vec2d",
 ]
 
 from . import _version
+from . import integrators  # noqa: F401
 from .arbiter import Arbiter
 from .bb import BB
 from .body import Body, CircleBody, SegmentBody, PolyBody
-from .collision_handler import CollisionHandler
+from .collision_handler import CollisionHandler, CollisionRule
 from .constraints import *
 from .contact_point_set import ContactPoint, ContactPointSet
 from .geometry import (
@@ -84,7 +91,10 @@ from .query_info import PointQueryInfo, SegmentQueryInfo, ShapeQueryInfo
 from .shape_filter import ShapeFilter
 from .shapes import Circle, Poly, Segment, Shape
 from .space import Space
+from .batch import SpaceBatch, step_parallel
+from .pool import SpacePool
 from .space_debug_draw_options import SpaceDebugDrawOptions
+from .step_stats import CallbackStats, StepStats
 from .transform import Transform
 from .vec2d import Vec2d
 
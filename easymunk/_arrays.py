@@ -0,0 +1,251 @@
+"""
+Helpers shared by the NumPy based batch APIs.
+
+NumPy is an optional dependency and is only imported when one of those APIs is
+used for the first time.
+"""
+__docformat__ = "reStructuredText"
+
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Optional, Tuple
+
+import sidekick.api as sk  # type: ignore[import-untyped]
+
+from ._chipmunk_cffi import ffi
+
+if TYPE_CHECKING:
+    import numpy
+
+np = sk.import_later("numpy")
+
+
+@lru_cache(1)
+def body_state_dtype() -> "numpy.dtype":
+    """
+    Structured dtype that mirrors the cpBodyState C struct.
+    """
+    dtype = np.dtype(
+        [
+            ("position", "f8", (2,)),
+            ("angle", "f8"),
+            ("velocity", "f8", (2,)),
+            ("angular_velocity", "f8"),
+            ("force", "f8", (2,)),
+            ("torque", "f8"),
+        ]
+    )
+    assert dtype.itemsize == ffi.sizeof("cpBodyState")
+    return dtype
+
+
+@lru_cache(1)
+def body_pose_dtype() -> "numpy.dtype":
+    """
+    Structured dtype that mirrors the cpBodyPose C struct.
+    """
+    dtype = np.dtype([("position", "f8", (2,)), ("angle", "f8")])
+    assert dtype.itemsize == ffi.sizeof("cpBodyPose")
+    return dtype
+
+
+@lru_cache(1)
+def collision_event_dtype() -> "numpy.dtype":
+    """
+    Structured dtype that mirrors the cpCollisionEvent C struct.
+    """
+    dtype = np.dtype(
+        [
+            ("event", "u1"),
+            ("first_contact", "?"),
+            ("shape_a", "uintp"),
+            ("shape_b", "uintp"),
+            ("normal", "f8", (2,)),
+            ("total_impulse", "f8", (2,)),
+            ("total_ke", "f8"),
+        ],
+        align=True,
+    )
+    assert dtype.itemsize == ffi.sizeof("cpCollisionEvent")
+    return dtype
+
+
+@lru_cache(1)
+def contact_stats_dtype() -> "numpy.dtype":
+    """
+    Structured dtype that mirrors the cpContactStats C struct.
+    """
+    dtype = np.dtype(
+        [
+            ("normal_impulse", "f8"),
+            ("max_impulse", "f8"),
+            ("kinetic_energy", "f8"),
+            ("collisions", "i4"),
+        ],
+        align=True,
+    )
+    assert dtype.itemsize == ffi.sizeof("cpContactStats")
+    return dtype
+
+
+@lru_cache(1)
+def segment_hit_dtype() -> "numpy.dtype":
+    """
+    Structured dtype that mirrors the cpSegmentHit C struct.
+    """
+    dtype = np.dtype(
+        [
+            ("point", "f8", (2,)),
+            ("normal", "f8", (2,)),
+            ("alpha", "f8"),
+            ("shape", "intp"),
+            ("body", "i4"),
+        ],
+        align=True,
+    )
+    assert dtype.itemsize == ffi.sizeof("cpSegmentHit")
+    return dtype
+
+
+@lru_cache(1)
+def point_hit_dtype() -> "numpy.dtype":
+    """
+    Structured dtype that mirrors the cpPointHit C struct.
+    """
+    dtype = np.dtype(
+        [
+            ("point", "f8", (2,)),
+            ("distance", "f8"),
+            ("gradient", "f8", (2,)),
+            ("shape", "intp"),
+            ("body", "i4"),
+        ],
+        align=True,
+    )
+    assert dtype.itemsize == ffi.sizeof("cpPointHit")
+    return dtype
+
+
+@lru_cache(1)
+def shape_hit_dtype() -> "numpy.dtype":
+    """
+    Structured dtype that mirrors the cpShapeHit C struct.
+    """
+    dtype = np.dtype([("shape", "intp"), ("body", "i4")], align=True)
+    assert dtype.itemsize == ffi.sizeof("cpShapeHit")
+    return dtype
+
+
+@lru_cache(1)
+def shape_query_hit_dtype() -> "numpy.dtype":
+    """
+    Structured dtype that mirrors the cpShapeQueryHit C struct.
+    """
+    point = np.dtype(
+        [("point_a", "f8", (2,)), ("point_b", "f8", (2,)), ("distance", "f8")],
+        align=True,
+    )
+    dtype = np.dtype(
+        [
+            ("count", "i4"),
+            ("normal", "f8", (2,)),
+            ("points", point, (2,)),
+            ("shape", "intp"),
+            ("body", "i4"),
+        ],
+        align=True,
+    )
+    assert dtype.itemsize == ffi.sizeof("cpShapeQueryHit")
+    return dtype
+
+
+def query_arrays(
+    *values: Any, name: str = "points", width: int = 2
+) -> Tuple["numpy.ndarray", ...]:
+    """
+    Broadcast arrays of query points against each other and check that they
+    have shape (n, width).
+    """
+    arrays = np.broadcast_arrays(*(np.asarray(v, dtype="f8") for v in values))
+    shape = arrays[0].shape
+    if len(shape) != 2 or shape[1] != width:
+        raise ValueError(f"{name} must have shape (n, {width}), got {shape}")
+    return tuple(np.ascontiguousarray(arr) for arr in arrays)
+
+
+def out_array(
+    out: Optional["numpy.ndarray"], shape: Tuple[int, ...], dtype: Any, name="out"
+) -> "numpy.ndarray":
+    """
+    Return out, after checking it can be filled from C, or a new empty array
+    with the given shape and dtype.
+    """
+    if out is None:
+        return np.empty(shape, dtype=dtype)
+    if not isinstance(out, np.ndarray):
+        raise TypeError(f"{name} must be a numpy array, got {type(out).__name__}")
+    if out.dtype != dtype:
+        raise TypeError(f"{name} must have dtype {dtype}, got {out.dtype}")
+    if out.shape != shape:
+        raise ValueError(f"{name} must have shape {shape}, got {out.shape}")
+    if not out.flags.c_contiguous or not out.flags.writeable:
+        raise ValueError(f"{name} must be a writeable C-contiguous array")
+    return out
+
+
+def in_array(
+    value: Any, shape: Tuple[int, ...], dtype: Any = "f8", name="value"
+) -> "numpy.ndarray":
+    """
+    Convert value to a C-contiguous array of the given shape and dtype.
+
+    Values with compatible shapes are broadcast, so a single vector can be
+    used to fill all rows of a (n, 2) array.
+    """
+    arr = np.asarray(value, dtype=dtype)
+    if arr.shape != shape:
+        try:
+            arr = np.broadcast_to(arr, shape)
+        except ValueError:
+            raise ValueError(f"{name} must have shape {shape}, got {arr.shape}")
+    return np.ascontiguousarray(arr)
+
+
+def in_buffer(value: Any, shape: Tuple[int, ...], ctype: str, name="value") -> Any:
+    """
+    Convert value with :func:`in_array` and return a C pointer to its data, or
+    NULL if value is None.
+    """
+    if value is None:
+        return ffi.NULL
+    return cffi_buffer(in_array(value, shape, name=name), ctype)
+
+
+def index_array(value: Any, size: int, name="indices") -> "numpy.ndarray":
+    """
+    Convert value to a C-contiguous array of valid indices for a sequence of
+    the given size.
+    """
+    arr = np.ascontiguousarray(value, dtype=np.intp)
+    if arr.ndim != 1:
+        raise ValueError(f"{name} must be one-dimensional, got shape {arr.shape}")
+    if len(arr) and (arr.min() < 0 or arr.max() >= size):
+        raise IndexError(f"{name} out of range for sequence of size {size}")
+    return arr
+
+
+def is_index_sequence(value: Any) -> bool:
+    """
+    Return True if value is an array or sequence of integers.
+    """
+    if isinstance(value, np.ndarray):
+        return value.dtype.kind in "iu"
+    return bool(len(value)) and all(isinstance(x, (int, np.integer)) for x in value)
+
+
+def cffi_buffer(arr: "numpy.ndarray", ctype: str) -> Any:
+    """
+    Expose the memory of a C-contiguous array as a C array of ctype.
+
+    The array must be kept alive while the returned pointer is in use.
+    """
+    return ffi.from_buffer(f"{ctype}[]", arr)
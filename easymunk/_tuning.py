@@ -0,0 +1,81 @@
+"""
+Automatic selection of the number of solver threads of threaded spaces.
+"""
+__docformat__ = "reStructuredText"
+
+from time import perf_counter
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+if TYPE_CHECKING:
+    from .space import Space
+
+
+class ThreadTuner:
+    """
+    Pick the fastest thread count for a threaded space by timing its steps.
+
+    The tuner runs a trial of trial_steps steps with each candidate thread
+    count and keeps the fastest one. Trials are repeated after interval steps
+    or when the number of bodies changes by more than the rebalance fraction
+    since the last trial.
+    """
+
+    def __init__(
+        self, candidates: List[int], trial_steps: int, interval: int, rebalance: float
+    ):
+        self.candidates = candidates
+        self.trial_steps = trial_steps
+        self.interval = interval
+        self.rebalance = rebalance
+        self.times: Dict[int, float] = {}
+        self.trial: Optional[int] = 0
+        self.remaining = trial_steps
+        self.num_bodies = 0
+
+    def run(self, space: "Space", dt: float, n: int, stats: Any) -> None:
+        """
+        Run n steps of the space, switching thread counts as required by the
+        trials.
+        """
+        while n > 0:
+            if self.trial is None and self._bodies_changed(space):
+                self._start_trials()
+
+            k = min(n, self.remaining)
+            if self.trial is None:
+                space._step_loop(dt, k, stats)
+            else:
+                threads = self.candidates[self.trial]
+                space.threads = threads
+                start = perf_counter()
+                space._step_loop(dt, k, stats)
+                elapsed = perf_counter() - start
+                self.times[threads] = self.times.get(threads, 0.0) + elapsed
+            n -= k
+            self.remaining -= k
+
+            if self.remaining == 0:
+                self._next(space)
+
+    def _bodies_changed(self, space: "Space") -> bool:
+        num_bodies = len(space._bodies)
+        return abs(num_bodies - self.num_bodies) > self.rebalance * self.num_bodies
+
+    def _start_trials(self) -> None:
+        self.times = {}
+        self.trial = 0
+        self.remaining = self.trial_steps
+
+    def _next(self, space: "Space") -> None:
+        if self.trial is None:
+            self._start_trials()
+            return
+
+        self.trial += 1
+        if self.trial < len(self.candidates):
+            self.remaining = self.trial_steps
+        else:
+            space.threads = min(self.times, key=self.times.__getitem__)
+            self.trial = None
+            self.remaining = self.interval
+            self.num_bodies = len(space._bodies)
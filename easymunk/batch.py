@@ -0,0 +1,270 @@
+"""
+Step many independent spaces together, with actions and observations
+exchanged as NumPy arrays.
+
+This is designed for reinforcement learning, where many copies of the same
+scene are simulated in lockstep.
+"""
+__docformat__ = "reStructuredText"
+
+import copy
+import os
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Iterable, List, Optional, Sequence, Union
+
+from ._arrays import body_state_dtype, cffi_buffer, in_array, out_array
+from ._chipmunk_cffi import ffi, lib
+from .space import Space
+from .util import cffi_body
+
+if TYPE_CHECKING:
+    import numpy
+
+ACTION_TYPES = ("force", "torque", "impulse", "velocity", "angular_velocity")
+
+
+def step_parallel(
+    spaces: Iterable[Space],
+    dt: float,
+    n: int = 1,
+    executor: Optional[Executor] = None,
+) -> None:
+    """Step a list of spaces n times in parallel threads.
+
+    The spaces must be distinct and must not run Python code during the step
+    (see :py:attr:`Space.native` and :py:meth:`Space.has_python_callbacks`).
+    Otherwise a ValueError is raised before any space is stepped.
+
+    >>> spaces = [mk.Space(native=True) for _ in range(4)]
+    >>> step_parallel(spaces, 0.01, 10)
+
+    Args:
+        spaces:
+            The spaces to step.
+        dt:
+            Time step length.
+        n:
+            Number of steps.
+        executor:
+            Executor that runs the steps. A temporary thread pool with one
+            thread per CPU is used if not given.
+    """
+    spaces = list(spaces)
+    if len({id(s) for s in spaces}) != len(spaces):
+        raise ValueError("spaces must be distinct")
+    for space in spaces:
+        if not space.native and space.has_python_callbacks():
+            raise ValueError("cannot step spaces with Python callbacks in parallel")
+
+    step = lambda space: space.step_many(dt, n)
+    if executor is None:
+        threads = max(1, min(len(spaces), os.cpu_count() or 1))
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(step, spaces))
+    else:
+        list(executor.map(step, spaces))
+
+
+class SpaceBatch:
+    """SpaceBatch owns a list of independent spaces and steps them together.
+
+    The batch controls the bodies in a fixed set of slots (see
+    :py:attr:`Body.slot`), which must be present in every space. Actions are
+    passed as an array with one row per space and observations are returned
+    as stacked NumPy arrays. Both are exchanged with all spaces in a single
+    call to C.
+
+    Spaces without Python callbacks (see :py:meth:`Space.has_python_callbacks`)
+    are stepped in parallel by a thread pool, since the step runs in C and
+    does not hold the GIL.
+
+    >>> template = mk.Space(gravity=(0, -10))
+    >>> body = mk.Body(1, 2, space=template)
+    >>> batch = SpaceBatch.from_template(template, 4, slots=[body.slot])
+    >>> obs = batch.step(0.1, actions=[[1, 0], [2, 0], [3, 0], [4, 0]])
+    >>> obs["velocity"][:, 0]
+    array([[ 0.1, -1. ],
+           [ 0.2, -1. ],
+           [ 0.3, -1. ],
+           [ 0.4, -1. ]])
+    >>> batch.close()
+    """
+
+    spaces: List[Space]
+    """The spaces in the batch."""
+
+    def __init__(
+        self,
+        spaces: Iterable[Space],
+        slots: Sequence[int] = (),
+        *,
+        action: str = "force",
+        threads: Optional[int] = None,
+    ):
+        """Create a batch from a sequence of spaces.
+
+        Args:
+            spaces:
+                The spaces in the batch. They must be distinct.
+            slots:
+                Slots of the controlled and observed bodies. The same slots are
+                used in every space.
+            action:
+                How actions are applied to the controlled bodies. One of
+                "force" or "impulse" (two columns per body, in world
+                coordinates), "torque" (one column per body), "velocity" (two
+                columns per body) or "angular_velocity" (one column per body,
+                in degrees per second). Forces and torques are applied before
+                each substep.
+            threads:
+                Number of threads used to step the spaces. Defaults to the
+                number of CPUs. Use 1 to step in the calling thread.
+        """
+        if action not in ACTION_TYPES:
+            raise ValueError(f"invalid action type: {action!r}")
+
+        self.spaces = list(spaces)
+        if len({id(s) for s in self.spaces}) != len(self.spaces):
+            raise ValueError("spaces must be distinct")
+        self.slots = tuple(slots)
+        self.action = action
+        self.threads = max(1, min(threads or os.cpu_count() or 1, len(self.spaces)))
+        self._initial = [s.snapshot() for s in self.spaces]
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+        # Keep the bodies alive, so their pointers stay valid even if they
+        # are removed from their spaces.
+        self._bodies = [s.body_at(i) for s in self.spaces for i in self.slots]
+        self._body_ptrs = ffi.new("cpBody *[]", [cffi_body(b) for b in self._bodies])
+
+    @classmethod
+    def from_template(cls, template: Space, n: int, **kwargs) -> "SpaceBatch":
+        """Create a batch with n copies of the template space.
+
+        Copies keep the slots of the template, so the slots of its bodies can
+        be passed as is. Accept the same keyword arguments as the constructor.
+        """
+        return cls([copy.deepcopy(template) for _ in range(n)], **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.spaces)
+
+    def __enter__(self) -> "SpaceBatch":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Shut down the thread pool."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    @property
+    def parallel(self) -> bool:
+        """True if the spaces can be stepped in parallel threads.
+
+        This is checked before each step, since Python callbacks can be added
+        to the spaces after the batch is created. The check is cheap: each
+        space remembers when a Python callback is added to it. A space is
+        stepped in the calling thread until :py:meth:`Space.has_python_callbacks`
+        is called again after its callbacks are removed.
+        """
+        return all(s.native or not s._python_callbacks for s in self.spaces)
+
+    @property
+    def action_size(self) -> int:
+        """Number of columns of the actions array."""
+        per_body = 2 if self.action in ("force", "impulse", "velocity") else 1
+        return per_body * len(self.slots)
+
+    def step(
+        self, dt: float, actions: Any = None, substeps: int = 1
+    ) -> "numpy.ndarray":
+        """Apply the actions and step all spaces.
+
+        Args:
+            dt:
+                Length of each substep.
+            actions:
+                Array of shape (len(batch), batch.action_size). If not given,
+                no actions are applied.
+            substeps:
+                Number of steps of length dt.
+
+        Returns:
+            The observations, as returned by :py:meth:`SpaceBatch.observe`.
+        """
+        if self.action in ("force", "torque") and actions is not None:
+            for _ in range(substeps):
+                self._apply(actions)
+                self._step_spaces(dt, 1)
+        else:
+            if actions is not None:
+                self._apply(actions)
+            self._step_spaces(dt, substeps)
+        return self.observe()
+
+    def observe(self, out: Optional["numpy.ndarray"] = None) -> "numpy.ndarray":
+        """Return the state of the controlled bodies of all spaces.
+
+        The result is a structured array of shape (len(batch), len(slots)) with
+        the same fields as :py:meth:`Space.get_body_states`.
+
+        Args:
+            out:
+                Optional array that receives the result.
+        """
+        n = len(self._bodies)
+        shape = (len(self.spaces), len(self.slots))
+        out = out_array(out, shape, body_state_dtype())
+        lib.cpBodyGetStates(self._body_ptrs, n, cffi_buffer(out, "cpBodyState"))
+        return out
+
+    def reset(self, indices: Union[Sequence[int], None] = None) -> None:
+        """Restore spaces to the state they had when the batch was created.
+
+        Args:
+            indices:
+                Indices of the spaces to reset. Reset all spaces if not given.
+        """
+        if indices is None:
+            indices = range(len(self.spaces))
+        for i in indices:
+            self.spaces[i].restore(self._initial[i])
+
+    def _apply(self, actions: Any) -> None:
+        n = len(self._bodies)
+        ptrs, null = self._body_ptrs, ffi.NULL
+        shape = (len(self.spaces), self.action_size)
+        arr = in_array(actions, shape, name="actions")
+        action = self.action
+        if action in ("force", "impulse", "velocity"):
+            values = cffi_buffer(arr.reshape(n, 2), "cpVect")
+        else:
+            values = cffi_buffer(arr.reshape(n), "cpFloat")
+
+        if action == "force":
+            lib.cpBodyApplyForces(ptrs, null, n, values, null, null)
+        elif action == "torque":
+            lib.cpBodyApplyForces(ptrs, null, n, null, null, values)
+        elif action == "impulse":
+            lib.cpBodyApplyImpulses(ptrs, null, n, values, null, null)
+        elif action == "velocity":
+            lib.cpBodySetStates(ptrs, null, n, null, null, values, null, False)
+        else:
+            lib.cpBodySetStates(ptrs, null, n, null, null, null, values, False)
+
+    def _step_spaces(self, dt: float, n: int) -> None:
+        if self.threads == 1 or not self.parallel:
+            for space in self.spaces:
+                space.step_many(dt, n)
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.threads)
+        k = self.threads
+        chunks = [self.spaces[i::k] for i in range(k)]
+        step = lambda chunk: [space.step_many(dt, n) for space in chunk]
+        list(self._executor.map(step, chunks))
@@ -22,8 +22,9 @@ from ._chipmunk_cffi import ffi, lib
 from ._mixins import PickleMixin, HasBBMixin
 from .arbiter import Arbiter
 from .collections import Shapes, Constraints
+from .integrators import Integrator
 from .shapes import MakeShapeMixin
-from .util import void, set_attrs, py_space, init_attributes
+from .util import void, set_attrs, py_space, init_attributes, callback_name
 from .vec2d import Vec2d, VecLike, vec2d_from_cffi
 
 if TYPE_CHECKING:
@@ -117,6 +118,7 @@ class Body(MakeShapeMixin, PickleMixin, HasBBMixin):
         "_constraints",
         "_nursery",
         "_shapes",
+        "_slot",
         "_space",
         "_position_func",
         "_position_func_base",
@@ -128,7 +130,8 @@ class Body(MakeShapeMixin, PickleMixin, HasBBMixin):
     }
     _init_kwargs = {*_pickle_args, *_pickle_kwargs[2:], "space"}
     _position_func_base: Optional[PositionFunc] = None  # For pickle
-    _velocity_func_base: Optional[VelocityFunc] = None  # For pickle
+    _velocity_func_base: Union[VelocityFunc, Integrator, None] = None  # For pickle
+    _slot: Optional[int] = None
     _id_counter = 1
 
     #
@@ -312,6 +315,11 @@ class Body(MakeShapeMixin, PickleMixin, HasBBMixin):
         ...
         >>> body.velocity_func = limit_velocity
 
+        The common cases above can also use the integrators from
+        :py:mod:`easymunk.integrators`, which run in C and avoid calling
+        Python for each body on every step:
+
+        >>> body.velocity_func = mk.integrators.clamp(max_speed=1000)
         """,
     )
     position_func: Callable[["Body", float], None]
@@ -340,6 +348,19 @@ class Body(MakeShapeMixin, PickleMixin, HasBBMixin):
         else:
             return None
 
+    @property
+    def slot(self) -> Optional[int]:
+        """Index of the body in the slot table of its space (or None).
+
+        Each body added to a space receives a small integer slot that indexes
+        the rows of the arrays used by the batch APIs, such as
+        :py:meth:`Space.get_body_states`. Slots freed by removed bodies are
+        reused by the next bodies added to the space. Otherwise, slots only
+        change when :py:meth:`Space.compact_slots` is called. Copies and
+        pickles of a space keep the slots of its bodies, including holes.
+        """
+        return self._slot
+
     @sk.lazy
     def constraints(self) -> Constraints:
         """Get the constraints this body is attached to.
@@ -504,13 +525,12 @@ class Body(MakeShapeMixin, PickleMixin, HasBBMixin):
 
         body_type = BODY_TYPES.get(body_type, body_type)
         if body_type == Body.DYNAMIC:
-            self._cffi_ref = ffi.gc(lib.cpBodyNew(mass, moment), cffi_free_body)
-        elif body_type == Body.KINEMATIC:
-            self._cffi_ref = ffi.gc(lib.cpBodyNewKinematic(), cffi_free_body)
-        elif body_type == Body.STATIC:
-            self._cffi_ref = ffi.gc(lib.cpBodyNewStatic(), cffi_free_body)
+            cp_body = lib.cpBodyExNew(mass, moment, body_type)
+        elif body_type in (Body.KINEMATIC, Body.STATIC):
+            cp_body = lib.cpBodyExNew(0, 0, body_type)
         else:
             raise ValueError(f"invalid body type: {body_type!r}")
+        self._cffi_ref = ffi.gc(cp_body, cffi_free_body)
 
         # To prevent the gc to collect the callbacks.
         self._position_func = None
@@ -538,7 +558,7 @@ class Body(MakeShapeMixin, PickleMixin, HasBBMixin):
 
         if self._position_func is not None:
             meta["position_func"] = self._position_func_base
-        if self._velocity_func is not None:
+        if self._velocity_func_base is not None:
             meta["velocity_func"] = self._velocity_func_base
 
         meta["$shapes"] = {s.copy() for s in list(self._shapes)}
@@ -577,20 +597,45 @@ class Body(MakeShapeMixin, PickleMixin, HasBBMixin):
             self.space.add(shape)
         return shape
 
-    def _set_velocity_func(self, func: VelocityFunc) -> None:
+    def _set_velocity_func(self, func: Union[VelocityFunc, Integrator]) -> None:
+        if isinstance(func, Integrator):
+            self._velocity_func_base = func
+            self._velocity_func = None
+            lib.cpBodySetIntegrator(self._cffi_ref, func._to_cffi())
+            return
+        if self._space is not None:
+            self._space._check_native("Python velocity functions")
+
         @ffi.callback("cpBodyVelocityFunc")
         def _impl(_: ffi.CData, gravity: ffi.CData, damping: float, dt: float) -> None:
-            func(self, Vec2d(gravity.x, gravity.y), damping, dt)
+            space = self._space
+            gravity = Vec2d(gravity.x, gravity.y)
+            if space is None or space._timings is None:
+                func(self, gravity, damping, dt)
+            else:
+                args = (self, gravity, damping, dt)
+                space._timed_call("body_callbacks", "velocity_func", name, func, *args)
 
+        name = callback_name(func)
         self._velocity_func_base = func
         self._velocity_func = _impl
         lib.cpBodySetVelocityUpdateFunc(self._cffi_ref, _impl)
 
     def _set_position_func(self, func: Callable[["Body", float], None]) -> None:
+        if self._space is not None:
+            self._space._check_native("Python position functions")
+
         @ffi.callback("cpBodyPositionFunc")
         def _impl(_: ffi.CData, dt: float) -> None:
-            return func(self, dt)
+            space = self._space
+            if space is None or space._timings is None:
+                func(self, dt)
+            else:
+                space._timed_call(
+                    "body_callbacks", "position_func", name, func, self, dt
+                )
 
+        name = callback_name(func)
         self._position_func_base = func
         self._position_func = _impl
         lib.cpBodySetPositionUpdateFunc(self._cffi_ref, _impl)
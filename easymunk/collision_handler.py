@@ -4,15 +4,27 @@ __docformat__ = "reStructuredText"
 import functools
 import warnings
 from types import MappingProxyType
-from typing import TYPE_CHECKING, Any, Callable, Dict, Optional
+from math import nan
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    NamedTuple,
+    Optional,
+    Tuple,
+)
 
 import sidekick.api as sk
 
-from ._chipmunk_cffi import ffi
+from ._chipmunk_cffi import ffi, lib
 from .arbiter import Arbiter
 from .util import void
+from .vec2d import VecLike
 
 if TYPE_CHECKING:
+    import easymunk as mk  # noqa: F401
     from .space import Space
 
 BoolCB = Callable[[Arbiter, "Space", Any], bool]
@@ -24,6 +36,7 @@ CFFI_REF_ATTR = {
     "post_solve": "postSolveFunc",
     "separate": "separateFunc",
 }
+COLLISION_EVENTS = ("begin", "post_solve", "separate")
 CFFI_FUNC_TYPE = {
     "begin": "cpCollisionBeginFunc",
     "pre_solve": "cpCollisionPreSolveFunc",
@@ -32,6 +45,45 @@ CFFI_FUNC_TYPE = {
 }
 
 
+class CollisionRule(NamedTuple):
+    """A collision rule evaluated in C, see :py:attr:`CollisionHandler.rule`."""
+
+    ignore: bool = False
+    """Ignore the collision entirely, as a begin callback returning False."""
+
+    sensor: bool = False
+    """Detect the contact but skip the collision response."""
+
+    friction: Optional[float] = None
+    """Friction of the arbiter. Keep the value computed from the shapes if
+    None."""
+
+    elasticity: Optional[float] = None
+    """Elasticity of the arbiter. Keep the value computed from the shapes if
+    None."""
+
+    surface_velocity: Optional[VecLike] = None
+    """Surface velocity of the arbiter. Keep the value computed from the
+    shapes if None."""
+
+    @property
+    def events(self) -> Tuple[str, ...]:
+        """Callbacks of the handler replaced by the rule."""
+        return ("begin",) if self.ignore else ("pre_solve",)
+
+    def _to_cffi(self) -> Any:
+        vx, vy = (nan, nan) if self.surface_velocity is None else self.surface_velocity
+        return ffi.new(
+            "cpCollisionRule *",
+            {
+                "friction": nan if self.friction is None else self.friction,
+                "elasticity": nan if self.elasticity is None else self.elasticity,
+                "surface_velocity": (vx, vy),
+                "sensor": self.sensor,
+            },
+        )
+
+
 def always_collide(arb, space, data):
     return True
 
@@ -128,15 +180,19 @@ class CollisionHandler:
         """,
     )
 
-    def __init__(self, _handler: Any, space: "Space") -> None:
+    def __init__(self, _handler: Any, space: "Space", key: Any = None) -> None:
         """Initialize a CollisionHandler object from the Chipmunk equivalent
         struct and the Space.
 
+        The key is the pair of collision types, a single collision type for
+        wildcard handlers or None for the default handler.
+
         .. note::
             You should never need to create an instance of this class directly.
         """
         self._cffi_ref = _handler
         self._space = space
+        self._key = key
         self._begin = None
         self._begin_base: Optional[BoolCB] = None  # For pickle
         self._pre_solve = None
@@ -145,18 +201,115 @@ class CollisionHandler:
         self._post_solve_base: Optional[NullCB] = None  # For pickle
         self._separate = None
         self._separate_base: Optional[NullCB] = None  # For pickle
+        self._recorded_events: Tuple[str, ...] = ()
+        self._rule: Optional[CollisionRule] = None
+        self._rule_ref: Any = None
         self._data: Dict[Any, Any] = {}
 
     def as_dict(self) -> Dict[str, callable]:
         """
         Return handler state as a dictionary
         """
-        return {
+        data: Dict[str, Any] = {
             "begin": self.begin,
             "pre_solve": self.pre_solve,
             "post_solve": self.post_solve,
             "separate": self.separate,
         }
+        if self._recorded_events:
+            for name in self._recorded_events:
+                del data[name]
+            data["recorded_events"] = self._recorded_events
+        if self._rule is not None:
+            for name in self._rule.events:
+                data.pop(name, None)
+            data["rule"] = self._rule
+        return data
+
+    @property
+    def recorded_events(self) -> Tuple[str, ...]:
+        """Events recorded in C instead of calling Python.
+
+        Any of "begin", "post_solve" and "separate". Recorded events replace
+        the Python callbacks of the handler: collisions are always accepted
+        and each event is appended to a buffer in the space, which is read
+        with :py:meth:`Space.drain_collision_events`. Handlers for a pair of
+        collision types and the default handler still call the wildcard
+        handlers.
+
+        Events removed from the set get the default callbacks of the handler
+        back, and setting a callback stops recording its event.
+
+        >>> space = mk.Space()
+        >>> handler = space.collision_handler(1, 2)
+        >>> handler.recorded_events = ("begin", "separate")
+        """
+        return self._recorded_events
+
+    @recorded_events.setter
+    def recorded_events(self, events: Iterable[str]) -> None:
+        events = tuple(events)
+        invalid = set(events).difference(COLLISION_EVENTS)
+        if invalid:
+            raise ValueError(f"invalid collision events: {sorted(invalid)}")
+
+        self._restore_defaults(e for e in self._recorded_events if e not in events)
+        space = self._space._cffi_ref
+        lib.cpSpaceEnableCollisionEvents(space)
+        flags = [name in events for name in COLLISION_EVENTS]
+        wildcard = isinstance(self._key, int)
+        lib.cpCollisionHandlerRecordEvents(self._cffi_ref, *flags, wildcard)
+        for name in events:
+            setattr(self, f"_{name}_base", None)
+            setattr(self, f"_{name}", None)
+        self._recorded_events = tuple(e for e in COLLISION_EVENTS if e in events)
+        if self._rule is not None and set(self._rule.events).intersection(events):
+            self._rule = None
+            self._rule_ref = None
+
+    @property
+    def rule(self) -> Optional[CollisionRule]:
+        """Collision rule evaluated in C instead of calling Python.
+
+        Rules cover the common uses of the begin and pre_solve callbacks
+        without leaving C: ignoring collisions, turning them into sensor
+        contacts and overriding the friction, elasticity or surface velocity
+        of the arbiter. Rules that ignore collisions replace the begin
+        callback, the others replace pre_solve. Handlers for a pair of
+        collision types and the default handler still call the wildcard
+        handlers. Unlike Python callbacks, rules can be used in native spaces.
+
+        Set the rule to None to get the default callbacks of the handler
+        back. Setting the replaced callback also removes the rule.
+
+        >>> space = mk.Space()
+        >>> handler = space.collision_handler(1, 2)
+        >>> handler.rule = CollisionRule(friction=0.0, elasticity=1.0)
+        """
+        return self._rule
+
+    @rule.setter
+    def rule(self, rule: Optional[CollisionRule]) -> None:
+        old, self._rule = self._rule, None
+        events = () if rule is None else rule.events
+        if old is not None:
+            self._restore_defaults(e for e in old.events if e not in events)
+            self._cffi_ref.userData = ffi.NULL
+            self._rule_ref = None
+        if rule is None:
+            return
+
+        if self._recorded_events:
+            recorded = self._recorded_events
+            self._recorded_events = tuple(e for e in recorded if e not in events)
+        ref = rule._to_cffi()
+        wildcard = isinstance(self._key, int)
+        lib.cpCollisionHandlerSetRule(self._cffi_ref, ref, rule.ignore, wildcard)
+        for name in events:
+            setattr(self, f"_{name}_base", None)
+            setattr(self, f"_{name}", None)
+        self._rule = rule
+        self._rule_ref = ref
 
     def update(self, data=MappingProxyType({}), **kwargs) -> None:
         """
@@ -165,25 +318,63 @@ class CollisionHandler:
         for k, v in {**data, **kwargs}.items():
             setattr(self, k, v)
 
+    def has_callbacks(self) -> bool:
+        """
+        Return True if any callback is installed, even if reset to None.
+        """
+        return any(getattr(self, f"_{name}") is not None for name in CFFI_REF_ATTR)
+
     def _reset(self) -> None:
         self.begin = always_collide
         self.pre_solve = always_collide
         self.post_solve = do_nothing
         self.separate = do_nothing
 
+    def _restore_defaults(self, names: Iterable[str]) -> None:
+        """Restore the default C callbacks of the given events.
+
+        Unlike setting the callbacks to None, this works in native spaces.
+        """
+        names = set(names)
+        if not names:
+            return
+        flags = [name in names for name in CFFI_REF_ATTR]
+        wildcard = isinstance(self._key, int)
+        lib.cpCollisionHandlerResetFuncs(self._cffi_ref, *flags, wildcard)
+        for name in names:
+            setattr(self, f"_{name}_base", None)
+            setattr(self, f"_{name}", None)
+
     def _set_cb(self, name, factory, func) -> None:
+        self._space._check_native("Python collision callbacks")
         attr = CFFI_REF_ATTR[name]
         cb_type = CFFI_FUNC_TYPE[name]
-        cf = functools.partial(factory, func or always_collide)
+        cf = functools.partial(factory, name, func or always_collide)
         ptr = ffi.callback(cb_type)(cf)
 
         setattr(self, f"_{name}_base", func)
         setattr(self, f"_{name}", ptr)
         setattr(self._cffi_ref, attr, ptr)
+        if name in self._recorded_events:
+            events = self._recorded_events
+            self._recorded_events = tuple(e for e in events if e != name)
+        if self._rule is not None and name in self._rule.events:
+            self._rule = None
+            self._rule_ref = None
+
+    def _call(self, name: str, func: Callable, arb: Arbiter) -> Any:
+        space = self._space
+        if space._timings is None:
+            return func(arb, space, self._data)
+        return space._timed_call(
+            "collision_callbacks", name, self._key, func, arb, space, self._data
+        )
 
-    def _bool_cb(self, func: BoolCB, ptr: Ptr, space: Ptr, data: Ptr) -> bool:
+    def _bool_cb(
+        self, name: str, func: BoolCB, ptr: Ptr, space: Ptr, data: Ptr
+    ) -> bool:
         arb = Arbiter(ptr, self._space)
-        out = func(arb, self._space, self._data)
+        out = self._call(name, func, arb)
 
         if isinstance(out, bool):
             return out
@@ -202,14 +393,18 @@ class CollisionHandler:
         warnings.warn_explicit(msg, UserWarning, filename, lineno, module)
         return True
 
-    def _null_cb(self, func: NullCB, ptr: Ptr, space: Ptr, data: Ptr) -> None:
+    def _null_cb(
+        self, name: str, func: NullCB, ptr: Ptr, space: Ptr, data: Ptr
+    ) -> None:
         arb = Arbiter(ptr, self._space)
-        func(arb, self._space, self._data)
+        self._call(name, func, arb)
 
-    def _locked_cb(self, func: NullCB, ptr: Ptr, space: Ptr, data: Ptr) -> None:
+    def _locked_cb(
+        self, name: str, func: NullCB, ptr: Ptr, space: Ptr, data: Ptr
+    ) -> None:
         # this try is needed since a separate callback will be called
         # if a colliding object is removed, regardless if its in a
         # step or not.
         with self._space.locked():
             arb = Arbiter(ptr, self._space)
-            func(arb, self._space, self._data)
+            self._call(name, func, arb)
@@ -67,11 +67,19 @@ __all__ = [
 ]
 
 import logging
+from math import inf
 from typing import TYPE_CHECKING, Any, Callable, Optional, TypeVar
 
 from ._chipmunk_cffi import ffi, lib
 from ._mixins import PickleMixin
-from .util import void, inner_constraints, cffi_body, init_attributes, cp_property
+from .util import (
+    void,
+    inner_constraints,
+    cffi_body,
+    init_attributes,
+    cp_property,
+    callback_name,
+)
 from .vec2d import Vec2d, VecLike, vec2d_from_cffi
 
 if TYPE_CHECKING:
@@ -111,10 +119,19 @@ class Constraint(PickleMixin):
     """
 
     _pickle_args = "a", "b"
-    _pickle_kwargs = "max_force", "error_bias", "max_bias", "collide_bodies"
+    _pickle_kwargs = (
+        "max_force",
+        "error_bias",
+        "max_bias",
+        "collide_bodies",
+        "max_impulse",
+        "break_force",
+    )
     _pickle_meta_hide = {
         "_a",
         "_b",
+        "_break_handle",
+        "_break_ref",
         "_cffi_ref",
         "_cffi_backend",
         "_nursery",
@@ -128,6 +145,8 @@ class Constraint(PickleMixin):
     _post_solve_func: Optional[Callable[["Constraint", "Space"], None]] = None
     _cp_pre_solve_func: Any = ffi.NULL
     _cp_post_solve_func: Any = ffi.NULL
+    _break_ref: Any = None
+    _break_handle: Any = None
 
     max_force: float
     max_force = constraint_property(  # type: ignore
@@ -183,6 +202,61 @@ class Constraint(PickleMixin):
         """
         return lib.cpConstraintGetImpulse(self._cffi_ref)
 
+    @property
+    def max_impulse(self) -> float:
+        """The constraint breaks when the impulse it applies in a step
+        exceeds this value.
+
+        Broken constraints are removed from the space at the end of the step,
+        without calling Python, and are reported by
+        :py:meth:`Space.drain_broken_constraints`. Defaults to infinity, i.e.,
+        unbreakable.
+
+        >>> s = mk.Space(gravity=(0, -10))
+        >>> a, b = s.static_body, mk.Body(1, 1, space=s)
+        >>> joint = mk.PivotJoint(a, b, (0, 0))
+        >>> joint.max_impulse = 0.5
+        >>> _ = s.add(joint).step(0.1)
+        >>> s.drain_broken_constraints() == [joint]
+        True
+        """
+        return inf if self._break_ref is None else self._break_ref.max_impulse
+
+    @max_impulse.setter
+    def max_impulse(self, value: float) -> None:
+        self._set_break_limits(value, self.break_force)
+
+    @property
+    def break_force(self) -> float:
+        """The constraint breaks when the force it applies exceeds this value.
+
+        The force is the impulse divided by the time step. See
+        :py:attr:`Constraint.max_impulse`. Defaults to infinity.
+        """
+        return inf if self._break_ref is None else self._break_ref.break_force
+
+    @break_force.setter
+    def break_force(self, value: float) -> None:
+        self._set_break_limits(self.max_impulse, value)
+
+    def _set_break_limits(self, max_impulse: float, break_force: float) -> None:
+        if max_impulse == inf and break_force == inf:
+            self._break_ref = None
+            self._break_handle = None
+        else:
+            if self._break_handle is None:
+                self._break_handle = ffi.new_handle(self)
+            self._break_ref = ffi.new(
+                "cpConstraintBreak *",
+                {
+                    "max_impulse": max_impulse,
+                    "break_force": break_force,
+                    "handle": self._break_handle,
+                },
+            )
+        limits = ffi.NULL if self._break_ref is None else self._break_ref
+        lib.cpConstraintSetBreak(self._cffi_ref, limits, self._cp_post_solve_func)
+
     @property
     def a(self) -> "Body":
         """The first of the two bodies constrained"""
@@ -203,17 +277,26 @@ class Constraint(PickleMixin):
 
     @pre_solve.setter
     def pre_solve(self, func: Optional[SolveFunc]):
+        if func is not None:
+            self._check_native()
         self._pre_solve_func = func
 
         if func is not None:
 
             @ffi.callback("cpConstraintPreSolveFunc")
             def _impl(_constraint, _space) -> None:
-                if self.a.space is None:
+                space = self.a.space
+                if space is None:
                     raise ValueError("body a is not attached to any space")
-                fn(self, self.a.space)
+                if space._timings is None:
+                    fn(self, space)
+                else:
+                    kind = "constraint_pre_solve"
+                    category = "constraint_callbacks"
+                    space._timed_call(category, kind, name, fn, self, space)
 
             fn = func
+            name = callback_name(func)
             self._cp_pre_solve_func = _impl
         else:
             self._cp_pre_solve_func = ffi.NULL
@@ -230,21 +313,38 @@ class Constraint(PickleMixin):
 
     @post_solve.setter
     def post_solve(self, func: Optional[SolveFunc]) -> None:
+        if func is not None:
+            self._check_native()
         self._post_solve_func = func
         if func is not None:
 
             @ffi.callback("cpConstraintPostSolveFunc")
             def _impl(_constraint, _space) -> None:
-                if self.a.space is None:
+                space = self.a.space
+                if space is None:
                     raise ValueError("body a is not attached to any space")
-                fn(self, self.a.space)
+                if space._timings is None:
+                    fn(self, space)
+                else:
+                    kind = "constraint_post_solve"
+                    category = "constraint_callbacks"
+                    space._timed_call(category, kind, name, fn, self, space)
 
             fn = func
+            name = callback_name(func)
             self._cp_post_solve_func = _impl
         else:
             self._cp_post_solve_func = ffi.NULL
 
-        lib.cpConstraintSetPostSolveFunc(self._cffi_ref, self._cp_post_solve_func)
+        if self._break_ref is None:
+            lib.cpConstraintSetPostSolveFunc(self._cffi_ref, self._cp_post_solve_func)
+        else:
+            self._break_ref.post_solve = self._cp_post_solve_func
+
+    def _check_native(self) -> None:
+        space = self.a.space
+        if space is not None and self in space._constraints:
+            space._check_native("Python solve functions")
 
     def __init__(self, a: "Body", b: "Body", _constraint: Any, **kwargs) -> None:
         if a is b:
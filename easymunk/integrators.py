@@ -0,0 +1,164 @@
+"""
+Velocity integrators that run in C, without calling Python for each body.
+
+Assign them to :py:attr:`easymunk.Body.velocity_func` in place of a Python
+function:
+
+>>> space = mk.Space(gravity=(0, -10))
+>>> body = mk.Body(1, 2, space=space)
+>>> body.velocity_func = clamp(max_speed=5)
+>>> _ = space.step_many(0.1, 100)
+>>> round(body.velocity.y, 6)
+-5.0
+
+Each integrator first updates the velocity as
+:py:meth:`easymunk.Body.update_velocity` does, with gravity multiplied by
+gravity_scale. Then drag is applied and the linear and angular speeds are
+clamped. The helpers below set some of the parameters of
+:py:class:`Integrator`, use its constructor or ``_replace()`` to combine them:
+
+>>> body.velocity_func = drag(linear=0.5)._replace(gravity_scale=0)
+"""
+__docformat__ = "reStructuredText"
+
+from math import inf, radians
+from typing import TYPE_CHECKING, Any, Callable, NamedTuple, Sequence, Tuple
+
+from ._arrays import cffi_buffer, np
+from ._chipmunk_cffi import ffi, lib
+from .util import callback_name, cffi_body
+from .vec2d import Vec2d
+
+if TYPE_CHECKING:
+    import easymunk as mk  # noqa: F401
+    import numpy
+    from .body import Body
+    from .space import Space
+
+__all__ = [
+    "Integrator",
+    "VelocityHook",
+    "zero_gravity",
+    "gravity_scale",
+    "drag",
+    "clamp",
+]
+
+HookFunc = Callable[..., Any]
+
+
+class Integrator(NamedTuple):
+    """Parameters of a native velocity integrator."""
+
+    gravity_scale: float = 1.0
+    """Factor applied to the gravity of the space."""
+
+    linear_drag: float = 0.0
+    """Deceleration proportional to the velocity, per second."""
+
+    quadratic_drag: float = 0.0
+    """Deceleration proportional to the square of the speed."""
+
+    angular_drag: float = 0.0
+    """Deceleration proportional to the angular velocity, per second."""
+
+    max_speed: float = inf
+    """Largest speed of the body."""
+
+    max_angular: float = inf
+    """Largest angular speed of the body, in degrees per second."""
+
+    def _to_cffi(self) -> Any:
+        values = self._asdict()
+        values["max_angular"] = radians(self.max_angular)
+        return ffi.new("cpBodyIntegrator *", values)
+
+
+def zero_gravity() -> Integrator:
+    """Ignore the gravity of the space."""
+    return Integrator(gravity_scale=0.0)
+
+
+def gravity_scale(scale: float) -> Integrator:
+    """Multiply the gravity of the space by scale."""
+    return Integrator(gravity_scale=scale)
+
+
+def drag(
+    linear: float = 0.0, quadratic: float = 0.0, angular: float = 0.0
+) -> Integrator:
+    """Slow the body down with linear and quadratic drag.
+
+    The drag is integrated implicitly, so it never reverses the velocity,
+    even for large coefficients.
+    """
+    return Integrator(
+        linear_drag=linear, quadratic_drag=quadratic, angular_drag=angular
+    )
+
+
+def clamp(max_speed: float = inf, max_angular: float = inf) -> Integrator:
+    """Limit the speed and the angular speed (in degrees per second)."""
+    return Integrator(max_speed=max_speed, max_angular=max_angular)
+
+
+class VelocityHook:
+    """VelocityHook updates the velocities of a group of bodies with a single
+    Python call per step.
+
+    Create hooks with :py:meth:`easymunk.Space.add_velocity_hook`.
+    """
+
+    def __init__(self, space: "Space", bodies: Sequence["Body"], func: HookFunc):
+        self.space = space
+        self.func = func
+
+        @ffi.callback("cpVelocityHookFunc")
+        def _impl(_: Any, gravity: Any, damping: float, dt: float) -> None:
+            args = (
+                self.velocities,
+                self.positions,
+                self.masses,
+                Vec2d(gravity.x, gravity.y),
+                damping,
+                dt,
+            )
+            if space._timings is None:
+                result = func(*args)
+            else:
+                result = space._timed_call(
+                    "body_callbacks", "velocity_hook", name, func, *args
+                )
+            if result is not None and result is not self.velocities:
+                self.velocities[:] = result
+
+        name = callback_name(func)
+        self._impl = _impl
+        self._cffi_ref = ffi.new("cpVelocityHook *", {"func": _impl})
+        self._set_bodies(bodies)
+
+    def _set_bodies(self, bodies: Sequence["Body"]) -> None:
+        n = len(bodies)
+        self.bodies: Tuple["Body", ...] = tuple(bodies)
+        self.velocities: "numpy.ndarray" = np.zeros((n, 2))
+        self.positions: "numpy.ndarray" = np.zeros((n, 2))
+        self.masses: "numpy.ndarray" = np.zeros(n)
+        self._bodies_ptr = ffi.new("cpBody *[]", [cffi_body(b) for b in bodies])
+        self._cffi_ref.bodies = self._bodies_ptr
+        self._cffi_ref.count = n
+        self._cffi_ref.velocities = cffi_buffer(self.velocities, "cpVect")
+        self._cffi_ref.positions = cffi_buffer(self.positions, "cpVect")
+        self._cffi_ref.masses = cffi_buffer(self.masses, "cpFloat")
+
+    def _attach(self) -> None:
+        for body in self.bodies:
+            lib.cpBodySetVelocityHook(cffi_body(body), self._cffi_ref)
+
+    def _detach(self) -> None:
+        for body in self.bodies:
+            lib.cpBodySetVelocityHook(cffi_body(body), ffi.NULL)
+
+    def _discard(self, body: "Body") -> None:
+        """Remove body from the hook and restore its velocity function."""
+        lib.cpBodySetVelocityHook(cffi_body(body), ffi.NULL)
+        self._set_bodies([b for b in self.bodies if b is not body])
@@ -0,0 +1,287 @@
+"""
+Simulate many independent spaces in a pool of worker processes.
+
+Body states are published in shared memory, so the parent reads them as
+NumPy arrays without copying.
+"""
+__docformat__ = "reStructuredText"
+
+import multiprocessing
+import os
+import pickle
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from typing import TYPE_CHECKING, Any, Callable, List, Optional, Sequence, Tuple
+
+from ._arrays import body_state_dtype, cffi_buffer, np
+from ._chipmunk_cffi import ffi, lib
+from .space import Space
+from .util import cffi_body
+
+if TYPE_CHECKING:
+    import numpy
+
+
+class SpacePool:
+    """SpacePool runs a list of spaces in a pool of worker processes.
+
+    Each worker owns a contiguous shard of the spaces and receives commands
+    from the parent over a pipe. Spaces are shipped to the workers with
+    pickle, so their collision handlers, body functions and constraint
+    functions must be picklable (e.g. functions defined at module level).
+    Pickling keeps the slot table of each space, so bodies have the same
+    slots in the workers.
+
+    After each step, the workers write the states of the bodies in a fixed
+    set of slots into a ring of frames in shared memory. The parent gets
+    NumPy views of these frames, without copying. A frame is overwritten
+    after depth further steps, copy it if it must be kept longer.
+
+    Use this class when the spaces run Python callbacks. Otherwise,
+    :py:class:`SpaceBatch` steps them in threads with less overhead.
+
+    >>> template = mk.Space(gravity=(0, -10))
+    >>> body = mk.Body(1, 2, space=template)
+    >>> with SpacePool([template] * 4, slots=[body.slot], processes=2) as pool:
+    ...     obs = pool.step(0.1, 10)
+    ...     obs["velocity"][:, 0]
+    array([[  0., -10.],
+           [  0., -10.],
+           [  0., -10.],
+           [  0., -10.]])
+    """
+
+    def __init__(
+        self,
+        spaces: Sequence[Space],
+        slots: Optional[Sequence[int]] = None,
+        *,
+        processes: Optional[int] = None,
+        depth: int = 2,
+        context: Optional[str] = None,
+    ):
+        """Start the workers and send them the spaces.
+
+        Args:
+            spaces:
+                The spaces simulated by the pool. Each worker receives a
+                copy, the spaces in the parent process are not modified.
+            slots:
+                Slots of the bodies whose states are published after each
+                step. The same slots are used in every space. Defaults to
+                the occupied slots of the first space.
+            processes:
+                Number of worker processes. Defaults to the number of CPUs.
+            depth:
+                Number of frames in the shared memory ring.
+            context:
+                Start method of the workers ("fork", "spawn" or
+                "forkserver"). Uses the default of multiprocessing if not
+                given.
+        """
+        if depth < 1:
+            raise ValueError("depth must be at least 1")
+        if slots is None:
+            slots = [i for i, b in enumerate(spaces[0]._slots) if b] if spaces else ()
+
+        self.slots = tuple(slots)
+        self.depth = depth
+        self.frame = -1
+        self._size = len(spaces)
+
+        ctx = multiprocessing.get_context(context)
+        shape = (depth, len(spaces), len(self.slots))
+        nbytes = max(1, int(np.prod(shape)) * body_state_dtype().itemsize)
+        self._ring = ctx.RawArray("b", nbytes)
+        self._frames = np.frombuffer(self._ring, dtype=body_state_dtype())
+        self._frames = self._frames[: int(np.prod(shape))].reshape(shape)
+
+        n = max(1, min(processes or os.cpu_count() or 1, len(spaces)))
+        bounds = [len(spaces) * i // n for i in range(n + 1)]
+        self._shards = list(zip(bounds[:-1], bounds[1:]))
+        self._conns: List[Connection] = []
+        self._workers: List[BaseProcess] = []
+        self._pending = False
+        try:
+            self._start(ctx, spaces, shape)
+            self._collect()
+        except BaseException:
+            self.close()
+            raise
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __enter__(self) -> "SpacePool":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Stop the workers.
+
+        Arrays returned by the pool remain valid after the pool is closed.
+        """
+        if not self._conns:
+            return
+        if self._pending:
+            self.wait()
+        for conn in self._conns:
+            try:
+                conn.send(("close",))
+            except OSError:
+                pass  # The worker already exited.
+            conn.close()
+        for worker in self._workers:
+            worker.join()
+        self._conns = []
+        self._workers = []
+
+    def step(self, dt: float, n: int = 1) -> "numpy.ndarray":
+        """Step all spaces n times and return the new body states.
+
+        The result is a view of shape (len(pool), len(slots)) into the shared
+        memory ring, with the same fields as :py:meth:`Space.get_body_states`.
+        """
+        self.step_async(dt, n)
+        return self.wait()
+
+    def step_async(self, dt: float, n: int = 1) -> None:
+        """Start stepping all spaces n times and return immediately.
+
+        Call :py:meth:`SpacePool.wait` to get the result. No other command
+        can be sent to the pool in between.
+        """
+        self._check_ready()
+        frame = (self.frame + 1) % self.depth
+        for conn in self._conns:
+            conn.send(("step", dt, n, frame))
+        self._pending = True
+        self.frame = frame
+
+    def wait(self) -> "numpy.ndarray":
+        """Wait for the step started by :py:meth:`SpacePool.step_async`.
+
+        Return the body states, as in :py:meth:`SpacePool.step`.
+        """
+        if not self._pending:
+            raise RuntimeError("no step in progress")
+        self._pending = False
+        self._collect()
+        return self.observe()
+
+    def observe(self) -> "numpy.ndarray":
+        """Return the body states published by the last step.
+
+        Before the first step, the states are filled with zeros.
+        """
+        return self._frames[max(self.frame, 0)]
+
+    def call(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> List[Any]:
+        """Call func(space, *args, **kwargs) for each space in its worker.
+
+        This can be used to change the spaces, e.g., to apply forces or
+        install callbacks. The function, its arguments and its results are
+        sent with pickle. Return the list of results in the order of the
+        spaces.
+        """
+        self._check_ready()
+        for conn in self._conns:
+            conn.send(("call", func, args, kwargs))
+        return [x for shard in self._collect() for x in shard]
+
+    def reset(self, indices: Optional[Sequence[int]] = None) -> None:
+        """Restore spaces to the state they had when the pool was created.
+
+        Args:
+            indices:
+                Indices of the spaces to reset. Reset all spaces if not given.
+        """
+        self._check_ready()
+        selected = set(range(self._size) if indices is None else indices)
+        for conn, (start, stop) in zip(self._conns, self._shards):
+            local = [i - start for i in range(start, stop) if i in selected]
+            conn.send(("reset", local))
+        self._collect()
+
+    def _start(
+        self, ctx: Any, spaces: Sequence[Space], shape: Tuple[int, ...]
+    ) -> None:
+        for start, stop in self._shards:
+            parent_conn, child_conn = ctx.Pipe()
+            self._conns.append(parent_conn)
+            try:
+                data = [pickle.dumps(space) for space in spaces[start:stop]]
+                args = (child_conn, data, self._ring, shape, start, self.slots)
+                worker = ctx.Process(target=_worker, args=args, daemon=True)
+                worker.start()
+            finally:
+                child_conn.close()
+            self._workers.append(worker)
+
+    def _check_ready(self) -> None:
+        if not self._workers:
+            raise RuntimeError("the pool is closed")
+        if self._pending:
+            raise RuntimeError("a step is in progress, call wait() first")
+
+    def _collect(self) -> List[Any]:
+        results = [conn.recv() for conn in self._conns]
+        for ok, value in results:
+            if not ok:
+                raise value
+        return [value for _, value in results]
+
+
+class _Worker:
+    """The spaces of a worker process and the commands it runs."""
+
+    def __init__(self, data, ring, shape, start, slots) -> None:
+        self.spaces: List[Space] = [pickle.loads(blob) for blob in data]
+        self.initial = [s.snapshot() for s in self.spaces]
+        self.bodies = [s.body_at(i) for s in self.spaces for i in slots]
+        self.ptrs = ffi.new("cpBody *[]", [cffi_body(b) for b in self.bodies])
+        frames = np.frombuffer(ring, dtype=body_state_dtype())
+        frames = frames[: int(np.prod(shape))].reshape(shape)
+        stop = start + len(self.spaces)
+        self.frames = frames[:, start:stop]
+
+    def step(self, dt: float, n: int, frame: int) -> None:
+        for space in self.spaces:
+            space.step_many(dt, n)
+        if self.bodies:
+            out = cffi_buffer(self.frames[frame], "cpBodyState")
+            lib.cpBodyGetStates(self.ptrs, len(self.bodies), out)
+
+    def call(self, func: Callable[..., Any], args: tuple, kwargs: dict) -> List[Any]:
+        return [func(space, *args, **kwargs) for space in self.spaces]
+
+    def reset(self, indices: Sequence[int]) -> None:
+        for i in indices:
+            self.spaces[i].restore(self.initial[i])
+
+
+def _worker(conn, *args) -> None:
+    try:
+        worker = _Worker(*args)
+    except Exception as ex:
+        conn.send((False, ex))
+        conn.close()
+        return
+    conn.send((True, None))
+
+    while True:
+        try:
+            cmd, *args = conn.recv()
+        except EOFError:
+            break
+        if cmd == "close":
+            break
+        try:
+            result = getattr(worker, cmd)(*args)
+        except Exception as ex:
+            conn.send((False, ex))
+        else:
+            conn.send((True, result))
+    conn.close()
@@ -1488,7 +1488,10 @@ if platform.system() != "Windows":
         void cpHastySpaceStep(cpSpace *space, cpFloat dt);
     """
     )
-    hasty_space_include = """#include "chipmunk/cpHastySpace.h" """
+    hasty_space_include = """
+        #include "chipmunk/cpHastySpace.h"
+        #define CP_HAS_HASTY_SPACE
+    """
 
 
 source_folders = [os.path.join("Chipmunk2D", "src")]
@@ -1526,6 +1529,187 @@ struct cpVectArr {
 };
 void cpSpaceGetBodyPositions(cpSpace *space, cpVectArr *arr);
 
+typedef struct cpBodyState {
+    cpVect position;
+    cpFloat angle;
+    cpVect velocity;
+    cpFloat angular_velocity;
+    cpVect force;
+    cpFloat torque;
+} cpBodyState;
+void cpBodyGetStates(cpBody **bodies, size_t count, cpBodyState *out);
+
+typedef struct cpBodyPose {
+    cpVect position;
+    cpFloat angle;
+} cpBodyPose;
+void cpBodyInterpolatePoses(
+    cpBody **bodies, size_t count,
+    const cpBodyPose *prev, size_t num_prev, cpFloat alpha, cpBodyPose *out
+);
+intptr_t cpBodySetStates(
+    cpBody **bodies, const intptr_t *indices, size_t count,
+    const cpVect *position, const cpFloat *angle,
+    const cpVect *velocity, const cpFloat *angular_velocity,
+    cpBool reindex
+);
+intptr_t cpBodyApplyForces(
+    cpBody **bodies, const intptr_t *indices, size_t count,
+    const cpVect *forces, const cpVect *points, const cpFloat *torques
+);
+intptr_t cpBodyApplyImpulses(
+    cpBody **bodies, const intptr_t *indices, size_t count,
+    const cpVect *impulses, const cpVect *points, const cpFloat *angular_impulses
+);
+
+size_t cpSpaceSnapshot(
+    cpSpace *space,
+    cpBody **bodies, size_t num_bodies, cpShape **shapes, size_t num_shapes,
+    cpConstraint **constraints, size_t num_constraints,
+    void *buffer, size_t size
+);
+int cpSpaceRestore(
+    cpSpace *space,
+    cpBody **bodies, size_t num_bodies, cpShape **shapes, size_t num_shapes,
+    cpConstraint **constraints, size_t num_constraints,
+    const void *buffer, size_t size
+);
+
+typedef struct cpSpaceStepStats {
+    cpFloat integrate_positions, broadphase, narrowphase, contact_graph;
+    cpFloat prestep, integrate_velocities, solver, post_solve;
+    int steps, contacts, arbiters, awake_bodies, islands;
+} cpSpaceStepStats;
+int cpSpaceStepMany(
+    cpSpace *space, cpFloat dt, int count, cpBool threaded, cpBool contacts,
+    const int *queued, cpSpaceStepStats *stats
+);
+
+typedef struct cpBodyIntegrator {
+    cpFloat gravity_scale;
+    cpFloat linear_drag, quadratic_drag, angular_drag;
+    cpFloat max_speed, max_angular;
+} cpBodyIntegrator;
+cpBody *cpBodyExNew(cpFloat mass, cpFloat moment, cpBodyType type);
+void cpBodySetIntegrator(cpBody *body, const cpBodyIntegrator *integrator);
+void cpBodySetSlot(cpBody *body, int slot);
+
+typedef struct cpVelocityHook cpVelocityHook;
+typedef void (*cpVelocityHookFunc)(cpVelocityHook *hook, cpVect gravity, cpFloat damping, cpFloat dt);
+struct cpVelocityHook {
+    cpTimestamp stamp;
+    cpBody **bodies;
+    size_t count;
+    cpVect *velocities;
+    cpVect *positions;
+    cpFloat *masses;
+    cpVelocityHookFunc func;
+};
+void cpBodySetVelocityHook(cpBody *body, cpVelocityHook *hook);
+
+typedef struct cpCollisionEvent {
+    uint8_t event;
+    uint8_t first_contact;
+    uintptr_t shape_a, shape_b;
+    cpVect normal;
+    cpVect total_impulse;
+    cpFloat total_ke;
+} cpCollisionEvent;
+void cpSpaceEnableCollisionEvents(cpSpace *space);
+void cpSpaceFreeData(cpSpace *space);
+size_t cpSpaceCountCollisionEvents(cpSpace *space);
+void cpSpaceDrainCollisionEvents(cpSpace *space, cpCollisionEvent *out);
+void cpCollisionHandlerRecordEvents(
+    cpCollisionHandler *handler, cpBool begin, cpBool post_solve, cpBool separate,
+    cpBool wildcard
+);
+
+typedef struct cpCollisionRule {
+    cpFloat friction, elasticity;
+    cpVect surface_velocity;
+    cpBool sensor;
+} cpCollisionRule;
+void cpCollisionHandlerSetRule(
+    cpCollisionHandler *handler, cpCollisionRule *rule, cpBool ignore, cpBool wildcard
+);
+void cpCollisionHandlerResetFuncs(
+    cpCollisionHandler *handler, cpBool begin, cpBool pre_solve, cpBool post_solve,
+    cpBool separate, cpBool wildcard
+);
+
+typedef struct cpContactStats {
+    cpFloat normal_impulse, max_impulse, kinetic_energy;
+    int collisions;
+} cpContactStats;
+void cpBodyGetContactStats(cpBody **bodies, size_t count, cpContactStats *out, cpBool reset);
+
+typedef struct cpConstraintBreak {
+    cpFloat max_impulse, break_force;
+    cpConstraintPostSolveFunc post_solve;
+    void *handle;
+} cpConstraintBreak;
+void cpConstraintSetBreak(
+    cpConstraint *constraint, cpConstraintBreak *limits, cpConstraintPostSolveFunc post_solve
+);
+size_t cpSpaceCountBrokenConstraints(cpSpace *space);
+void cpSpaceDrainBrokenConstraints(cpSpace *space, void **out);
+
+typedef struct cpSegmentHit {
+    cpVect point, normal;
+    cpFloat alpha;
+    intptr_t shape;
+    int body;
+} cpSegmentHit;
+void cpSpaceSegmentQueryFirstBatch(
+    cpSpace *space, const cpVect *starts, const cpVect *ends, size_t count,
+    cpFloat radius, cpShapeFilter filter, cpSegmentHit *out
+);
+
+typedef struct cpPointHit {
+    cpVect point;
+    cpFloat distance;
+    cpVect gradient;
+    intptr_t shape;
+    int body;
+} cpPointHit;
+void cpSpacePointQueryNearestBatch(
+    cpSpace *space, const cpVect *points, size_t count, cpFloat max_distance,
+    cpShapeFilter filter, cpPointHit *out
+);
+
+typedef struct cpShapeHit {
+    intptr_t shape;
+    int body;
+} cpShapeHit;
+typedef struct cpShapeQueryHit {
+    cpContactPointSet set;
+    intptr_t shape;
+    int body;
+} cpShapeQueryHit;
+typedef struct cpQueryBuffer {
+    char *data;
+    size_t count, capacity, size;
+} cpQueryBuffer;
+cpQueryBuffer *cpQueryBufferNew(size_t size);
+void cpQueryBufferFree(cpQueryBuffer *buffer);
+void cpSpacePointQueryCollect(
+    cpSpace *space, cpVect point, cpFloat max_distance, cpShapeFilter filter,
+    cpQueryBuffer *buffer
+);
+void cpSpaceSegmentQueryCollect(
+    cpSpace *space, cpVect start, cpVect end, cpFloat radius, cpShapeFilter filter,
+    cpQueryBuffer *buffer
+);
+void cpSpaceBBQueryCollect(cpSpace *space, cpBB bb, cpShapeFilter filter, cpQueryBuffer *buffer);
+void cpSpaceShapeQueryCollect(cpSpace *space, cpShape *shape, cpQueryBuffer *buffer);
+void cpSpaceBBQueryBatch(
+    cpSpace *space, const cpBB *bbs, size_t count, cpShapeFilter filter,
+    intptr_t *offsets, cpQueryBuffer *buffer
+);
+void cpSpaceRasterize(
+    cpSpace *space, cpBB bb, cpFloat resolution, cpFloat margin,
+    cpShapeFilter filter, int rows, int cols, uint8_t *out
+);
 
 """
 )
@@ -1555,7 +1739,1734 @@ void cpSpaceBodyIteratorFuncForPositions(cpBody *body, void *data){
 
 void cpSpaceGetBodyPositions(cpSpace *space, cpVectArr *arr) {
     cpSpaceEachBody(space, cpSpaceBodyIteratorFuncForPositions, arr);
-	
+
+}
+
+// Batched body state API
+//
+// Angles are exported in degrees to match the units used by the Python API.
+
+#define CP_DEG_PER_RAD (180.0/CP_PI)
+
+typedef struct cpBodyState {
+    cpVect position;
+    cpFloat angle;
+    cpVect velocity;
+    cpFloat angular_velocity;
+    cpVect force;
+    cpFloat torque;
+} cpBodyState;
+
+// Bodies are given as an array of pointers that may contain NULL entries for
+// empty slots. The corresponding rows are filled with NaN.
+void cpBodyGetStates(cpBody **bodies, size_t count, cpBodyState *out) {
+    for (size_t i = 0; i < count; i++) {
+        cpBody *body = bodies[i];
+        cpBodyState *state = out + i;
+        if (body == NULL) {
+            cpFloat *values = (cpFloat *) state;
+            for (size_t j = 0; j < sizeof(cpBodyState)/sizeof(cpFloat); j++) values[j] = NAN;
+            continue;
+        }
+        state->position = cpBodyGetPosition(body);
+        state->angle = body->a*CP_DEG_PER_RAD;
+        state->velocity = body->v;
+        state->angular_velocity = body->w*CP_DEG_PER_RAD;
+        state->force = body->f;
+        state->torque = body->t;
+    }
+}
+
+typedef struct cpBodyPose {
+    cpVect position;
+    cpFloat angle;
+} cpBodyPose;
+
+// Blend the poses in prev with the current poses of the bodies, using
+// prev + alpha*(current - prev). Bodies without a previous pose (beyond
+// num_prev or NaN) use their current pose and empty entries are set to NaN.
+void cpBodyInterpolatePoses(
+    cpBody **bodies, size_t count,
+    const cpBodyPose *prev, size_t num_prev, cpFloat alpha, cpBodyPose *out
+) {
+    for (size_t i = 0; i < count; i++) {
+        cpBody *body = bodies[i];
+        if (body == NULL) {
+            out[i].position = cpv(NAN, NAN);
+            out[i].angle = NAN;
+            continue;
+        }
+        cpVect position = cpBodyGetPosition(body);
+        cpFloat angle = body->a*CP_DEG_PER_RAD;
+        if (i < num_prev && !isnan(prev[i].angle)) {
+            position = cpvlerp(prev[i].position, position, alpha);
+            angle = cpflerp(prev[i].angle, angle, alpha);
+        }
+        out[i].position = position;
+        out[i].angle = angle;
+    }
+}
+
+// The batch functions below receive the bodies as an array of pointers,
+// usually the slot table of the space, and an optional array of indices. If
+// indices is not NULL, the i-th row of the input arrays applies to
+// bodies[indices[i]], otherwise it applies to bodies[i]. Input arrays can be
+// NULL, in which case they are ignored.
+//
+// Empty (NULL) entries are skipped when iterating over all bodies. Explicit
+// indices must point to non-empty entries: the functions do nothing and
+// return the first offending row otherwise. They return -1 on success.
+
+static intptr_t cpBodiesCheckIndices(cpBody **bodies, const intptr_t *indices, size_t count) {
+    if (indices) {
+        for (size_t i = 0; i < count; i++) {
+            if (bodies[indices[i]] == NULL) return (intptr_t) i;
+        }
+    }
+    return -1;
+}
+
+static inline cpBody *cpBodiesGet(cpBody **bodies, const intptr_t *indices, size_t i) {
+    return bodies[indices ? indices[i] : (intptr_t) i];
+}
+
+intptr_t cpBodySetStates(
+    cpBody **bodies, const intptr_t *indices, size_t count,
+    const cpVect *position, const cpFloat *angle,
+    const cpVect *velocity, const cpFloat *angular_velocity,
+    cpBool reindex
+) {
+    intptr_t error = cpBodiesCheckIndices(bodies, indices, count);
+    if (error != -1) return error;
+
+    for (size_t i = 0; i < count; i++) {
+        cpBody *body = cpBodiesGet(bodies, indices, i);
+        if (body == NULL) continue;
+        if (position) cpBodySetPosition(body, position[i]);
+        if (angle) cpBodySetAngle(body, angle[i]/CP_DEG_PER_RAD);
+        if (velocity) cpBodySetVelocity(body, velocity[i]);
+        if (angular_velocity) cpBodySetAngularVelocity(body, angular_velocity[i]/CP_DEG_PER_RAD);
+        if (reindex && body->space) cpSpaceReindexShapesForBody(body->space, body);
+    }
+    return -1;
+}
+
+intptr_t cpBodyApplyForces(
+    cpBody **bodies, const intptr_t *indices, size_t count,
+    const cpVect *forces, const cpVect *points, const cpFloat *torques
+) {
+    intptr_t error = cpBodiesCheckIndices(bodies, indices, count);
+    if (error != -1) return error;
+
+    for (size_t i = 0; i < count; i++) {
+        cpBody *body = cpBodiesGet(bodies, indices, i);
+        if (body == NULL) continue;
+        if (forces) {
+            cpVect point = points ? points[i] : cpTransformPoint(body->transform, body->cog);
+            cpBodyApplyForceAtWorldPoint(body, forces[i], point);
+        }
+        if (torques) cpBodySetTorque(body, body->t + torques[i]);
+    }
+    return -1;
+}
+
+intptr_t cpBodyApplyImpulses(
+    cpBody **bodies, const intptr_t *indices, size_t count,
+    const cpVect *impulses, const cpVect *points, const cpFloat *angular_impulses
+) {
+    intptr_t error = cpBodiesCheckIndices(bodies, indices, count);
+    if (error != -1) return error;
+
+    for (size_t i = 0; i < count; i++) {
+        cpBody *body = cpBodiesGet(bodies, indices, i);
+        if (body == NULL) continue;
+        if (impulses) {
+            cpVect point = points ? points[i] : cpTransformPoint(body->transform, body->cog);
+            cpBodyApplyImpulseAtWorldPoint(body, impulses[i], point);
+        }
+        if (angular_impulses) {
+            cpBodySetAngularVelocity(body, body->w + body->i_inv*angular_impulses[i]);
+        }
+    }
+    return -1;
+}
+
+// Native velocity integrators
+//
+// Bodies are allocated with room for the parameters of a native velocity
+// integrator after the cpBody struct, so the integrator finds them without
+// a lookup. cpBodyFree() releases the whole block, since the cpBody is its
+// first member.
+
+typedef struct cpBodyIntegrator {
+    cpFloat gravity_scale;
+    cpFloat linear_drag, quadratic_drag, angular_drag;
+    cpFloat max_speed, max_angular;
+} cpBodyIntegrator;
+
+typedef struct cpVelocityHook cpVelocityHook;
+
+typedef struct cpContactStats {
+    cpFloat normal_impulse, max_impulse, kinetic_energy;
+    int collisions;
+} cpContactStats;
+
+typedef struct cpBodyEx {
+    cpBody body;
+    cpBodyIntegrator integrator;
+    cpVelocityHook *hook;
+    cpContactStats contacts;  // See "Contact statistics" below.
+    int slot;  // Slot of the body in its space or -1, set from Python.
+} cpBodyEx;
+
+// Same as cpBodyNew(), cpBodyNewKinematic() and cpBodyNewStatic().
+cpBody *cpBodyExNew(cpFloat mass, cpFloat moment, cpBodyType type) {
+    cpBody *body = cpBodyInit((cpBody *) cpcalloc(1, sizeof(cpBodyEx)), mass, moment);
+    ((cpBodyEx *) body)->slot = -1;
+    if (type != CP_BODY_TYPE_DYNAMIC) cpBodySetType(body, type);
+    return body;
+}
+
+void cpBodySetSlot(cpBody *body, int slot) {
+    ((cpBodyEx *) body)->slot = slot;
+}
+
+// Same as cpBodyUpdateVelocity(), with scaled gravity, followed by implicit
+// linear, quadratic and angular drag and by clamping of the speed and of
+// the angular speed. Limits can be INFINITY.
+static void cpBodyIntegrateVelocity(cpBody *body, cpVect gravity, cpFloat damping, cpFloat dt) {
+    const cpBodyIntegrator *it = &((cpBodyEx *) body)->integrator;
+    cpBodyUpdateVelocity(body, cpvmult(gravity, it->gravity_scale), damping, dt);
+
+    cpVect v = body->v;
+    cpFloat w = body->w;
+    cpFloat drag = it->linear_drag + it->quadratic_drag*cpvlength(v);
+    if (drag > 0.0) v = cpvmult(v, 1.0/(1.0 + drag*dt));
+    if (it->angular_drag > 0.0) w /= 1.0 + it->angular_drag*dt;
+    if (cpvlengthsq(v) > it->max_speed*it->max_speed) v = cpvmult(cpvnormalize(v), it->max_speed);
+    body->v = v;
+    body->w = cpfclamp(w, -it->max_angular, it->max_angular);
+}
+
+// The body must have been created by cpBodyExNew().
+void cpBodySetIntegrator(cpBody *body, const cpBodyIntegrator *integrator) {
+    ((cpBodyEx *) body)->integrator = *integrator;
+    cpBodySetVelocityUpdateFunc(body, cpBodyIntegrateVelocity);
+}
+
+// Velocity hooks
+//
+// A hook updates the linear velocities of a group of bodies with a single
+// call to func per step. The first body of the group integrated in a step
+// gathers the velocities, positions and masses of all bodies in the buffers
+// of the hook, calls func and writes the velocities back. The other bodies
+// of the group only integrate their angular velocity.
+//
+// Forces are integrated into the gathered velocities, since they are reset
+// at the end of the step. Bodies that sleep or are not in the space of the
+// step are passed to func unchanged and their velocities are not written.
+
+typedef void (*cpVelocityHookFunc)(cpVelocityHook *hook, cpVect gravity, cpFloat damping, cpFloat dt);
+
+struct cpVelocityHook {
+    cpTimestamp stamp;
+    cpBody **bodies;
+    size_t count;
+    cpVect *velocities;
+    cpVect *positions;
+    cpFloat *masses;
+    cpVelocityHookFunc func;
+};
+
+static inline cpBool cpVelocityHookIsActive(cpBody *member, cpSpace *space) {
+    return member->space == space && !cpBodyIsSleeping(member);
+}
+
+static void cpBodyHookVelocity(cpBody *body, cpVect gravity, cpFloat damping, cpFloat dt) {
+    cpVelocityHook *hook = ((cpBodyEx *) body)->hook;
+    cpSpace *space = body->space;
+    if (hook->stamp != space->stamp) {
+        hook->stamp = space->stamp;
+        for (size_t i = 0; i < hook->count; i++) {
+            cpBody *member = hook->bodies[i];
+            cpVect v = member->v;
+            if (cpVelocityHookIsActive(member, space)) v = cpvadd(v, cpvmult(member->f, member->m_inv*dt));
+            hook->velocities[i] = v;
+            hook->positions[i] = cpBodyGetPosition(member);
+            hook->masses[i] = member->m;
+        }
+        hook->func(hook, gravity, damping, dt);
+        for (size_t i = 0; i < hook->count; i++) {
+            cpBody *member = hook->bodies[i];
+            if (cpVelocityHookIsActive(member, space)) member->v = hook->velocities[i];
+        }
+    }
+
+    // Same as the angular part of cpBodyUpdateVelocity().
+    body->w = body->w*damping + body->t*body->i_inv*dt;
+    body->f = cpvzero;
+    body->t = 0.0f;
+}
+
+// Pass NULL to restore the default velocity function. The body must have
+// been created by cpBodyExNew().
+void cpBodySetVelocityHook(cpBody *body, cpVelocityHook *hook) {
+    ((cpBodyEx *) body)->hook = hook;
+    cpBodySetVelocityUpdateFunc(body, hook ? cpBodyHookVelocity : cpBodyUpdateVelocity);
+}
+
+// Collision event buffer
+//
+// Collision handlers can record their begin, post-solve and separate events
+// in a buffer owned by the space (stored in its user data, see cpSpaceData)
+// instead of calling Python. Shapes are identified by their user data, which holds their id.
+// Handlers of pairs of collision types and the default handler also call the
+// wildcard handlers, as the default Chipmunk callbacks do.
+
+enum {CP_EVENT_BEGIN, CP_EVENT_POST_SOLVE, CP_EVENT_SEPARATE};
+
+typedef struct cpCollisionEvent {
+    uint8_t event;
+    uint8_t first_contact;
+    uintptr_t shape_a, shape_b;
+    cpVect normal;
+    cpVect total_impulse;
+    cpFloat total_ke;
+} cpCollisionEvent;
+
+// Buffers filled by the space during steps, allocated on first use by collision
+// events or breakable constraints. Events are only recorded once
+// cpSpaceEnableCollisionEvents() was called.
+typedef struct cpSpaceData {
+    cpCollisionEvent *events;
+    size_t count, capacity;
+    cpBool events_enabled;
+    cpArray *broken;
+} cpSpaceData;
+
+static cpSpaceData *cpSpaceGetData(cpSpace *space) {
+    cpSpaceData *data = (cpSpaceData *) cpSpaceGetUserData(space);
+    if (data == NULL) {
+        data = (cpSpaceData *) cpcalloc(1, sizeof(cpSpaceData));
+        data->broken = cpArrayNew(0);
+        cpSpaceSetUserData(space, data);
+    }
+    return data;
+}
+
+void cpSpaceEnableCollisionEvents(cpSpace *space) {
+    cpSpaceGetData(space)->events_enabled = cpTrue;
+}
+
+void cpSpaceFreeData(cpSpace *space) {
+    cpSpaceData *data = (cpSpaceData *) cpSpaceGetUserData(space);
+    if (data) {
+        cpfree(data->events);
+        cpArrayFree(data->broken);
+        cpfree(data);
+        cpSpaceSetUserData(space, NULL);
+    }
+}
+
+size_t cpSpaceCountCollisionEvents(cpSpace *space) {
+    cpSpaceData *buffer = (cpSpaceData *) cpSpaceGetUserData(space);
+    return buffer ? buffer->count : 0;
+}
+
+// Copy all events to out, which must have room for them, and clear the buffer.
+void cpSpaceDrainCollisionEvents(cpSpace *space, cpCollisionEvent *out) {
+    cpSpaceData *buffer = (cpSpaceData *) cpSpaceGetUserData(space);
+    if (buffer == NULL) return;
+    memcpy(out, buffer->events, buffer->count*sizeof(cpCollisionEvent));
+    buffer->count = 0;
+}
+
+static void cpRecordCollisionEvent(cpArbiter *arb, cpSpace *space, uint8_t event) {
+    cpSpaceData *buffer = (cpSpaceData *) cpSpaceGetUserData(space);
+    if (buffer == NULL || !buffer->events_enabled) return;
+    if (buffer->count == buffer->capacity) {
+        buffer->capacity = buffer->capacity ? 2*buffer->capacity : 64;
+        buffer->events = (cpCollisionEvent *) cprealloc(buffer->events, buffer->capacity*sizeof(cpCollisionEvent));
+    }
+
+    cpShape *a, *b;
+    cpArbiterGetShapes(arb, &a, &b);
+    cpCollisionEvent *record = buffer->events + buffer->count++;
+    record->event = event;
+    record->first_contact = cpArbiterIsFirstContact(arb);
+    record->shape_a = (uintptr_t) cpShapeGetUserData(a);
+    record->shape_b = (uintptr_t) cpShapeGetUserData(b);
+    record->normal = cpArbiterGetNormal(arb);
+    record->total_impulse = cpArbiterTotalImpulse(arb);
+    record->total_ke = cpArbiterTotalKE(arb);
+}
+
+static cpBool cpRecordBegin(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpRecordCollisionEvent(arb, space, CP_EVENT_BEGIN);
+    return cpTrue;
+}
+
+static void cpRecordPostSolve(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpRecordCollisionEvent(arb, space, CP_EVENT_POST_SOLVE);
+}
+
+static void cpRecordSeparate(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpRecordCollisionEvent(arb, space, CP_EVENT_SEPARATE);
+}
+
+static cpBool cpRecordBeginChain(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpRecordCollisionEvent(arb, space, CP_EVENT_BEGIN);
+    cpBool retA = cpArbiterCallWildcardBeginA(arb, space);
+    cpBool retB = cpArbiterCallWildcardBeginB(arb, space);
+    return retA && retB;
+}
+
+static void cpRecordPostSolveChain(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpRecordCollisionEvent(arb, space, CP_EVENT_POST_SOLVE);
+    cpArbiterCallWildcardPostSolveA(arb, space);
+    cpArbiterCallWildcardPostSolveB(arb, space);
+}
+
+static void cpRecordSeparateChain(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpRecordCollisionEvent(arb, space, CP_EVENT_SEPARATE);
+    cpArbiterCallWildcardSeparateA(arb, space);
+    cpArbiterCallWildcardSeparateB(arb, space);
+}
+
+void cpCollisionHandlerRecordEvents(
+    cpCollisionHandler *handler, cpBool begin, cpBool post_solve, cpBool separate,
+    cpBool wildcard
+) {
+    if (begin) handler->beginFunc = wildcard ? cpRecordBegin : cpRecordBeginChain;
+    if (post_solve) handler->postSolveFunc = wildcard ? cpRecordPostSolve : cpRecordPostSolveChain;
+    if (separate) handler->separateFunc = wildcard ? cpRecordSeparate : cpRecordSeparateChain;
+}
+
+// Collision rules
+//
+// Rules replace the Python begin and pre-solve callbacks of a handler for
+// the common cases: ignore the collision, treat it as a sensor or override
+// the friction, elasticity or surface velocity of the arbiter (NaN keeps the
+// value computed by the space). The rule is the user data of the handler.
+
+typedef struct cpCollisionRule {
+    cpFloat friction, elasticity;
+    cpVect surface_velocity;
+    cpBool sensor;
+} cpCollisionRule;
+
+static cpBool cpRuleIgnore(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    return cpFalse;
+}
+
+static cpBool cpRuleApply(cpArbiter *arb, const cpCollisionRule *rule) {
+    if (!isnan(rule->friction)) cpArbiterSetFriction(arb, rule->friction);
+    if (!isnan(rule->elasticity)) cpArbiterSetRestitution(arb, rule->elasticity);
+    if (!isnan(rule->surface_velocity.x)) cpArbiterSetSurfaceVelocity(arb, rule->surface_velocity);
+    return !rule->sensor;
+}
+
+static cpBool cpRulePreSolve(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    return cpRuleApply(arb, (cpCollisionRule *) data);
+}
+
+static cpBool cpRulePreSolveChain(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpBool retA = cpArbiterCallWildcardPreSolveA(arb, space);
+    cpBool retB = cpArbiterCallWildcardPreSolveB(arb, space);
+    return cpRuleApply(arb, (cpCollisionRule *) data) && retA && retB;
+}
+
+// The rule must stay alive while the handler uses it.
+void cpCollisionHandlerSetRule(
+    cpCollisionHandler *handler, cpCollisionRule *rule, cpBool ignore, cpBool wildcard
+) {
+    handler->userData = rule;
+    if (ignore) handler->beginFunc = cpRuleIgnore;
+    else handler->preSolveFunc = wildcard ? cpRulePreSolve : cpRulePreSolveChain;
+}
+
+// Default callbacks
+//
+// Same as the default callbacks of a new handler in cpSpace.c, which are not
+// exported: wildcard handlers accept every collision and the other handlers
+// call the wildcard handlers.
+
+static cpBool cpDefaultAlwaysCollide(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    return cpTrue;
+}
+
+static void cpDefaultDoNothing(cpArbiter *arb, cpSpace *space, cpDataPointer data) {}
+
+static cpBool cpDefaultBegin(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpBool retA = cpArbiterCallWildcardBeginA(arb, space);
+    cpBool retB = cpArbiterCallWildcardBeginB(arb, space);
+    return retA && retB;
+}
+
+static cpBool cpDefaultPreSolve(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpBool retA = cpArbiterCallWildcardPreSolveA(arb, space);
+    cpBool retB = cpArbiterCallWildcardPreSolveB(arb, space);
+    return retA && retB;
+}
+
+static void cpDefaultPostSolve(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpArbiterCallWildcardPostSolveA(arb, space);
+    cpArbiterCallWildcardPostSolveB(arb, space);
+}
+
+static void cpDefaultSeparate(cpArbiter *arb, cpSpace *space, cpDataPointer data) {
+    cpArbiterCallWildcardSeparateA(arb, space);
+    cpArbiterCallWildcardSeparateB(arb, space);
+}
+
+// Restore the default callbacks selected by the flags.
+void cpCollisionHandlerResetFuncs(
+    cpCollisionHandler *handler, cpBool begin, cpBool pre_solve, cpBool post_solve,
+    cpBool separate, cpBool wildcard
+) {
+    if (begin) handler->beginFunc = wildcard ? cpDefaultAlwaysCollide : cpDefaultBegin;
+    if (pre_solve) handler->preSolveFunc = wildcard ? cpDefaultAlwaysCollide : cpDefaultPreSolve;
+    if (post_solve) handler->postSolveFunc = wildcard ? cpDefaultDoNothing : cpDefaultPostSolve;
+    if (separate) handler->separateFunc = wildcard ? cpDefaultDoNothing : cpDefaultSeparate;
+}
+
+// Contact statistics
+//
+// After each step, the arbiters that were solved are visited and their
+// impulses and kinetic energy lost are added to the statistics of both
+// bodies. Sensors, ignored collisions and sleeping bodies are skipped, since
+// their arbiters are not solved. Statistics accumulate until they are read
+// with reset set.
+
+static void cpSpaceAccumulateContacts(cpSpace *space) {
+    cpArray *arbiters = space->arbiters;
+    for (int i = 0; i < arbiters->num; i++) {
+        cpArbiter *arb = (cpArbiter *) arbiters->arr[i];
+        cpFloat jn = 0.0;
+        for (int j = 0; j < arb->count; j++) jn += arb->contacts[j].jnAcc;
+        cpFloat impulse = cpvlength(cpArbiterTotalImpulse(arb));
+        cpFloat ke = cpArbiterTotalKE(arb);
+
+        cpBody *bodies[2] = {arb->body_a, arb->body_b};
+        for (int k = 0; k < 2; k++) {
+            cpContactStats *stats = &((cpBodyEx *) bodies[k])->contacts;
+            stats->normal_impulse += jn;
+            stats->max_impulse = cpfmax(stats->max_impulse, impulse);
+            stats->kinetic_energy += ke;
+            stats->collisions++;
+        }
+    }
+}
+
+// Bodies may contain NULL entries, whose rows are filled with zeros.
+void cpBodyGetContactStats(cpBody **bodies, size_t count, cpContactStats *out, cpBool reset) {
+    static const cpContactStats empty = {0.0, 0.0, 0.0, 0};
+    for (size_t i = 0; i < count; i++) {
+        if (bodies[i] == NULL) {
+            out[i] = empty;
+            continue;
+        }
+        cpContactStats *stats = &((cpBodyEx *) bodies[i])->contacts;
+        out[i] = *stats;
+        if (reset) *stats = empty;
+    }
+}
+
+// Breakable constraints
+//
+// The limits of a breakable constraint are stored in its user data and are
+// checked by a native post-solve function, which also calls the post-solve
+// function of the constraint, if any. A constraint whose impulse exceeds
+// max_impulse or break_force*dt is removed from the space at the end of the
+// step and the handle of its limits is stored in a list of the space until it
+// is drained.
+
+typedef struct cpConstraintBreak {
+    cpFloat max_impulse, break_force;
+    cpConstraintPostSolveFunc post_solve;
+    void *handle;
+} cpConstraintBreak;
+
+static void cpConstraintRemoveBroken(cpSpace *space, void *key, void *data) {
+    cpConstraint *constraint = (cpConstraint *) key;
+    cpConstraintBreak *limits = (cpConstraintBreak *) cpConstraintGetUserData(constraint);
+    if (limits == NULL || !cpSpaceContainsConstraint(space, constraint)) return;
+    cpSpaceRemoveConstraint(space, constraint);
+    cpArrayPush(cpSpaceGetData(space)->broken, limits->handle);
+}
+
+static void cpConstraintBreakPostSolve(cpConstraint *constraint, cpSpace *space) {
+    cpConstraintBreak *limits = (cpConstraintBreak *) cpConstraintGetUserData(constraint);
+    if (limits->post_solve) limits->post_solve(constraint, space);
+
+    cpFloat j = cpfabs(cpConstraintGetImpulse(constraint));
+    if (j > limits->max_impulse || j > limits->break_force*cpSpaceGetCurrentTimeStep(space)) {
+        cpSpaceAddPostStepCallback(space, cpConstraintRemoveBroken, constraint, NULL);
+    }
+}
+
+// Pass NULL limits to make the constraint unbreakable. In both cases,
+// post_solve becomes the post-solve function of the constraint. The limits
+// must stay alive while the constraint uses them.
+void cpConstraintSetBreak(
+    cpConstraint *constraint, cpConstraintBreak *limits, cpConstraintPostSolveFunc post_solve
+) {
+    cpConstraintSetUserData(constraint, limits);
+    if (limits) {
+        limits->post_solve = post_solve;
+        cpConstraintSetPostSolveFunc(constraint, cpConstraintBreakPostSolve);
+    } else {
+        cpConstraintSetPostSolveFunc(constraint, post_solve);
+    }
+}
+
+size_t cpSpaceCountBrokenConstraints(cpSpace *space) {
+    cpSpaceData *data = (cpSpaceData *) cpSpaceGetUserData(space);
+    return data ? data->broken->num : 0;
+}
+
+// Copy the handles of all broken constraints to out, which must have room for
+// them, and clear the list.
+void cpSpaceDrainBrokenConstraints(cpSpace *space, void **out) {
+    cpSpaceData *data = (cpSpaceData *) cpSpaceGetUserData(space);
+    if (data == NULL) return;
+    memcpy(out, data->broken->arr, data->broken->num*sizeof(void *));
+    data->broken->num = 0;
+}
+
+// Batched queries
+//
+// Run many queries in a single call and write compact results. Shapes are
+// identified by their id (their user data) and by the slot of their body,
+// with -1 for misses and for bodies without a slot, such as static bodies.
+
+static inline intptr_t cpShapeGetId(const cpShape *shape) {
+    return shape ? (intptr_t) cpShapeGetUserData(shape) : -1;
+}
+
+static inline int cpShapeGetBodySlot(const cpShape *shape) {
+    return shape ? ((cpBodyEx *) cpShapeGetBody(shape))->slot : -1;
+}
+
+typedef struct cpSegmentHit {
+    cpVect point, normal;
+    cpFloat alpha;
+    intptr_t shape;
+    int body;
+} cpSegmentHit;
+
+// Misses report the end point, a zero normal and alpha = 1.
+void cpSpaceSegmentQueryFirstBatch(
+    cpSpace *space, const cpVect *starts, const cpVect *ends, size_t count,
+    cpFloat radius, cpShapeFilter filter, cpSegmentHit *out
+) {
+    for (size_t i = 0; i < count; i++) {
+        cpSegmentQueryInfo info;
+        const cpShape *shape = cpSpaceSegmentQueryFirst(space, starts[i], ends[i], radius, filter, &info);
+        out[i].point = info.point;
+        out[i].normal = info.normal;
+        out[i].alpha = info.alpha;
+        out[i].shape = cpShapeGetId(shape);
+        out[i].body = cpShapeGetBodySlot(shape);
+    }
+}
+
+typedef struct cpPointHit {
+    cpVect point;
+    cpFloat distance;
+    cpVect gradient;
+    intptr_t shape;
+    int body;
+} cpPointHit;
+
+// Misses report the query point, distance = max_distance and a zero gradient.
+void cpSpacePointQueryNearestBatch(
+    cpSpace *space, const cpVect *points, size_t count, cpFloat max_distance,
+    cpShapeFilter filter, cpPointHit *out
+) {
+    for (size_t i = 0; i < count; i++) {
+        cpPointQueryInfo info;
+        const cpShape *shape = cpSpacePointQueryNearest(space, points[i], max_distance, filter, &info);
+        if (shape == NULL) {
+            info.point = points[i];
+            info.distance = max_distance;
+            info.gradient = cpvzero;
+        }
+        out[i].point = info.point;
+        out[i].distance = info.distance;
+        out[i].gradient = info.gradient;
+        out[i].shape = cpShapeGetId(shape);
+        out[i].body = cpShapeGetBodySlot(shape);
+    }
+}
+
+// Query hit buffers
+//
+// Queries with many hits append them to a growable buffer of fixed size
+// records instead of calling back into Python. Each query clears the buffer
+// first, so the same buffer can be reused by all queries of its record type.
+
+typedef struct cpShapeHit {
+    intptr_t shape;
+    int body;
+} cpShapeHit;
+
+typedef struct cpShapeQueryHit {
+    cpContactPointSet set;
+    intptr_t shape;
+    int body;
+} cpShapeQueryHit;
+
+typedef struct cpQueryBuffer {
+    char *data;
+    size_t count, capacity, size;
+} cpQueryBuffer;
+
+cpQueryBuffer *cpQueryBufferNew(size_t size) {
+    cpQueryBuffer *buffer = (cpQueryBuffer *) cpcalloc(1, sizeof(cpQueryBuffer));
+    buffer->size = size;
+    return buffer;
+}
+
+void cpQueryBufferFree(cpQueryBuffer *buffer) {
+    if (buffer) {
+        cpfree(buffer->data);
+        cpfree(buffer);
+    }
+}
+
+static void *cpQueryBufferPush(cpQueryBuffer *buffer) {
+    if (buffer->count == buffer->capacity) {
+        buffer->capacity = buffer->capacity ? 2*buffer->capacity : 16;
+        buffer->data = (char *) cprealloc(buffer->data, buffer->capacity*buffer->size);
+    }
+    return buffer->data + buffer->size*buffer->count++;
+}
+
+static void cpCollectPointHit(cpShape *shape, cpVect point, cpFloat distance, cpVect gradient, void *data) {
+    cpPointHit *hit = (cpPointHit *) cpQueryBufferPush((cpQueryBuffer *) data);
+    hit->point = point;
+    hit->distance = distance;
+    hit->gradient = gradient;
+    hit->shape = cpShapeGetId(shape);
+    hit->body = cpShapeGetBodySlot(shape);
+}
+
+static void cpCollectSegmentHit(cpShape *shape, cpVect point, cpVect normal, cpFloat alpha, void *data) {
+    cpSegmentHit *hit = (cpSegmentHit *) cpQueryBufferPush((cpQueryBuffer *) data);
+    hit->point = point;
+    hit->normal = normal;
+    hit->alpha = alpha;
+    hit->shape = cpShapeGetId(shape);
+    hit->body = cpShapeGetBodySlot(shape);
+}
+
+static void cpCollectShapeHit(cpShape *shape, void *data) {
+    cpShapeHit *hit = (cpShapeHit *) cpQueryBufferPush((cpQueryBuffer *) data);
+    hit->shape = cpShapeGetId(shape);
+    hit->body = cpShapeGetBodySlot(shape);
+}
+
+static void cpCollectShapeQueryHit(cpShape *shape, cpContactPointSet *points, void *data) {
+    cpShapeQueryHit *hit = (cpShapeQueryHit *) cpQueryBufferPush((cpQueryBuffer *) data);
+    hit->set = *points;
+    hit->shape = cpShapeGetId(shape);
+    hit->body = cpShapeGetBodySlot(shape);
+}
+
+// The buffer must hold cpPointHit records.
+void cpSpacePointQueryCollect(
+    cpSpace *space, cpVect point, cpFloat max_distance, cpShapeFilter filter,
+    cpQueryBuffer *buffer
+) {
+    buffer->count = 0;
+    cpSpacePointQuery(space, point, max_distance, filter, cpCollectPointHit, buffer);
+}
+
+// The buffer must hold cpSegmentHit records.
+void cpSpaceSegmentQueryCollect(
+    cpSpace *space, cpVect start, cpVect end, cpFloat radius, cpShapeFilter filter,
+    cpQueryBuffer *buffer
+) {
+    buffer->count = 0;
+    cpSpaceSegmentQuery(space, start, end, radius, filter, cpCollectSegmentHit, buffer);
+}
+
+// The buffer must hold cpShapeHit records.
+void cpSpaceBBQueryCollect(cpSpace *space, cpBB bb, cpShapeFilter filter, cpQueryBuffer *buffer) {
+    buffer->count = 0;
+    cpSpaceBBQuery(space, bb, filter, cpCollectShapeHit, buffer);
+}
+
+// The buffer must hold cpShapeQueryHit records.
+void cpSpaceShapeQueryCollect(cpSpace *space, cpShape *shape, cpQueryBuffer *buffer) {
+    buffer->count = 0;
+    cpSpaceShapeQuery(space, shape, cpCollectShapeQueryHit, buffer);
+}
+
+// The buffer must hold cpShapeHit records. The hits of bbs[i] are stored in
+// the range offsets[i] to offsets[i + 1], so offsets must have count + 1
+// items.
+void cpSpaceBBQueryBatch(
+    cpSpace *space, const cpBB *bbs, size_t count, cpShapeFilter filter,
+    intptr_t *offsets, cpQueryBuffer *buffer
+) {
+    buffer->count = 0;
+    offsets[0] = 0;
+    for (size_t i = 0; i < count; i++) {
+        cpSpaceBBQuery(space, bbs[i], filter, cpCollectShapeHit, buffer);
+        offsets[i + 1] = (intptr_t) buffer->count;
+    }
+}
+
+// Occupancy grids
+//
+// The cell in row j and column i of a grid covers the square with lower left
+// corner at (bb.l + i*resolution, bb.b + j*resolution). A cell is occupied
+// when its center is within margin of a shape. Each shape found by the
+// spatial index only tests the cells whose centers fall in its bounding box.
+
+typedef struct cpRasterizeContext {
+    cpBB bb;
+    cpFloat resolution, margin;
+    int rows, cols;
+    uint8_t *out;
+} cpRasterizeContext;
+
+static void cpRasterizeShape(cpShape *shape, void *data) {
+    cpRasterizeContext *ctx = (cpRasterizeContext *) data;
+    cpBB sbb = cpShapeGetBB(shape);
+    cpFloat res = ctx->resolution, margin = ctx->margin;
+
+    // Indices are clamped before the cast, since huge (or infinite) bounding
+    // boxes overflow an int. Empty ranges stay empty.
+    int i0 = (int) cpfclamp(ceil((sbb.l - margin - ctx->bb.l)/res - 0.5), 0, ctx->cols);
+    int i1 = (int) cpfclamp(floor((sbb.r + margin - ctx->bb.l)/res - 0.5), -1, ctx->cols - 1);
+    int j0 = (int) cpfclamp(ceil((sbb.b - margin - ctx->bb.b)/res - 0.5), 0, ctx->rows);
+    int j1 = (int) cpfclamp(floor((sbb.t + margin - ctx->bb.b)/res - 0.5), -1, ctx->rows - 1);
+
+    for (int j = j0; j <= j1; j++) {
+        uint8_t *row = ctx->out + (size_t) j*ctx->cols;
+        cpFloat y = ctx->bb.b + (j + 0.5)*res;
+        for (int i = i0; i <= i1; i++) {
+            if (row[i]) continue;
+            cpVect center = cpv(ctx->bb.l + (i + 0.5)*res, y);
+            cpPointQueryInfo info;
+            if (cpShapePointQuery(shape, center, &info) <= margin) row[i] = 1;
+        }
+    }
+}
+
+// out must have rows*cols items, in row major order.
+void cpSpaceRasterize(
+    cpSpace *space, cpBB bb, cpFloat resolution, cpFloat margin,
+    cpShapeFilter filter, int rows, int cols, uint8_t *out
+) {
+    if (rows <= 0 || cols <= 0) return;
+    memset(out, 0, (size_t) rows*cols);
+
+    cpRasterizeContext ctx = {bb, resolution, margin, rows, cols, out};
+    cpBB query = cpBBNew(bb.l - margin, bb.b - margin, bb.r + margin, bb.t + margin);
+    cpSpaceBBQuery(space, query, filter, cpRasterizeShape, &ctx);
+}
+
+// Space snapshots
+//
+// A snapshot is a flat buffer with the simulation state of a space: the
+// motion of bodies, the material of shapes, the state of constraints
+// (including accumulated impulses), the arbiter cache with its contacts and
+// the sleeping components.
+//
+// The caller passes tables with all bodies, shapes and constraints of the
+// space and objects are stored as indices in those tables. A hash of the
+// addresses in the tables is used to detect changes, so a snapshot can only
+// be restored in the space that created it, while it still holds the same
+// objects. Restoring validates every count and index in the snapshot before
+// the space is modified.
+
+#define CP_SNAPSHOT_MAGIC 0x4b4d4d45
+#define CP_SNAPSHOT_VERSION 1
+#define CP_SNAPSHOT_NO_INDEX SIZE_MAX
+
+enum cpSnapshotArbiterKind {
+    CP_SNAPSHOT_ARBITER_ACTIVE,
+    CP_SNAPSHOT_ARBITER_CACHED,
+    CP_SNAPSHOT_ARBITER_SLEEPING,
+};
+
+typedef struct cpSnapshotHeader {
+    uint32_t magic, version;
+    uint64_t hash;
+    cpFloat curr_dt;
+    size_t num_bodies, num_shapes, num_constraints, constraint_bytes;
+    size_t num_arbiters, num_contacts, num_components, num_sleeping;
+    size_t num_dynamic_bodies, num_active_constraints;
+} cpSnapshotHeader;
+
+typedef struct cpSnapshotBody {
+    cpVect p, v, f, v_bias;
+    cpFloat a, w, t, w_bias, idle_time;
+    cpTransform transform;
+} cpSnapshotBody;
+
+typedef struct cpSnapshotShape {
+    cpFloat e, u;
+    cpVect surface_v;
+} cpSnapshotShape;
+
+typedef struct cpSnapshotConstraint {
+    cpFloat max_force, error_bias, max_bias;
+    cpBool collide_bodies;
+} cpSnapshotConstraint;
+
+// Handlers are not stored: they are looked up again from the collision types
+// of the shapes when the arbiter is restored.
+typedef struct cpSnapshotArbiter {
+    size_t a, b;
+    cpFloat e, u;
+    cpVect surface_vr, n;
+    cpTimestamp age;
+    int count, state, kind;
+} cpSnapshotArbiter;
+
+// Position of an object in one of the tables passed by the caller.
+typedef struct cpSnapshotEntry {
+    void *ptr;
+    size_t index;
+} cpSnapshotEntry;
+
+// Sections of a snapshot, in the order they are stored.
+typedef struct cpSnapshotLayout {
+    const char *bodies, *shapes, *constraints, *arbiters, *contacts;
+    const char *component_sizes, *sleeping, *dynamic_bodies, *active_constraints;
+    const char *constraint_data;
+} cpSnapshotLayout;
+
+static void cpSnapshotWrite(char **cursor, const void *data, size_t size) {
+    memcpy(*cursor, data, size);
+    *cursor += size;
+}
+
+static size_t cpSnapshotReadIndex(const char *section, size_t i) {
+    size_t index;
+    memcpy(&index, section + i*sizeof(index), sizeof(index));
+    return index;
+}
+
+static uint64_t cpSnapshotHash(
+    cpBody **bodies, size_t num_bodies, cpShape **shapes, size_t num_shapes,
+    cpConstraint **constraints, size_t num_constraints
+) {
+    // FNV-1a over the addresses of all objects
+    uint64_t hash = 14695981039346656037ULL;
+    #define CP_SNAPSHOT_HASH(ptrs, n) \
+        for (size_t i = 0; i < n; i++) hash = (hash ^ (uint64_t) (uintptr_t) ptrs[i])*1099511628211ULL; \
+        hash = (hash ^ n)*1099511628211ULL;
+    CP_SNAPSHOT_HASH(bodies, num_bodies)
+    CP_SNAPSHOT_HASH(shapes, num_shapes)
+    CP_SNAPSHOT_HASH(constraints, num_constraints)
+    #undef CP_SNAPSHOT_HASH
+    return hash;
+}
+
+// Size of the type specific part of a constraint, which follows the common
+// cpConstraint header.
+static size_t cpSnapshotConstraintSize(const cpConstraint *constraint) {
+    size_t size = sizeof(cpConstraint);
+    if (cpConstraintIsPinJoint(constraint)) size = sizeof(cpPinJoint);
+    else if (cpConstraintIsSlideJoint(constraint)) size = sizeof(cpSlideJoint);
+    else if (cpConstraintIsPivotJoint(constraint)) size = sizeof(cpPivotJoint);
+    else if (cpConstraintIsGrooveJoint(constraint)) size = sizeof(cpGrooveJoint);
+    else if (cpConstraintIsDampedSpring(constraint)) size = sizeof(cpDampedSpring);
+    else if (cpConstraintIsDampedRotarySpring(constraint)) size = sizeof(cpDampedRotarySpring);
+    else if (cpConstraintIsRotaryLimitJoint(constraint)) size = sizeof(cpRotaryLimitJoint);
+    else if (cpConstraintIsRatchetJoint(constraint)) size = sizeof(cpRatchetJoint);
+    else if (cpConstraintIsGearJoint(constraint)) size = sizeof(cpGearJoint);
+    else if (cpConstraintIsSimpleMotor(constraint)) size = sizeof(cpSimpleMotor);
+    return size - sizeof(cpConstraint);
+}
+
+// Compares pointers, or entries by their pointer.
+static int cpSnapshotComparePointers(const void *a, const void *b) {
+    uintptr_t x = (uintptr_t) *(void **) a, y = (uintptr_t) *(void **) b;
+    return (x > y) - (x < y);
+}
+
+static int cpSnapshotComparePairs(const void *a, const void *b) {
+    const size_t *x = (const size_t *) a, *y = (const size_t *) b;
+    if (x[0] != y[0]) return (x[0] > y[0]) - (x[0] < y[0]);
+    return (x[1] > y[1]) - (x[1] < y[1]);
+}
+
+static cpBool cpSnapshotContains(void **sorted, size_t n, void *ptr) {
+    return bsearch(&ptr, sorted, n, sizeof(void *), cpSnapshotComparePointers) != NULL;
+}
+
+// Entries of the non NULL objects of a table, sorted by address.
+static cpSnapshotEntry *cpSnapshotIndexNew(void **table, size_t n, size_t *count) {
+    cpSnapshotEntry *entries = (cpSnapshotEntry *) cpcalloc(n + 1, sizeof(cpSnapshotEntry));
+    *count = 0;
+    for (size_t i = 0; i < n; i++) {
+        if (table[i]) entries[(*count)++] = (cpSnapshotEntry) {table[i], i};
+    }
+    qsort(entries, *count, sizeof(cpSnapshotEntry), cpSnapshotComparePointers);
+    return entries;
+}
+
+static size_t cpSnapshotFind(cpSnapshotEntry *entries, size_t count, const void *ptr) {
+    cpSnapshotEntry *entry = (cpSnapshotEntry *) bsearch(&ptr, entries, count, sizeof(cpSnapshotEntry), cpSnapshotComparePointers);
+    return entry ? entry->index : CP_SNAPSHOT_NO_INDEX;
+}
+
+// Advance offset past a section of n records of the given size, failing if
+// the size of the snapshot overflows.
+static cpBool cpSnapshotSection(size_t *offset, size_t *start, size_t n, size_t size) {
+    if (n > (SIZE_MAX - *offset)/size) return cpFalse;
+    *start = *offset;
+    *offset += n*size;
+    return cpTrue;
+}
+
+typedef struct cpSnapshotArbiterContext {
+    cpArray *arbiters;
+    void **active;
+    size_t num_active;
+} cpSnapshotArbiterContext;
+
+static void cpSnapshotCollectCachedArbiter(cpArbiter *arb, cpSnapshotArbiterContext *context) {
+    if (!cpSnapshotContains(context->active, context->num_active, arb)) cpArrayPush(context->arbiters, arb);
+}
+
+static cpBool cpSnapshotOwnsArbiter(cpBody *body, cpArbiter *arb) {
+    // Same rule used by cpSpaceDeactivateBody() to visit each arbiter once.
+    return body == arb->body_a || cpBodyGetType(arb->body_a) == CP_BODY_TYPE_STATIC;
+}
+
+static void cpSnapshotWriteIndices(char **cursor, cpArray *arr, cpSnapshotEntry *entries, size_t count) {
+    for (int i = 0; i < arr->num; i++) {
+        size_t index = cpSnapshotFind(entries, count, arr->arr[i]);
+        cpSnapshotWrite(cursor, &index, sizeof(index));
+    }
+}
+
+// Write a snapshot of the space to buffer and return its size. Nothing is
+// written if buffer is NULL or smaller than the snapshot.
+size_t cpSpaceSnapshot(
+    cpSpace *space,
+    cpBody **bodies, size_t num_bodies, cpShape **shapes, size_t num_shapes,
+    cpConstraint **constraints, size_t num_constraints,
+    void *buffer, size_t size
+) {
+    cpArray *active = space->arbiters, *components = space->sleepingComponents;
+    cpSnapshotHeader header = {
+        CP_SNAPSHOT_MAGIC, CP_SNAPSHOT_VERSION,
+        cpSnapshotHash(bodies, num_bodies, shapes, num_shapes, constraints, num_constraints),
+        space->curr_dt, num_bodies, num_shapes, num_constraints,
+    };
+
+    // Arbiters are stored in three groups: the ones processed by the last
+    // step, in the same order, followed by the remaining cached arbiters and
+    // the arbiters of sleeping bodies, which are kept out of the cache.
+    cpArray *arbiters = cpArrayNew(active->num + cpHashSetCount(space->cachedArbiters));
+    void **sorted = (void **) cpcalloc(active->num + 1, sizeof(void *));
+    memcpy(sorted, active->arr, active->num*sizeof(void *));
+    qsort(sorted, active->num, sizeof(void *), cpSnapshotComparePointers);
+    cpSnapshotArbiterContext context = {arbiters, sorted, active->num};
+
+    for (int i = 0; i < active->num; i++) cpArrayPush(arbiters, active->arr[i]);
+    cpHashSetEach(space->cachedArbiters, (cpHashSetIteratorFunc) cpSnapshotCollectCachedArbiter, &context);
+    int num_awake = arbiters->num;
+    for (int i = 0; i < components->num; i++) {
+        CP_BODY_FOREACH_COMPONENT((cpBody *) components->arr[i], body) {
+            header.num_sleeping++;
+            CP_BODY_FOREACH_ARBITER(body, arb) {
+                if (cpSnapshotOwnsArbiter(body, arb)) cpArrayPush(arbiters, arb);
+            }
+        }
+    }
+    cpfree(sorted);
+
+    header.num_arbiters = arbiters->num;
+    for (int i = 0; i < arbiters->num; i++) {
+        header.num_contacts += ((cpArbiter *) arbiters->arr[i])->count;
+    }
+    for (size_t i = 0; i < num_constraints; i++) {
+        header.constraint_bytes += cpSnapshotConstraintSize(constraints[i]);
+    }
+    header.num_components = components->num;
+    header.num_dynamic_bodies = space->dynamicBodies->num;
+    header.num_active_constraints = space->constraints->num;
+
+    size_t required = sizeof(header)
+        + num_bodies*sizeof(cpSnapshotBody)
+        + num_shapes*sizeof(cpSnapshotShape)
+        + num_constraints*sizeof(cpSnapshotConstraint)
+        + header.num_arbiters*sizeof(cpSnapshotArbiter)
+        + header.num_contacts*sizeof(struct cpContact)
+        + header.num_components*sizeof(size_t)
+        + (header.num_sleeping + header.num_dynamic_bodies + header.num_active_constraints)*sizeof(size_t)
+        + header.constraint_bytes;
+    if (buffer == NULL || size < required) {
+        cpArrayFree(arbiters);
+        return required;
+    }
+
+    size_t body_count, shape_count, constraint_count;
+    cpSnapshotEntry *body_index = cpSnapshotIndexNew((void **) bodies, num_bodies, &body_count);
+    cpSnapshotEntry *shape_index = cpSnapshotIndexNew((void **) shapes, num_shapes, &shape_count);
+    cpSnapshotEntry *constraint_index = cpSnapshotIndexNew((void **) constraints, num_constraints, &constraint_count);
+
+    char *writer = (char *) buffer;
+    cpSnapshotWrite(&writer, &header, sizeof(header));
+
+    for (size_t i = 0; i < num_bodies; i++) {
+        cpBody *body = bodies[i];
+        cpSnapshotBody record = {{0}};
+        if (body) {
+            record = (cpSnapshotBody) {
+                body->p, body->v, body->f, body->v_bias,
+                body->a, body->w, body->t, body->w_bias, body->sleeping.idleTime,
+                body->transform,
+            };
+        }
+        cpSnapshotWrite(&writer, &record, sizeof(record));
+    }
+    for (size_t i = 0; i < num_shapes; i++) {
+        cpShape *shape = shapes[i];
+        cpSnapshotShape record = {shape->e, shape->u, shape->surfaceV};
+        cpSnapshotWrite(&writer, &record, sizeof(record));
+    }
+    for (size_t i = 0; i < num_constraints; i++) {
+        cpConstraint *constraint = constraints[i];
+        cpSnapshotConstraint record = {
+            constraint->maxForce, constraint->errorBias, constraint->maxBias,
+            constraint->collideBodies,
+        };
+        cpSnapshotWrite(&writer, &record, sizeof(record));
+    }
+
+    for (int i = 0; i < arbiters->num; i++) {
+        cpArbiter *arb = (cpArbiter *) arbiters->arr[i];
+        int kind = (i < active->num ? CP_SNAPSHOT_ARBITER_ACTIVE : i < num_awake ? CP_SNAPSHOT_ARBITER_CACHED : CP_SNAPSHOT_ARBITER_SLEEPING);
+        cpSnapshotArbiter record = {
+            cpSnapshotFind(shape_index, shape_count, arb->a), cpSnapshotFind(shape_index, shape_count, arb->b),
+            arb->e, arb->u, arb->surface_vr, arb->n, space->stamp - arb->stamp,
+            arb->count, arb->state, kind,
+        };
+        cpSnapshotWrite(&writer, &record, sizeof(record));
+    }
+    for (int i = 0; i < arbiters->num; i++) {
+        cpArbiter *arb = (cpArbiter *) arbiters->arr[i];
+        cpSnapshotWrite(&writer, arb->contacts, arb->count*sizeof(struct cpContact));
+    }
+    cpArrayFree(arbiters);
+
+    // Sleeping components: the number of bodies in each one, followed by the
+    // bodies of all components, starting from their roots.
+    for (int i = 0; i < components->num; i++) {
+        size_t n = 0;
+        CP_BODY_FOREACH_COMPONENT((cpBody *) components->arr[i], body) n++;
+        cpSnapshotWrite(&writer, &n, sizeof(n));
+    }
+    for (int i = 0; i < components->num; i++) {
+        CP_BODY_FOREACH_COMPONENT((cpBody *) components->arr[i], body) {
+            size_t index = cpSnapshotFind(body_index, body_count, body);
+            cpSnapshotWrite(&writer, &index, sizeof(index));
+        }
+    }
+
+    // Order of the arrays iterated by cpSpaceStep().
+    cpSnapshotWriteIndices(&writer, space->dynamicBodies, body_index, body_count);
+    cpSnapshotWriteIndices(&writer, space->constraints, constraint_index, constraint_count);
+    cpfree(body_index);
+    cpfree(shape_index);
+    cpfree(constraint_index);
+
+    for (size_t i = 0; i < num_constraints; i++) {
+        cpConstraint *constraint = constraints[i];
+        cpSnapshotWrite(&writer, (char *) constraint + sizeof(cpConstraint), cpSnapshotConstraintSize(constraint));
+    }
+    return required;
+}
+
+enum cpSnapshotError {
+    CP_SNAPSHOT_OK,
+    CP_SNAPSHOT_INVALID,
+    CP_SNAPSHOT_MISMATCH,
+    CP_SNAPSHOT_CANNOT_SLEEP,
+    CP_SNAPSHOT_LOCKED,
+};
+
+// Split the snapshot into its sections, checking that its size matches the
+// counts in the header.
+static cpBool cpSnapshotGetLayout(const cpSnapshotHeader *header, const void *buffer, size_t size, cpSnapshotLayout *layout) {
+    size_t offset = sizeof(cpSnapshotHeader), start[10];
+    cpBool ok = (
+        cpSnapshotSection(&offset, start + 0, header->num_bodies, sizeof(cpSnapshotBody))
+        && cpSnapshotSection(&offset, start + 1, header->num_shapes, sizeof(cpSnapshotShape))
+        && cpSnapshotSection(&offset, start + 2, header->num_constraints, sizeof(cpSnapshotConstraint))
+        && cpSnapshotSection(&offset, start + 3, header->num_arbiters, sizeof(cpSnapshotArbiter))
+        && cpSnapshotSection(&offset, start + 4, header->num_contacts, sizeof(struct cpContact))
+        && cpSnapshotSection(&offset, start + 5, header->num_components, sizeof(size_t))
+        && cpSnapshotSection(&offset, start + 6, header->num_sleeping, sizeof(size_t))
+        && cpSnapshotSection(&offset, start + 7, header->num_dynamic_bodies, sizeof(size_t))
+        && cpSnapshotSection(&offset, start + 8, header->num_active_constraints, sizeof(size_t))
+        && cpSnapshotSection(&offset, start + 9, header->constraint_bytes, 1)
+    );
+    if (!ok || offset != size) return cpFalse;
+
+    const char *data = (const char *) buffer;
+    *layout = (cpSnapshotLayout) {
+        data + start[0], data + start[1], data + start[2], data + start[3], data + start[4],
+        data + start[5], data + start[6], data + start[7], data + start[8], data + start[9],
+    };
+    return cpTrue;
+}
+
+// Check that the counts and indices of a snapshot are consistent with the
+// object tables, before the space is modified.
+static int cpSnapshotValidate(
+    const cpSnapshotHeader *header, const cpSnapshotLayout *layout,
+    cpBody **bodies, size_t num_bodies, cpShape **shapes, size_t num_shapes,
+    cpConstraint **constraints, size_t num_constraints
+) {
+    size_t constraint_bytes = 0;
+    for (size_t i = 0; i < num_constraints; i++) constraint_bytes += cpSnapshotConstraintSize(constraints[i]);
+    if (constraint_bytes != header->constraint_bytes) return CP_SNAPSHOT_INVALID;
+
+    // Shapes of arbiters must exist and each pair can only appear once.
+    int error = CP_SNAPSHOT_OK;
+    size_t num_contacts = 0;
+    size_t *pairs = (size_t *) cpcalloc(2*header->num_arbiters + 1, sizeof(size_t));
+    for (size_t i = 0; i < header->num_arbiters && !error; i++) {
+        cpSnapshotArbiter record;
+        memcpy(&record, layout->arbiters + i*sizeof(record), sizeof(record));
+        if (
+            record.a >= num_shapes || record.b >= num_shapes
+            || shapes[record.a]->body == shapes[record.b]->body
+            || record.count < 0 || record.count > CP_MAX_CONTACTS_PER_ARBITER
+            || record.state < CP_ARBITER_STATE_FIRST_COLLISION || record.state > CP_ARBITER_STATE_INVALIDATED
+            || record.kind < CP_SNAPSHOT_ARBITER_ACTIVE || record.kind > CP_SNAPSHOT_ARBITER_SLEEPING
+        ) {
+            error = CP_SNAPSHOT_INVALID;
+        }
+        pairs[2*i] = record.a < record.b ? record.a : record.b;
+        pairs[2*i + 1] = record.a < record.b ? record.b : record.a;
+        num_contacts += record.count;
+    }
+    if (!error) {
+        qsort(pairs, header->num_arbiters, 2*sizeof(size_t), cpSnapshotComparePairs);
+        for (size_t i = 1; i < header->num_arbiters; i++) {
+            if (cpSnapshotComparePairs(pairs + 2*i - 2, pairs + 2*i) == 0) error = CP_SNAPSHOT_INVALID;
+        }
+    }
+    cpfree(pairs);
+    if (error || num_contacts != header->num_contacts) return CP_SNAPSHOT_INVALID;
+
+    size_t num_sleeping = 0;
+    for (size_t i = 0; i < header->num_components; i++) {
+        size_t n = cpSnapshotReadIndex(layout->component_sizes, i);
+        if (n == 0 || n > header->num_sleeping - num_sleeping) return CP_SNAPSHOT_INVALID;
+        num_sleeping += n;
+    }
+    if (num_sleeping != header->num_sleeping) return CP_SNAPSHOT_INVALID;
+
+    // Sleeping bodies must exist and belong to a single component.
+    cpBool *seen = (cpBool *) cpcalloc(num_bodies + 1, sizeof(cpBool));
+    for (size_t i = 0; i < header->num_sleeping && !error; i++) {
+        size_t index = cpSnapshotReadIndex(layout->sleeping, i);
+        if (index >= num_bodies || bodies[index] == NULL || seen[index]) error = CP_SNAPSHOT_INVALID;
+        else seen[index] = cpTrue;
+    }
+    cpfree(seen);
+    if (error) return error;
+
+    for (size_t i = 0; i < header->num_dynamic_bodies; i++) {
+        size_t index = cpSnapshotReadIndex(layout->dynamic_bodies, i);
+        if (index >= num_bodies || bodies[index] == NULL) return CP_SNAPSHOT_INVALID;
+    }
+    for (size_t i = 0; i < header->num_active_constraints; i++) {
+        if (cpSnapshotReadIndex(layout->active_constraints, i) >= num_constraints) return CP_SNAPSHOT_INVALID;
+    }
+    return CP_SNAPSHOT_OK;
+}
+
+static cpBool cpSnapshotDropArbiter(cpArbiter *arb, cpSpace *space) {
+    cpArbiterUnthread(arb);
+    arb->contacts = NULL;
+    arb->count = 0;
+    cpArrayPush(space->pooledArbiters, arb);
+    return cpFalse;
+}
+
+// Same as cpSpaceArbiterSetTrans() in cpSpaceStep.c
+static cpArbiter *cpSnapshotNewArbiter(cpSpace *space, cpShape *a, cpShape *b) {
+    if (space->pooledArbiters->num == 0) {
+        int count = CP_BUFFER_BYTES/sizeof(cpArbiter);
+        cpArbiter *buffer = (cpArbiter *) cpcalloc(1, CP_BUFFER_BYTES);
+        cpArrayPush(space->allocatedBuffers, buffer);
+        for (int i = 0; i < count; i++) cpArrayPush(space->pooledArbiters, buffer + i);
+    }
+    return cpArbiterInit((cpArbiter *) cpArrayPop(space->pooledArbiters), a, b);
+}
+
+// Same as cpSpaceLookupHandler() in cpArbiter.c
+static cpCollisionHandler *cpSnapshotLookupHandler(cpSpace *space, cpCollisionType a, cpCollisionType b, cpCollisionHandler *defaultValue) {
+    cpCollisionType types[] = {a, b};
+    cpCollisionHandler *handler = (cpCollisionHandler *) cpHashSetFind(space->collisionHandlers, CP_HASH_PAIR(a, b), types);
+    return (handler ? handler : defaultValue);
+}
+
+// Same handler lookup as cpArbiterUpdate() in cpArbiter.c
+static void cpSnapshotSetHandlers(cpSpace *space, cpArbiter *arb) {
+    cpCollisionType typeA = arb->a->type, typeB = arb->b->type;
+    cpCollisionHandler *defaultHandler = &space->defaultHandler;
+    cpCollisionHandler *handler = arb->handler = cpSnapshotLookupHandler(space, typeA, typeB, defaultHandler);
+    cpBool swapped = arb->swapped = (typeA != handler->typeA && handler->typeA != CP_WILDCARD_COLLISION_TYPE);
+    if (handler != defaultHandler || space->usesWildcards) {
+        arb->handlerA = cpSnapshotLookupHandler(space, (swapped ? typeB : typeA), CP_WILDCARD_COLLISION_TYPE, &cpCollisionHandlerDoNothing);
+        arb->handlerB = cpSnapshotLookupHandler(space, (swapped ? typeA : typeB), CP_WILDCARD_COLLISION_TYPE, &cpCollisionHandlerDoNothing);
+    }
+}
+
+// Same as cpBodyPushArbiter() in cpSpaceComponent.c
+static void cpSnapshotPushArbiter(cpBody *body, cpArbiter *arb) {
+    cpArbiter *next = body->arbiterList;
+    cpArbiterThreadForBody(arb, body)->next = next;
+    if (next) cpArbiterThreadForBody(next, body)->prev = arb;
+    body->arbiterList = arb;
+}
+
+// Reorder arr as saved, if both contain the same elements.
+static void cpSnapshotReorder(cpArray *arr, const char *saved, size_t n, void **table) {
+    if ((size_t) arr->num != n) return;
+
+    void **sorted = (void **) cpcalloc(n + 1, sizeof(void *));
+    void **order = (void **) cpcalloc(n + 1, sizeof(void *));
+    memcpy(sorted, arr->arr, n*sizeof(void *));
+    qsort(sorted, n, sizeof(void *), cpSnapshotComparePointers);
+    cpBool same = cpTrue;
+    for (size_t i = 0; i < n && same; i++) {
+        order[i] = table[cpSnapshotReadIndex(saved, i)];
+        same = cpSnapshotContains(sorted, n, order[i]);
+    }
+    if (same) memcpy(arr->arr, order, n*sizeof(void *));
+    cpfree(sorted);
+    cpfree(order);
+}
+
+// Restore a snapshot created by cpSpaceSnapshot() with the same object
+// tables. Returns CP_SNAPSHOT_OK or an error code, in which case the space is
+// not modified.
+int cpSpaceRestore(
+    cpSpace *space,
+    cpBody **bodies, size_t num_bodies, cpShape **shapes, size_t num_shapes,
+    cpConstraint **constraints, size_t num_constraints,
+    const void *buffer, size_t size
+) {
+    cpSnapshotHeader header;
+    cpSnapshotLayout layout;
+    if (size < sizeof(header)) return CP_SNAPSHOT_INVALID;
+    memcpy(&header, buffer, sizeof(header));
+    if (
+        header.magic != CP_SNAPSHOT_MAGIC || header.version != CP_SNAPSHOT_VERSION
+        || !cpSnapshotGetLayout(&header, buffer, size, &layout)
+    ) {
+        return CP_SNAPSHOT_INVALID;
+    }
+
+    if (
+        header.num_bodies != num_bodies || header.num_shapes != num_shapes
+        || header.num_constraints != num_constraints
+        || header.hash != cpSnapshotHash(bodies, num_bodies, shapes, num_shapes, constraints, num_constraints)
+    ) {
+        return CP_SNAPSHOT_MISMATCH;
+    }
+
+    int error = cpSnapshotValidate(&header, &layout, bodies, num_bodies, shapes, num_shapes, constraints, num_constraints);
+    if (error) return error;
+    if (space->locked) return CP_SNAPSHOT_LOCKED;
+
+    // Bodies can only be put back to sleep if they are still dynamic.
+    if (header.num_components && space->sleepTimeThreshold == INFINITY) return CP_SNAPSHOT_CANNOT_SLEEP;
+    for (size_t i = 0; i < header.num_sleeping; i++) {
+        cpBody *body = bodies[cpSnapshotReadIndex(layout.sleeping, i)];
+        if (cpBodyGetType(body) != CP_BODY_TYPE_DYNAMIC) return CP_SNAPSHOT_CANNOT_SLEEP;
+    }
+
+    // Wake up all bodies and empty the arbiter cache. Arbiters are dropped
+    // silently, as if they never existed.
+    cpArray *components = space->sleepingComponents;
+    while (components->num) cpBodyActivate((cpBody *) components->arr[components->num - 1]);
+    for (int i = 0; i < space->arbiters->num; i++) cpArbiterUnthread((cpArbiter *) space->arbiters->arr[i]);
+    space->arbiters->num = 0;
+    cpHashSetFilter(space->cachedArbiters, (cpHashSetFilterFunc) cpSnapshotDropArbiter, space);
+    for (size_t i = 0; i < num_bodies; i++) {
+        if (bodies[i]) bodies[i]->arbiterList = NULL;
+    }
+    if (space->staticBody) space->staticBody->arbiterList = NULL;
+
+    space->curr_dt = header.curr_dt;
+
+    for (size_t i = 0; i < num_bodies; i++) {
+        cpBody *body = bodies[i];
+        cpSnapshotBody record;
+        if (body == NULL) continue;
+        memcpy(&record, layout.bodies + i*sizeof(record), sizeof(record));
+
+        cpBool moved = memcmp(&body->transform, &record.transform, sizeof(cpTransform)) != 0;
+        body->p = record.p;
+        body->v = record.v;
+        body->f = record.f;
+        body->v_bias = record.v_bias;
+        body->a = record.a;
+        body->w = record.w;
+        body->t = record.t;
+        body->w_bias = record.w_bias;
+        body->sleeping.idleTime = record.idle_time;
+        body->transform = record.transform;
+        if (moved) CP_BODY_FOREACH_SHAPE(body, shape) cpSpaceReindexShape(space, shape);
+    }
+
+    for (size_t i = 0; i < num_shapes; i++) {
+        cpShape *shape = shapes[i];
+        cpSnapshotShape record;
+        memcpy(&record, layout.shapes + i*sizeof(record), sizeof(record));
+        shape->e = record.e;
+        shape->u = record.u;
+        shape->surfaceV = record.surface_v;
+    }
+
+    const char *constraint_data = layout.constraint_data;
+    for (size_t i = 0; i < num_constraints; i++) {
+        cpConstraint *constraint = constraints[i];
+        cpSnapshotConstraint record;
+        memcpy(&record, layout.constraints + i*sizeof(record), sizeof(record));
+        constraint->maxForce = record.max_force;
+        constraint->errorBias = record.error_bias;
+        constraint->maxBias = record.max_bias;
+        constraint->collideBodies = record.collide_bodies;
+
+        // Callbacks are owned by the Python objects and are not restored.
+        size_t n = cpSnapshotConstraintSize(constraint);
+        if (cpConstraintIsDampedSpring(constraint)) {
+            cpDampedSpring *spring = (cpDampedSpring *) constraint;
+            cpDampedSpringForceFunc func = spring->springForceFunc;
+            memcpy((char *) constraint + sizeof(cpConstraint), constraint_data, n);
+            spring->springForceFunc = func;
+        } else if (cpConstraintIsDampedRotarySpring(constraint)) {
+            cpDampedRotarySpring *spring = (cpDampedRotarySpring *) constraint;
+            cpDampedRotarySpringTorqueFunc func = spring->springTorqueFunc;
+            memcpy((char *) constraint + sizeof(cpConstraint), constraint_data, n);
+            spring->springTorqueFunc = func;
+        } else {
+            memcpy((char *) constraint + sizeof(cpConstraint), constraint_data, n);
+        }
+        constraint_data += n;
+    }
+
+    // Rebuild the arbiter cache. Contacts are copied to the current contact
+    // buffer and timestamps are shifted, so arbiters expire in the same step
+    // as they would have from the snapshot.
+    const char *contacts = layout.contacts;
+    cpArbiter **arbiters = (cpArbiter **) cpcalloc(header.num_arbiters + 1, sizeof(cpArbiter *));
+    if (header.num_contacts && space->contactBuffersHead == NULL) cpSpacePushFreshContactBuffer(space);
+    for (size_t i = 0; i < header.num_arbiters; i++) {
+        cpSnapshotArbiter record;
+        memcpy(&record, layout.arbiters + i*sizeof(record), sizeof(record));
+
+        cpShape *a = shapes[record.a], *b = shapes[record.b];
+        cpArbiter *arb = arbiters[i] = cpSnapshotNewArbiter(space, a, b);
+        arb->e = record.e;
+        arb->u = record.u;
+        arb->surface_vr = record.surface_vr;
+        arb->n = record.n;
+        arb->stamp = space->stamp - record.age;
+        arb->state = (enum cpArbiterState) record.state;
+        arb->count = record.count;
+        cpSnapshotSetHandlers(space, arb);
+        if (record.count) {
+            arb->contacts = cpContactBufferGetArray(space);
+            memcpy(arb->contacts, contacts, record.count*sizeof(struct cpContact));
+            cpSpacePushContacts(space, record.count);
+            contacts += record.count*sizeof(struct cpContact);
+        }
+
+        const cpShape *shape_pair[] = {a, b};
+        cpHashSetInsert(space->cachedArbiters, CP_HASH_PAIR((cpHashValue) a, (cpHashValue) b), shape_pair, NULL, arb);
+        if (record.kind != CP_SNAPSHOT_ARBITER_CACHED) {
+            cpSnapshotPushArbiter(arb->body_a, arb);
+            cpSnapshotPushArbiter(arb->body_b, arb);
+        }
+    }
+
+    // Put components back to sleep. This moves the arbiters of sleeping
+    // bodies out of the cache, like cpSpaceProcessComponents() does.
+    size_t offset = 0;
+    for (size_t i = 0; i < header.num_components; i++) {
+        size_t n = cpSnapshotReadIndex(layout.component_sizes, i);
+        cpBody *root = bodies[cpSnapshotReadIndex(layout.sleeping, offset)];
+        cpBodySleepWithGroup(root, NULL);
+        for (size_t j = n - 1; j > 0; j--) {
+            cpBodySleepWithGroup(bodies[cpSnapshotReadIndex(layout.sleeping, offset + j)], root);
+        }
+        offset += n;
+    }
+    for (size_t i = 0; i < num_bodies; i++) {
+        if (bodies[i]) {
+            cpSnapshotBody record;
+            memcpy(&record, layout.bodies + i*sizeof(record), sizeof(record));
+            bodies[i]->sleeping.idleTime = record.idle_time;
+        }
+    }
+
+    for (size_t i = 0; i < header.num_arbiters; i++) {
+        cpSnapshotArbiter record;
+        memcpy(&record, layout.arbiters + i*sizeof(record), sizeof(record));
+        if (record.kind == CP_SNAPSHOT_ARBITER_ACTIVE) cpArrayPush(space->arbiters, arbiters[i]);
+    }
+    cpfree(arbiters);
+
+    cpSnapshotReorder(space->dynamicBodies, layout.dynamic_bodies, header.num_dynamic_bodies, (void **) bodies);
+    cpSnapshotReorder(space->constraints, layout.active_constraints, header.num_active_constraints, (void **) constraints);
+    return CP_SNAPSHOT_OK;
+}
+
+// Step profiler
+
+#ifdef _WIN32
+#include <windows.h>
+static double cpTimerNow(void) {
+    LARGE_INTEGER frequency, counter;
+    QueryPerformanceFrequency(&frequency);
+    QueryPerformanceCounter(&counter);
+    return (double) counter.QuadPart/(double) frequency.QuadPart;
+}
+#else
+#include <time.h>
+static double cpTimerNow(void) {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return (double) ts.tv_sec + 1e-9*(double) ts.tv_nsec;
+}
+#endif
+
+typedef struct cpSpaceStepStats {
+    cpFloat integrate_positions, broadphase, narrowphase, contact_graph;
+    cpFloat prestep, integrate_velocities, solver, post_solve;
+    int steps, contacts, arbiters, awake_bodies, islands;
+} cpSpaceStepStats;
+
+// Same as cpSpaceStep() in cpSpaceStep.c, but adds the time spent in each
+// phase to stats. Callbacks count towards the phase that calls them. The timer
+// is only read between phases, so the broadphase only covers the update of
+// the bounding boxes of shapes and the narrowphase covers the spatial index
+// query, which interleaves finding pairs and colliding them.
+//
+// This must be kept in sync with cpSpaceStep() when Chipmunk is updated.
+#if CP_VERSION_MAJOR != 7 || CP_VERSION_MINOR != 0 || CP_VERSION_RELEASE != 3
+#error "cpSpaceStepProfiled() mirrors cpSpaceStep() of Chipmunk 7.0.3"
+#endif
+
+static void cpSpaceStepProfiled(cpSpace *space, cpFloat dt, cpSpaceStepStats *stats) {
+    if (dt == 0.0f) return;
+
+    space->stamp++;
+
+    cpFloat prev_dt = space->curr_dt;
+    space->curr_dt = dt;
+
+    cpArray *bodies = space->dynamicBodies;
+    cpArray *constraints = space->constraints;
+    cpArray *arbiters = space->arbiters;
+    double start = cpTimerNow(), now;
+    #define CP_PROFILE_PHASE(field) now = cpTimerNow(); stats->field += now - start; start = now;
+
+    // Reset and empty the arbiter lists.
+    for (int i = 0; i < arbiters->num; i++) {
+        cpArbiter *arb = (cpArbiter *) arbiters->arr[i];
+        arb->state = CP_ARBITER_STATE_NORMAL;
+
+        // If both bodies are awake, unthread the arbiter from the contact graph.
+        if (!cpBodyIsSleeping(arb->body_a) && !cpBodyIsSleeping(arb->body_b)) {
+            cpArbiterUnthread(arb);
+        }
+    }
+    arbiters->num = 0;
+
+    cpSpaceLock(space); {
+        // Integrate positions
+        for (int i = 0; i < bodies->num; i++) {
+            cpBody *body = (cpBody *) bodies->arr[i];
+            body->position_func(body, dt);
+        }
+        CP_PROFILE_PHASE(integrate_positions)
+
+        // Find colliding pairs.
+        cpSpacePushFreshContactBuffer(space);
+        cpSpatialIndexEach(space->dynamicShapes, (cpSpatialIndexIteratorFunc) cpShapeUpdateFunc, NULL);
+        CP_PROFILE_PHASE(broadphase)
+        cpSpatialIndexReindexQuery(space->dynamicShapes, (cpSpatialIndexQueryFunc) cpSpaceCollideShapes, space);
+        CP_PROFILE_PHASE(narrowphase)
+    } cpSpaceUnlock(space, cpFalse);
+
+    // Rebuild the contact graph (and detect sleeping components if sleeping is enabled)
+    cpSpaceProcessComponents(space, dt);
+    CP_PROFILE_PHASE(contact_graph)
+
+    cpSpaceLock(space); {
+        // Clear out old cached arbiters and call separate callbacks
+        cpHashSetFilter(space->cachedArbiters, (cpHashSetFilterFunc) cpSpaceArbiterSetFilter, space);
+
+        // Prestep the arbiters and constraints.
+        cpFloat slop = space->collisionSlop;
+        cpFloat biasCoef = 1.0f - cpfpow(space->collisionBias, dt);
+        for (int i = 0; i < arbiters->num; i++) {
+            cpArbiterPreStep((cpArbiter *) arbiters->arr[i], dt, slop, biasCoef);
+        }
+
+        for (int i = 0; i < constraints->num; i++) {
+            cpConstraint *constraint = (cpConstraint *) constraints->arr[i];
+
+            cpConstraintPreSolveFunc preSolve = constraint->preSolve;
+            if (preSolve) preSolve(constraint, space);
+
+            constraint->klass->preStep(constraint, dt);
+        }
+        CP_PROFILE_PHASE(prestep)
+
+        // Integrate velocities.
+        cpFloat damping = cpfpow(space->damping, dt);
+        cpVect gravity = space->gravity;
+        for (int i = 0; i < bodies->num; i++) {
+            cpBody *body = (cpBody *) bodies->arr[i];
+            body->velocity_func(body, gravity, damping, dt);
+        }
+        CP_PROFILE_PHASE(integrate_velocities)
+
+        // Apply cached impulses
+        cpFloat dt_coef = (prev_dt == 0.0f ? 0.0f : dt/prev_dt);
+        for (int i = 0; i < arbiters->num; i++) {
+            cpArbiterApplyCachedImpulse((cpArbiter *) arbiters->arr[i], dt_coef);
+        }
+
+        for (int i = 0; i < constraints->num; i++) {
+            cpConstraint *constraint = (cpConstraint *) constraints->arr[i];
+            constraint->klass->applyCachedImpulse(constraint, dt_coef);
+        }
+
+        // Run the impulse solver.
+        for (int i = 0; i < space->iterations; i++) {
+            for (int j = 0; j < arbiters->num; j++) {
+                cpArbiterApplyImpulse((cpArbiter *) arbiters->arr[j]);
+            }
+
+            for (int j = 0; j < constraints->num; j++) {
+                cpConstraint *constraint = (cpConstraint *) constraints->arr[j];
+                constraint->klass->applyImpulse(constraint, dt);
+            }
+        }
+        CP_PROFILE_PHASE(solver)
+
+        // Run the constraint post-solve callbacks
+        for (int i = 0; i < constraints->num; i++) {
+            cpConstraint *constraint = (cpConstraint *) constraints->arr[i];
+
+            cpConstraintPostSolveFunc postSolve = constraint->postSolve;
+            if (postSolve) postSolve(constraint, space);
+        }
+
+        // run the post-solve callbacks
+        for (int i = 0; i < arbiters->num; i++) {
+            cpArbiter *arb = (cpArbiter *) arbiters->arr[i];
+
+            cpCollisionHandler *handler = arb->handler;
+            handler->postSolveFunc(arb, space, handler->userData);
+        }
+    } cpSpaceUnlock(space, cpTrue);
+    CP_PROFILE_PHASE(post_solve)
+    #undef CP_PROFILE_PHASE
+}
+
+static void cpSpaceVisitIslandBody(cpBody *body, cpArray *stack) {
+    if (cpBodyGetType(body) == CP_BODY_TYPE_DYNAMIC && body->sleeping.root == NULL) {
+        body->sleeping.root = body;
+        cpArrayPush(stack, body);
+    }
+}
+
+// Count the connected components of awake dynamic bodies linked by arbiters
+// or constraints. The component root pointer, which is only used by sleeping
+// bodies, marks visited bodies and is cleared at the end.
+static int cpSpaceCountIslands(cpSpace *space) {
+    cpArray *bodies = space->dynamicBodies;
+    cpArray *stack = cpArrayNew(0);
+    int islands = 0;
+
+    for (int i = 0; i < bodies->num; i++) {
+        cpBody *root = (cpBody *) bodies->arr[i];
+        if (cpBodyGetType(root) != CP_BODY_TYPE_DYNAMIC || root->sleeping.root) continue;
+
+        islands++;
+        cpSpaceVisitIslandBody(root, stack);
+        while (stack->num) {
+            cpBody *body = (cpBody *) cpArrayPop(stack);
+            CP_BODY_FOREACH_ARBITER(body, arb) {
+                cpSpaceVisitIslandBody(body == arb->body_a ? arb->body_b : arb->body_a, stack);
+            }
+            CP_BODY_FOREACH_CONSTRAINT(body, constraint) {
+                cpSpaceVisitIslandBody(body == constraint->a ? constraint->b : constraint->a, stack);
+            }
+        }
+    }
+
+    for (int i = 0; i < bodies->num; i++) ((cpBody *) bodies->arr[i])->sleeping.root = NULL;
+    cpArrayFree(stack);
+    return islands;
+}
+
+static void cpSpaceGetStepCounts(cpSpace *space, cpSpaceStepStats *stats) {
+    cpArray *arbiters = space->arbiters;
+    stats->contacts = 0;
+    for (int i = 0; i < arbiters->num; i++) stats->contacts += ((cpArbiter *) arbiters->arr[i])->count;
+    stats->arbiters = arbiters->num;
+    stats->awake_bodies = space->dynamicBodies->num;
+    stats->islands = cpSpaceCountIslands(space);
+}
+
+// Run up to count steps and return the number of steps taken. The loop stops
+// early after a step in which Python queued work (deferred additions, removals
+// or post step callbacks) and sets *queued.
+//
+// If contacts is true, the contact statistics of the bodies are updated after
+// each step.
+//
+// If stats is not NULL, the number of steps and the time spent in each phase
+// are added to it and the counters are set from the state after the last step. Threaded spaces only
+// report the counters, since their solver cannot be instrumented.
+int cpSpaceStepMany(
+    cpSpace *space, cpFloat dt, int count, cpBool threaded, cpBool contacts,
+    const int *queued, cpSpaceStepStats *stats
+) {
+    int steps = 0;
+    while (steps < count) {
+#ifdef CP_HAS_HASTY_SPACE
+        if (threaded) cpHastySpaceStep(space, dt);
+        else if (stats) cpSpaceStepProfiled(space, dt, stats);
+        else cpSpaceStep(space, dt);
+#else
+        if (stats) cpSpaceStepProfiled(space, dt, stats);
+        else cpSpaceStep(space, dt);
+#endif
+        if (contacts) cpSpaceAccumulateContacts(space);
+        steps++;
+        if (*queued) break;
+    }
+    if (stats && steps) {
+        stats->steps += steps;
+        cpSpaceGetStepCounts(space, stats);
+    }
+    return steps;
 }
 
 """
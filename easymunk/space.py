@@ -1,10 +1,15 @@
 __docformat__ = "reStructuredText"
 
+import heapq
 import logging
+import math
+import os
 import platform
 import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
 from functools import lru_cache
+from time import perf_counter
 from typing import (
     TYPE_CHECKING,
     Any,
@@ -17,21 +22,42 @@ from typing import (
     Tuple,
     Union,
     TypeVar,
+    Sequence,
+    cast,
 )
 
 import sidekick.api as sk
 
 from . import _chipmunk_cffi
+from ._arrays import (
+    body_pose_dtype,
+    body_state_dtype,
+    collision_event_dtype,
+    contact_stats_dtype,
+    out_array,
+    in_buffer,
+    index_array,
+    is_index_sequence,
+    cffi_buffer,
+    query_arrays,
+    point_hit_dtype,
+    segment_hit_dtype,
+    shape_hit_dtype,
+    shape_query_hit_dtype,
+)
 from ._mixins import PickleMixin
+from ._tuning import ThreadTuner
 from .arbiter import Arbiter
 from .body import Body, CircleBody, SegmentBody, PolyBody
 from .collections import Shapes, Bodies, Constraints
-from .collision_handler import CollisionHandler
+from .collision_handler import CollisionHandler, CollisionRule
 from .constraints import Constraint
+from .integrators import VelocityHook
 from .contact_point_set import contact_point_set_from_cffi
 from .query_info import PointQueryInfo, SegmentQueryInfo, ShapeQueryInfo
 from .shape_filter import ShapeFilter
 from .shapes import Shape, Circle, Segment, Poly, MakeShapeMixin
+from .step_stats import CallbackStats, StepStats
 from .util import (
     void,
     init_attributes,
@@ -47,6 +73,7 @@ if TYPE_CHECKING:
     from .bb import BB
     from .space_debug_draw_options import SpaceDebugDrawOptions
     import easymunk as mk
+    import numpy
 
 cp = _chipmunk_cffi.lib
 ffi = _chipmunk_cffi.ffi
@@ -59,6 +86,34 @@ ColType = int
 AddableObjects = Union[Body, Shape, Constraint]
 S = TypeVar("S", bound="Space")
 SHAPE_TO_BODY = {Circle: CircleBody, Segment: SegmentBody, Poly: PolyBody}
+PYTHON_TIMINGS = (
+    "collision_callbacks",
+    "body_callbacks",
+    "constraint_callbacks",
+    "deferred",
+    "post_step_callbacks",
+)
+C_STATS = (
+    "steps",
+    "integrate_positions",
+    "broadphase",
+    "narrowphase",
+    "contact_graph",
+    "prestep",
+    "integrate_velocities",
+    "solver",
+    "post_solve",
+    "contacts",
+    "arbiters",
+    "awake_bodies",
+    "islands",
+)
+_SNAPSHOT_ERRORS = {
+    1: "invalid snapshot",
+    2: "snapshot does not match the bodies, shapes and constraints in the space",
+    3: "snapshot has sleeping bodies that cannot be put to sleep",
+    4: "cannot restore a snapshot during a step or query",
+}
 
 POINT_QUERY_ARGS = """
         Args:
@@ -112,25 +167,52 @@ class Space(MakeShapeMixin, PickleMixin):
         "collision_bias",
         "collision_persistence",
         "threads",
+        "collect_stats",
+        "native",
+        "track_contacts",
     )
     _pickle_meta_hide = {
         "_add_later",
         "_bodies",
+        "_broken_constraints",
         "_cffi_ref",
         "_constraints",
         "_forces",
+        "_frame_states",
+        "_free_slots",
         "_handlers",
         "_locked",
+        "_native",
+        "_object_ptrs",
+        "_prev_poses",
         # "_post_step_callbacks",
         "_removed_shapes",
         "_remove_later",
         "_shapes",
+        "_slots",
+        "_slot_ptrs",
+        "_stats",
+        "_step_future",
+        "_step_queued",
+        "_thread_tuner",
+        "_callback_counters",
+        "_profile_start",
+        "_python_callbacks",
+        "_timings",
+        "_track_contacts",
+        "_velocity_hooks",
         "bodies",
         "constraints",
         "shapes",
         "static_body",
     }
     _init_kwargs = {*_pickle_args, *_pickle_kwargs, "elasticity", "friction"}
+    _native: bool
+    _python_callbacks: bool
+    _track_contacts: bool
+    _timings: Optional[Dict[str, float]]
+    _callback_counters: Dict[Tuple[str, Any], List[Any]]
+    _stats: Optional[StepStats]
 
     iterations: int
     iterations = property(  # type: ignore
@@ -303,6 +385,131 @@ class Space(MakeShapeMixin, PickleMixin):
         cp.cpSpaceAddBody(self._cffi_ref, cffi_body(body))
         return body
 
+    @property
+    def collect_stats(self) -> bool:
+        """If True, profile each step and report the results in
+        :py:attr:`Space.stats` and :py:meth:`Space.callback_stats`.
+
+        Profiling times each phase of the step and every Python callback, so
+        it makes steps slightly slower. Disabled by default.
+        """
+        return self._timings is not None
+
+    @collect_stats.setter
+    def collect_stats(self, value: bool) -> None:
+        if not value:
+            self._timings = None
+            self._stats = None
+            self._callback_counters = {}
+        elif self._timings is None:
+            self._timings = dict.fromkeys(PYTHON_TIMINGS, 0.0)
+
+    @property
+    def track_contacts(self) -> bool:
+        """If True, accumulate contact statistics of each body during steps.
+
+        Statistics are computed in C after each step and read with
+        :py:meth:`Space.get_contact_stats`. Disabled by default.
+        """
+        return self._track_contacts
+
+    @track_contacts.setter
+    def track_contacts(self, value: bool) -> None:
+        self._track_contacts = bool(value)
+
+    @property
+    def native(self) -> bool:
+        """If True, guarantee that steps of the space never call Python code.
+
+        Native spaces reject collision handler callbacks, body velocity and
+        position functions, velocity hooks, constraint pre and post solve
+        functions and post step callbacks with a ValueError. Native
+        integrators and recorded collision events are allowed. Since the step
+        runs entirely in C and does not hold the GIL, different native spaces
+        can be stepped from different threads in parallel, see
+        :py:func:`easymunk.step_parallel`.
+
+        Setting native to True raises a ValueError if the space already has
+        Python callbacks. Defaults to False.
+
+        >>> space = mk.Space(native=True)
+        >>> space.add_post_step_callback(print, "key")
+        Traceback (most recent call last):
+        ...
+        ValueError: cannot add post step callbacks to a native space
+        """
+        return self._native
+
+    @native.setter
+    def native(self, value: bool) -> None:
+        if value and self.has_python_callbacks():
+            raise ValueError("space has Python callbacks, it cannot be native")
+        self._native = bool(value)
+
+    def _check_native(self, what: str) -> None:
+        # Called whenever a Python callback is added to the space.
+        if self._native:
+            raise ValueError(f"cannot add {what} to a native space")
+        self._python_callbacks = True
+
+    def callback_stats(self, reset: bool = False) -> List[CallbackStats]:
+        """Return the number of calls and the time spent in each Python
+        callback since :py:attr:`Space.collect_stats` was enabled, slowest
+        first.
+
+        Collision handler callbacks are reported by collision type pair and
+        body and constraint functions by function name.
+
+        >>> space = mk.Space(collect_stats=True)
+        >>> body = mk.Body(1, 2, space=space)
+        >>> def slow_down(body, gravity, damping, dt):
+        ...     mk.Body.update_velocity(body, gravity, damping / 2, dt)
+        >>> body.velocity_func = slow_down
+        >>> [(s.kind, s.key, s.calls) for s in space.step(0.1).callback_stats()]
+        [('velocity_func', 'slow_down', 1)]
+
+        Args:
+            reset: If True, clear the counters after reading them.
+        """
+        counters = self._callback_counters
+        if reset:
+            self._callback_counters = {}
+        stats = [CallbackStats(k, key, n, t) for (k, key), (n, t) in counters.items()]
+        stats.sort(key=lambda s: s.time, reverse=True)
+        return stats
+
+    def _timed_call(
+        self, category: str, kind: str, key: Any, func: Callable, *args: Any
+    ) -> Any:
+        """Call func(*args), adding the elapsed time to the given category of
+        :py:attr:`Space.stats` and to the counters of the callback."""
+        start = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = perf_counter() - start
+            if self._timings is not None:
+                self._timings[category] += elapsed
+            counter = self._callback_counters.setdefault((kind, key), [0, 0.0])
+            counter[0] += 1
+            counter[1] += elapsed
+
+    @property
+    def stats(self) -> Optional[StepStats]:
+        """Profile of the last call to :py:meth:`Space.step`,
+        :py:meth:`Space.step_many` or :py:meth:`Space.advance`.
+
+        None if :py:attr:`Space.collect_stats` is disabled or if the space was
+        not stepped since it was enabled.
+
+        >>> space = mk.Space(collect_stats=True)
+        >>> body = mk.Body(1, 2, space=space)
+        >>> stats = space.step(0.1).stats
+        >>> stats.steps, stats.awake_bodies, stats.islands
+        (1, 1, 1)
+        """
+        return self._stats
+
     @property
     def kinetic_energy(self):
         """
@@ -398,16 +605,36 @@ class Space(MakeShapeMixin, PickleMixin):
 
         # To prevent the gc to collect the callbacks.
         self._handlers: Dict[Any, CollisionHandler] = {}
+        self._velocity_hooks: List[VelocityHook] = []
         self._post_step_callbacks: Dict[Any, Callable[["Space"], None]] = {}
 
         self._removed_shapes: Dict[int, Shape] = {}
         self._shapes: Dict[int, Shape] = {}
         self._bodies: Set[Body] = set()
+        self._slots: List[Optional[Body]] = []
+        self._free_slots: List[int] = []
+        self._slot_ptrs: Any = ffi.new("cpBody *[]", 16)
         self._constraints: Set[Constraint] = set()
+        self._broken_constraints: List[Constraint] = []
+        self._object_ptrs: Optional[Tuple[Any, Any]] = None
         self._add_later: Set[AddableObjects] = set()
         self._remove_later: Set[AddableObjects] = set()
         self._forces: List[Any] = []  # TODO: Implement support for forces
         self._locked: bool = False
+        self._native = False
+        self._python_callbacks = False
+        self._track_contacts = False
+        self._step_queued: Any = ffi.new("int *")
+        self._accumulator: float = 0.0
+        self._alpha: float = 0.0
+        self._prev_poses: Optional["numpy.ndarray"] = None
+        self._frame_states: Optional["numpy.ndarray"] = None
+        self._step_future: Optional[Future] = None
+        self._timings = None
+        self._callback_counters = {}
+        self._thread_tuner: Optional[ThreadTuner] = None
+        self._stats = None
+        self._profile_start: float = 0.0
 
         # Save attributes
         init_attributes(self, self._init_kwargs, kwargs)
@@ -419,7 +646,7 @@ class Space(MakeShapeMixin, PickleMixin):
         args, meta = super().__getstate__()
         exclude = set(self._remove_later)
         objects = {
-            "bodies": [b for b in self._bodies if b not in exclude],
+            "bodies": [None if b in exclude else b for b in self._slots],
             "constraints": [c for c in self._constraints if c not in exclude],
             "forces": [f for f in self._forces if f not in exclude],
             "later": list(self._add_later),
@@ -438,6 +665,7 @@ class Space(MakeShapeMixin, PickleMixin):
         # Keep for later
         objects = meta.pop("$objects")
         handlers = meta.pop("$handlers")
+        native = meta.pop("native", False)
 
         super().__setstate__((args, meta))
 
@@ -449,7 +677,9 @@ class Space(MakeShapeMixin, PickleMixin):
             self.add(static)
             self.static_body = static
             self._bodies.discard(static)
-        self.add(*bodies)
+            self._release_slot(static)
+        self.add(*(b for b in bodies if b is not None))
+        self._set_slots(bodies)
 
         # Register handlers
         for k, data in handlers.items():
@@ -459,7 +689,8 @@ class Space(MakeShapeMixin, PickleMixin):
                 handler = self.collision_handler(*k)
             else:
                 handler = self.wildcard_collision_handler(k)
-            handler.update(data)
+            handler.update({n: f for n, f in data.items() if f is not None})
+        self.native = native
 
     def _create_shape(self, cls, args, kwargs):
         space = kwargs.pop("space", self)
@@ -500,6 +731,7 @@ class Space(MakeShapeMixin, PickleMixin):
 
         if self._locked:
             self._add_later.update(objs)
+            self._step_queued[0] = 1
             return self
 
         # add bodies first, since the shapes require their bodies to be
@@ -556,6 +788,7 @@ class Space(MakeShapeMixin, PickleMixin):
 
         if self._locked:
             self._remove_later.update(objs)
+            self._step_queued[0] = 1
             return self
 
         for o in objs:
@@ -588,23 +821,30 @@ class Space(MakeShapeMixin, PickleMixin):
 
         shape._space = weakref.proxy(self)
         self._shapes[shape_id(shape)] = shape
+        self._object_ptrs = None
         cp.cpSpaceAddShape(self._cffi_ref, get_cffi_ref(shape))
         clear_nursery(shape)
 
     def _add_body(self, body: "Body") -> None:
         if body in self._bodies:
             return
+        if body._velocity_func is not None or body._position_func is not None:
+            self._check_native("bodies with Python velocity or position functions")
 
         body._space = weakref.proxy(self)
         self._bodies.add(body)
+        self._acquire_slot(body)
         cp.cpSpaceAddBody(self._cffi_ref, get_cffi_ref(body))
         clear_nursery(body)
 
     def _add_constraint(self, constraint: "Constraint") -> None:
         if constraint in self._constraints:
             return
+        if constraint.pre_solve is not None or constraint.post_solve is not None:
+            self._check_native("constraints with Python solve functions")
 
         self._constraints.add(constraint)
+        self._object_ptrs = None
         cp.cpSpaceAddConstraint(self._cffi_ref, get_cffi_ref(constraint))
         clear_nursery(constraint)
 
@@ -622,6 +862,7 @@ class Space(MakeShapeMixin, PickleMixin):
         if cp.cpSpaceContainsShape(self._cffi_ref, ref):
             cp.cpSpaceRemoveShape(self._cffi_ref, ref)
         del self._shapes[id_]
+        self._object_ptrs = None
 
     def _remove_body(self, body: "Body", discard: bool) -> None:
         if body not in self._bodies:
@@ -629,6 +870,12 @@ class Space(MakeShapeMixin, PickleMixin):
                 return
             raise ValueError("body not in space, already removed?")
         body._space = None
+        for hook in self._velocity_hooks:
+            if body in hook.bodies:
+                hook._discard(body)
+                if not hook.bodies:
+                    self._velocity_hooks.remove(hook)
+                break
 
         # During GC at program exit sometimes the shape might already be removed. Then
         # skip this step.
@@ -636,6 +883,48 @@ class Space(MakeShapeMixin, PickleMixin):
         if cp.cpSpaceContainsBody(self._cffi_ref, ref):
             cp.cpSpaceRemoveBody(self._cffi_ref, ref)
         self._bodies.remove(body)
+        self._release_slot(body)
+
+    def _acquire_slot(self, body: "Body") -> None:
+        if self._free_slots:
+            slot = heapq.heappop(self._free_slots)
+            self._slots[slot] = body
+        else:
+            slot = len(self._slots)
+            self._slots.append(body)
+            if slot == len(self._slot_ptrs):
+                ptrs = ffi.new("cpBody *[]", 2 * slot)
+                ffi.memmove(ptrs, self._slot_ptrs, ffi.sizeof(self._slot_ptrs))
+                self._slot_ptrs = ptrs
+        self._slot_ptrs[slot] = get_cffi_ref(body)
+        body._slot = slot
+        cp.cpBodySetSlot(self._slot_ptrs[slot], slot)
+
+    def _set_slots(self, slots: List[Optional[Body]]) -> None:
+        """Rebuild the slot table with the given body (or None) at each slot.
+
+        All bodies must already be in the space.
+        """
+        self._slots = slots
+        self._free_slots = [i for i, body in enumerate(slots) if body is None]
+        self._slot_ptrs = ffi.new("cpBody *[]", max(16, len(slots)))
+        for slot, body in enumerate(slots):
+            if body is not None:
+                self._slot_ptrs[slot] = get_cffi_ref(body)
+                body._slot = slot
+                cp.cpBodySetSlot(self._slot_ptrs[slot], slot)
+
+    def _release_slot(self, body: "Body") -> None:
+        slot = body._slot
+        if slot is None:
+            return
+        self._slots[slot] = None
+        self._slot_ptrs[slot] = ffi.NULL
+        heapq.heappush(self._free_slots, slot)
+        body._slot = None
+        cp.cpBodySetSlot(get_cffi_ref(body), -1)
+        if self._prev_poses is not None and slot < len(self._prev_poses):
+            self._prev_poses["angle"][slot] = float("nan")
 
     def _remove_constraint(self, constraint: "Constraint", discard: bool) -> None:
         if constraint not in self._constraints:
@@ -649,6 +938,7 @@ class Space(MakeShapeMixin, PickleMixin):
         if cp.cpSpaceContainsConstraint(self._cffi_ref, ref):
             cp.cpSpaceRemoveConstraint(self._cffi_ref, ref)
         self._constraints.remove(constraint)
+        self._object_ptrs = None
 
     def reindex_shape(self: S, shape: Shape) -> S:
         """Update the collision detection data for a specific shape in the
@@ -704,6 +994,396 @@ class Space(MakeShapeMixin, PickleMixin):
         cp.cpSpaceUseSpatialHash(self._cffi_ref, dim, count)
         return self
 
+    def body_at(self, slot: int) -> Body:
+        """Return the body that occupies the given slot.
+
+        See :py:attr:`Body.slot` for details. Raises an IndexError if the slot
+        is empty.
+        """
+        body = self._slots[slot] if 0 <= slot < len(self._slots) else None
+        if body is None:
+            raise IndexError(f"no body at slot {slot}")
+        return body
+
+    def compact_slots(self) -> List[int]:
+        """Remove the holes left in the slot table by removed bodies.
+
+        Bodies keep their relative order. Return a list with the old slot of
+        each body in the new slot order, so arrays indexed by the old slots can
+        be converted with ``new_array = old_array[order]``.
+        """
+        order = [i for i, body in enumerate(self._slots) if body is not None]
+        self._set_slots([self._slots[i] for i in order])
+        if self._prev_poses is not None:
+            prev = self._prev_poses
+            self._prev_poses = prev[[i for i in order if i < len(prev)]]
+        return order
+
+    def _get_body_pointers(
+        self, bodies: Optional[Sequence[Body]] = None
+    ) -> Tuple[Any, int]:
+        """Return a C array with pointers to the given bodies and its size.
+
+        If no bodies are given, return the slot table, which has NULL entries
+        for empty slots.
+        """
+        if bodies is None:
+            return self._slot_ptrs, len(self._slots)
+        ptrs = ffi.new("cpBody *[]", [get_cffi_ref(b) for b in bodies])
+        return ptrs, len(ptrs)
+
+    def get_body_states(
+        self,
+        out: Optional["numpy.ndarray"] = None,
+        bodies: Optional[Sequence[Body]] = None,
+    ) -> "numpy.ndarray":
+        """Read the state of many bodies at once into a NumPy structured array.
+
+        All values are copied in a single pass in C, which is much faster than
+        reading the body properties one by one from Python. Each row has the
+        fields "position", "angle", "velocity", "angular_velocity", "force"
+        and "torque". Angles are in degrees, like in :py:class:`Body`.
+
+        >>> space = mk.Space()
+        >>> body = mk.Body(1, 2, position=(1, 2))
+        >>> states = space.add(body).get_body_states()
+        >>> states["position"]
+        array([[1., 2.]])
+
+        Args:
+            out:
+                Optional array of dtype ``states.dtype`` and shape (n,) that
+                receives the result. A new array is allocated if not given.
+            bodies:
+                Sequence of bodies to read. If not given, read all bodies in
+                the space: the i-th row holds the state of the body in slot i
+                (see :py:attr:`Body.slot`) and rows of empty slots are filled
+                with NaN. The static body is not included.
+        """
+        ptrs, n = self._get_body_pointers(bodies)
+        out = out_array(out, (n,), body_state_dtype())
+        cp.cpBodyGetStates(ptrs, n, cffi_buffer(out, "cpBodyState"))
+        return out
+
+    def get_contact_stats(
+        self,
+        out: Optional["numpy.ndarray"] = None,
+        bodies: Optional[Sequence[Body]] = None,
+        reset: bool = True,
+    ) -> "numpy.ndarray":
+        """Read the contact statistics accumulated by bodies during steps.
+
+        Statistics are only collected while :py:attr:`Space.track_contacts`
+        is enabled. They replace post_solve callbacks that read
+        :py:attr:`Arbiter.total_impulse` and :py:attr:`Arbiter.total_ke`,
+        e.g., to compute damage or sound volumes. Each row has the fields:
+
+        * normal_impulse: sum of the normal impulses applied to the body;
+        * max_impulse: largest impulse applied by a single collision in a
+          single step;
+        * kinetic_energy: energy lost in collisions of the body;
+        * collisions: number of collisions solved, counted once per step.
+
+        Collisions with sensors, ignored collisions and collisions of sleeping
+        bodies are not included.
+
+        >>> space = mk.Space(gravity=(0, -10), track_contacts=True)
+        >>> ball = mk.Body(1, 1, space=space).create_circle(1)
+        >>> floor = space.static_body.create_segment((-5, -1.5), (5, -1.5), 0)
+        >>> _ = space.step_many(0.05, 10)
+        >>> stats = space.get_contact_stats()
+        >>> bool(stats["normal_impulse"][0] > 0), bool(stats["collisions"][0] > 0)
+        (True, True)
+
+        Args:
+            out:
+                Optional array of dtype ``stats.dtype`` and shape (n,) that
+                receives the result. A new array is allocated if not given.
+            bodies:
+                Sequence of bodies to read. If not given, read all bodies in
+                the space, one row per slot (see :py:attr:`Body.slot`). Rows
+                of empty slots are filled with zeros.
+            reset:
+                If True, the statistics of the bodies that were read are
+                cleared, so the next call only reports the following steps.
+        """
+        ptrs, n = self._get_body_pointers(bodies)
+        out = out_array(out, (n,), contact_stats_dtype())
+        cp.cpBodyGetContactStats(ptrs, n, cffi_buffer(out, "cpContactStats"), reset)
+        return out
+
+    def set_body_states(
+        self: S,
+        bodies_or_indices: Union[Sequence[Body], Sequence[int], None] = None,
+        *,
+        position: Any = None,
+        angle: Any = None,
+        velocity: Any = None,
+        angular_velocity: Any = None,
+        reindex: bool = False,
+    ) -> S:
+        """Write the state of many bodies at once from NumPy arrays.
+
+        This is the counterpart of :py:meth:`Space.get_body_states`. All
+        values are written in a single pass in C. Arguments that are not given
+        are left untouched and a single value is broadcast to all bodies.
+
+        >>> space = mk.Space()
+        >>> a, b = mk.Body(1, 2, space=space), mk.Body(1, 2, space=space)
+        >>> _ = space.set_body_states([a, b], position=[(1, 2), (3, 4)])
+        >>> b.position
+        Vec2d(3.0, 4.0)
+
+        Args:
+            bodies_or_indices:
+                Either a sequence of bodies or a sequence of body slots (see
+                :py:attr:`Body.slot`). If not given, write to all bodies in
+                the space, in slot order.
+            position:
+                Array of shape (n, 2) with the new positions.
+            angle:
+                Array of shape (n,) with the new angles, in degrees.
+            velocity:
+                Array of shape (n, 2) with the new velocities.
+            angular_velocity:
+                Array of shape (n,) with the new angular velocities, in
+                degrees per second.
+            reindex:
+                If True, reindex the shapes attached to each body. This is
+                only necessary if the space is queried before the next step.
+        """
+        ptrs, indices, n = self._select_bodies(bodies_or_indices)
+        row = cp.cpBodySetStates(
+            ptrs,
+            indices,
+            n,
+            in_buffer(position, (n, 2), "cpVect", "position"),
+            in_buffer(angle, (n,), "cpFloat", "angle"),
+            in_buffer(velocity, (n, 2), "cpVect", "velocity"),
+            in_buffer(angular_velocity, (n,), "cpFloat", "angular_velocity"),
+            reindex,
+        )
+        self._check_selected_row(indices, row)
+        return self
+
+    def apply_forces(
+        self: S,
+        slots: Union[Sequence[int], Sequence[Body], None],
+        forces: Any = None,
+        points: Any = None,
+        torques: Any = None,
+    ) -> S:
+        """Apply forces and torques to many bodies at once from NumPy arrays.
+
+        This is equivalent to calling :py:meth:`Body.apply_force_at_world_point`
+        and :py:meth:`Body.apply_torque` for each body, but runs in a single
+        loop in C. As with :py:attr:`Body.force`, the accumulated forces are
+        reset after each step.
+
+        Args:
+            slots:
+                Sequence of body slots (see :py:attr:`Body.slot`) or bodies.
+                If None, apply to all bodies in slot order.
+            forces:
+                Array of shape (n, 2) with forces in world coordinates.
+            points:
+                Array of shape (n, 2) with the world points where each force
+                is applied. If not given, forces are applied to the center of
+                gravity and do not produce torques.
+            torques:
+                Array of shape (n,) with additional torques.
+        """
+        ptrs, indices, n = self._select_bodies(slots)
+        row = cp.cpBodyApplyForces(
+            ptrs,
+            indices,
+            n,
+            in_buffer(forces, (n, 2), "cpVect", "forces"),
+            in_buffer(points, (n, 2), "cpVect", "points"),
+            in_buffer(torques, (n,), "cpFloat", "torques"),
+        )
+        self._check_selected_row(indices, row)
+        return self
+
+    def apply_impulses(
+        self: S,
+        slots: Union[Sequence[int], Sequence[Body], None],
+        impulses: Any = None,
+        points: Any = None,
+        angular_impulses: Any = None,
+    ) -> S:
+        """Apply impulses to many bodies at once from NumPy arrays.
+
+        This is equivalent to calling
+        :py:meth:`Body.apply_impulse_at_world_point` for each body, but runs
+        in a single loop in C. Impulses change the velocities immediately.
+
+        Args:
+            slots:
+                Sequence of body slots (see :py:attr:`Body.slot`) or bodies.
+                If None, apply to all bodies in slot order.
+            impulses:
+                Array of shape (n, 2) with impulses in world coordinates.
+            points:
+                Array of shape (n, 2) with the world points where each impulse
+                is applied. If not given, impulses are applied to the center
+                of gravity.
+            angular_impulses:
+                Array of shape (n,) with additional angular impulses.
+        """
+        ptrs, indices, n = self._select_bodies(slots)
+        row = cp.cpBodyApplyImpulses(
+            ptrs,
+            indices,
+            n,
+            in_buffer(impulses, (n, 2), "cpVect", "impulses"),
+            in_buffer(points, (n, 2), "cpVect", "points"),
+            in_buffer(angular_impulses, (n,), "cpFloat", "angular_impulses"),
+        )
+        self._check_selected_row(indices, row)
+        return self
+
+    def _select_bodies(
+        self, bodies_or_slots: Union[Sequence[Body], Sequence[int], None]
+    ) -> Tuple[Any, Any, int]:
+        """Return the (bodies, indices, count) arguments of the batch C
+        functions for a sequence of bodies, a sequence of slots or None (all
+        slots).
+        """
+        if bodies_or_slots is None:
+            ptrs, n = self._get_body_pointers()
+            return ptrs, ffi.NULL, n
+        elif is_index_sequence(bodies_or_slots):
+            ptrs, size = self._get_body_pointers()
+            idx = index_array(bodies_or_slots, size, name="slots")
+            return ptrs, cffi_buffer(idx, "intptr_t"), len(idx)
+        else:
+            ptrs, n = self._get_body_pointers(cast(Sequence[Body], bodies_or_slots))
+            return ptrs, ffi.NULL, n
+
+    def _check_selected_row(self, indices: Any, row: int) -> None:
+        """Raise an IndexError if a batch C function reported an empty slot."""
+        if row != -1:
+            raise IndexError(f"no body at slot {indices[row]}")
+
+    def _get_object_pointers(self) -> Tuple[Any, Any]:
+        """Return C arrays with pointers to all shapes and constraints.
+
+        The arrays are cached until a shape or constraint is added or removed.
+        """
+        if self._object_ptrs is None:
+            shapes = [get_cffi_ref(s) for s in self._shapes.values()]
+            constraints = [get_cffi_ref(c) for c in self._constraints]
+            self._object_ptrs = (
+                ffi.new("cpShape *[]", shapes),
+                ffi.new("cpConstraint *[]", constraints),
+            )
+        return self._object_ptrs
+
+    def snapshot(self) -> bytes:
+        """Save the simulation state of the space to a compact binary blob.
+
+        The snapshot holds the motion state of all bodies, the friction,
+        elasticity and surface velocity of shapes, the state of constraints
+        (including accumulated impulses), the arbiter cache with its contacts
+        and the sleeping state of bodies. It is taken in C without touching
+        the Python objects and can be restored with :py:meth:`Space.restore`.
+
+        A snapshot refers to the objects of the space by their address in
+        memory. It can only be restored in the same space, while it holds the
+        same bodies, shapes and constraints, and it cannot be pickled or sent
+        to another process.
+
+        >>> space = mk.Space(gravity=(0, -10))
+        >>> body = mk.Body(1, 2, space=space)
+        >>> blob = space.snapshot()
+        >>> _ = space.step(1).restore(blob)
+        >>> body.position
+        Vec2d(0.0, 0.0)
+        """
+        if self._locked or cp.cpSpaceIsLocked(self._cffi_ref):
+            raise ValueError("cannot take a snapshot during a step or query")
+        shapes, constraints = self._get_object_pointers()
+        args = (
+            self._cffi_ref,
+            self._slot_ptrs,
+            len(self._slots),
+            shapes,
+            len(shapes),
+            constraints,
+            len(constraints),
+        )
+        buffer = bytearray(cp.cpSpaceSnapshot(*args, ffi.NULL, 0))
+        cp.cpSpaceSnapshot(*args, ffi.from_buffer(buffer), len(buffer))
+        return bytes(buffer)
+
+    def restore(self: S, snapshot: bytes) -> S:
+        """Restore a snapshot created by :py:meth:`Space.snapshot`.
+
+        The state is written back in place: no Python objects are created and
+        no collision callbacks are called for arbiters that are dropped or
+        restored. Parameters of the space, such as gravity or damping, are not
+        part of the snapshot.
+
+        The broadphase is updated with the restored positions, but its
+        internal layout is not saved. Simulations continued from a restored
+        snapshot are therefore only guaranteed to match the original run up
+        to floating point rounding.
+
+        Raises a ValueError if the snapshot was not created by this space or
+        if bodies, shapes or constraints were added or removed since then.
+        """
+        if self._locked:
+            raise ValueError("cannot restore a snapshot during a step")
+        shapes, constraints = self._get_object_pointers()
+        error = cp.cpSpaceRestore(
+            self._cffi_ref,
+            self._slot_ptrs,
+            len(self._slots),
+            shapes,
+            len(shapes),
+            constraints,
+            len(constraints),
+            ffi.from_buffer(snapshot),
+            len(snapshot),
+        )
+        if error:
+            raise ValueError(_SNAPSHOT_ERRORS[error])
+        return self
+
+    def has_python_callbacks(self) -> bool:
+        """Return True if a step of the space might call Python code.
+
+        This is the case when the space has collision handlers with Python
+        callbacks (even if they were reset to None), bodies with custom
+        velocity or position functions, velocity hooks, constraints with pre
+        or post solve functions or queued post step callbacks. Steps of other spaces run
+        entirely in C and do not hold the GIL.
+
+        >>> space = mk.Space()
+        >>> space.has_python_callbacks()
+        False
+        >>> _ = space.default_collision_handler(begin=lambda *args: True)
+        >>> space.has_python_callbacks()
+        True
+        """
+        self._python_callbacks = self._find_python_callbacks()
+        return self._python_callbacks
+
+    def _find_python_callbacks(self) -> bool:
+        if self._post_step_callbacks or self._velocity_hooks:
+            return True
+        for handler in self._handlers.values():
+            if handler.has_callbacks():
+                return True
+        for body in self._bodies:
+            if body._velocity_func is not None or body._position_func is not None:
+                return True
+        for constraint in self._constraints:
+            if constraint.pre_solve is not None or constraint.post_solve is not None:
+                return True
+        return False
+
     def step(self: S, dt: float) -> S:
         """Update the space for the given time step.
 
@@ -726,6 +1406,13 @@ class Space(MakeShapeMixin, PickleMixin):
         Args:
             dt: Time step length
         """
+        if (
+            self._timings is not None
+            or self._thread_tuner is not None
+            or self._track_contacts
+        ):
+            return self.step_many(dt, 1)
+
         try:
             self._locked = True
             if self.threaded:
@@ -736,16 +1423,303 @@ class Space(MakeShapeMixin, PickleMixin):
         finally:
             self._locked = False
 
+        self._collect_broken_constraints()
+        self._flush_step_queue()
+        return self
+
+    def step_many(self: S, dt: float, n: int) -> S:
+        """Update the space for n time steps of length dt.
+
+        This is equivalent to calling :py:meth:`Space.step` n times, but the
+        steps run in a loop in C. The loop only returns to Python to add or
+        remove objects and to call post step callbacks after a step in which
+        they were queued.
+
+        >>> s = mk.Space(gravity=(0, -10))
+        >>> body = mk.Body(1, 2, space=s)
+        >>> _ = s.step_many(0.01, 100)
+        >>> round(body.velocity.y, 6)
+        -10.0
+
+        Args:
+            dt: Time step length
+            n: Number of steps
+        """
+        stats = self._start_profile()
+        self._run_steps(dt, n, stats)
+        self._finish_profile(stats)
+        return self
+
+    def step_async(self, dt: float, n: int = 1) -> Future:
+        """Run n steps of length dt in a background thread.
+
+        Return a :py:class:`concurrent.futures.Future` whose result is the
+        space. Before the step starts, the body states are copied to
+        :py:attr:`Space.frame_states`, so other threads can render the last
+        complete frame while the step runs. The step itself releases the GIL
+        while it runs in C.
+
+        The space must not be modified, queried or drawn until the future is
+        done. Only one asynchronous step can run at a time, a RuntimeError is
+        raised otherwise.
+
+        Steps run in a thread pool shared by all spaces, with at most one
+        thread per CPU, so spaces do not keep threads of their own.
+
+        >>> s = mk.Space(gravity=(0, -10))
+        >>> body = mk.Body(1, 2, space=s)
+        >>> future = s.step_async(1)
+        >>> s.frame_states["velocity"]
+        array([[0., 0.]])
+        >>> future.result() is s
+        True
+        >>> body.velocity
+        Vec2d(0.0, -10.0)
+        """
+        if self._step_future is not None and not self._step_future.done():
+            raise RuntimeError("an asynchronous step is already running")
+        states = self.get_body_states()
+        states.flags.writeable = False
+        self._frame_states = states
+        executor = get_step_executor(os.getpid())
+        self._step_future = executor.submit(self.step_many, dt, n)
+        return self._step_future
+
+    @property
+    def frame_states(self) -> Optional["numpy.ndarray"]:
+        """Read-only body states taken by the last call to
+        :py:meth:`Space.step_async`, before the step started.
+
+        The array has the same layout as :py:meth:`Space.get_body_states` and
+        is never modified, so it is safe to read from any thread. It is None
+        before the first asynchronous step.
+        """
+        return self._frame_states
+
+    def _run_steps(self, dt: float, n: int, stats: Any) -> None:
+        if self._thread_tuner is None:
+            self._step_loop(dt, n, stats)
+        else:
+            self._thread_tuner.run(self, dt, n, stats)
+
+    def _step_loop(self, dt: float, n: int, stats: Any) -> None:
+        while n > 0:
+            try:
+                self._locked = True
+                n -= cp.cpSpaceStepMany(
+                    self._cffi_ref,
+                    dt,
+                    n,
+                    self.threaded,
+                    self._track_contacts,
+                    self._step_queued,
+                    stats,
+                )
+                self._removed_shapes = {}
+            finally:
+                self._locked = False
+
+            self._collect_broken_constraints()
+            if self._step_queued[0]:
+                self._flush_step_queue()
+
+    def _collect_broken_constraints(self) -> None:
+        """Remove the constraints broken during the last steps from the Python
+        side of the space. See :py:attr:`Constraint.max_impulse`."""
+        n = cp.cpSpaceCountBrokenConstraints(self._cffi_ref)
+        if not n:
+            return
+        handles = ffi.new("void *[]", n)
+        cp.cpSpaceDrainBrokenConstraints(self._cffi_ref, handles)
+        for handle in handles:
+            constraint = ffi.from_handle(handle)
+            self._remove_constraint(constraint, True)
+            self._broken_constraints.append(constraint)
+
+    def _start_profile(self) -> Any:
+        """Reset the timers and return the stats struct filled by the C step
+        loop, or NULL if stats are disabled."""
+        if self._timings is None:
+            return ffi.NULL
+        for key in self._timings:
+            self._timings[key] = 0.0
+        self._profile_start = perf_counter()
+        return ffi.new("cpSpaceStepStats *")
+
+    def _finish_profile(self, stats: Any) -> None:
+        if stats == ffi.NULL or self._timings is None:
+            return
+        total = perf_counter() - self._profile_start
+        values: Dict[str, Any] = {k: getattr(stats, k) for k in C_STATS}
+        values.update(self._timings)
+        self._stats = StepStats(total=total, **values)
+
+    def autotune_threads(
+        self: S,
+        enable: bool = True,
+        *,
+        max_threads: Optional[int] = None,
+        trial_steps: int = 10,
+        interval: int = 2000,
+        rebalance: float = 0.5,
+    ) -> S:
+        """Let the space choose the fastest number of solver threads.
+
+        The following steps are used as a benchmark: each possible thread
+        count runs for trial_steps steps and the fastest is kept in
+        :py:attr:`Space.threads`. The trials are repeated every interval
+        steps and when the number of bodies changes by more than the
+        rebalance fraction, so the choice follows the scene as it grows or
+        shrinks.
+
+        Only spaces created with threaded=True are tuned, this method has no
+        effect on other spaces. Note that the threaded solver is not
+        deterministic when it uses more than one thread.
+
+        >>> space = mk.Space(threaded=True).autotune_threads()
+        >>> _ = space.step_many(0.01, 100)
+
+        Args:
+            enable:
+                If False, stop tuning and keep the current thread count.
+            max_threads:
+                Largest thread count tried. Defaults to the number of CPUs.
+                The threaded solver might support fewer threads.
+            trial_steps:
+                Number of steps timed for each thread count.
+            interval:
+                Number of steps between trials.
+            rebalance:
+                Relative change in the number of bodies that starts new
+                trials.
+        """
+        if not enable or not self.threaded:
+            self._thread_tuner = None
+            return self
+
+        current = self.threads
+        candidates = []
+        for n in range(1, (max_threads or os.cpu_count() or 1) + 1):
+            self.threads = n
+            if self.threads not in candidates:
+                candidates.append(self.threads)
+        self.threads = current
+        self._thread_tuner = ThreadTuner(candidates, trial_steps, interval, rebalance)
+        return self
+
+    def advance(self, real_dt: float, fixed_dt: float, max_substeps: int = 8) -> int:
+        """Advance the simulation by real_dt seconds using fixed time steps.
+
+        The elapsed time is added to an accumulator and as many steps of
+        length fixed_dt as fit in it are run with :py:meth:`Space.step_many`.
+        The time left in the accumulator is used to interpolate the poses
+        returned by :py:meth:`Space.get_interpolated_poses`, so rendering is
+        smooth even if the frame rate is not a multiple of the physics rate.
+
+        Call it once per frame with the frame duration and render the
+        interpolated poses.
+
+        >>> s = mk.Space()
+        >>> body = mk.Body(1, 2, space=s, velocity=(1, 0))
+        >>> s.advance(0.25, 0.1)
+        2
+        >>> s.get_interpolated_poses()["position"]
+        array([[0.15, 0.  ]])
+
+        Args:
+            real_dt:
+                Time elapsed since the last call, usually the frame duration.
+            fixed_dt:
+                Length of each simulation step.
+            max_substeps:
+                Maximum number of steps taken in a single call. If the
+                simulation falls behind, the extra time is discarded rather
+                than accumulated, so a slow frame does not make the next ones
+                even slower.
+
+        Returns:
+            The number of steps taken.
+        """
+        if fixed_dt <= 0:
+            raise ValueError(f"fixed_dt must be positive, got {fixed_dt}")
+        self._accumulator += real_dt
+
+        # Tolerate rounding errors in the accumulator, so that three frames of
+        # 0.1s run three steps of 0.1s.
+        steps = int(self._accumulator / fixed_dt + 1e-9)
+        if steps > max_substeps:
+            steps = max_substeps
+            self._accumulator = steps * fixed_dt
+
+        if steps:
+            stats = self._start_profile()
+            self._run_steps(fixed_dt, steps - 1, stats)
+            self._prev_poses = self._interpolate_poses(None, 1.0, None)
+            self._run_steps(fixed_dt, 1, stats)
+            self._finish_profile(stats)
+            self._accumulator = max(self._accumulator - steps * fixed_dt, 0.0)
+        self._alpha = self._accumulator / fixed_dt
+        return steps
+
+    def get_interpolated_poses(
+        self, out: Optional["numpy.ndarray"] = None
+    ) -> "numpy.ndarray":
+        """Return the positions and angles of all bodies for rendering.
+
+        Poses are blended between the two last steps taken by
+        :py:meth:`Space.advance`, according to the time left in its
+        accumulator. The result is a NumPy structured array with the fields
+        "position" and "angle" (in degrees), with one row per body slot (see
+        :py:attr:`Body.slot`). Rows of empty slots are filled with NaN.
+
+        Bodies added after the last step and spaces that were never advanced
+        report their current pose.
+
+        Args:
+            out:
+                Optional array of dtype ``poses.dtype`` and shape (n,) that
+                receives the result. A new array is allocated if not given.
+        """
+        return self._interpolate_poses(self._prev_poses, self._alpha, out)
+
+    def _interpolate_poses(
+        self,
+        prev: Optional["numpy.ndarray"],
+        alpha: float,
+        out: Optional["numpy.ndarray"],
+    ) -> "numpy.ndarray":
+        ptrs, n = self._get_body_pointers()
+        out = out_array(out, (n,), body_pose_dtype())
+        if prev is None:
+            prev_ptr, num_prev = ffi.NULL, 0
+        else:
+            prev_ptr, num_prev = cffi_buffer(prev, "cpBodyPose"), len(prev)
+        cp.cpBodyInterpolatePoses(
+            ptrs, n, prev_ptr, num_prev, alpha, cffi_buffer(out, "cpBodyPose")
+        )
+        return out
+
+    def _flush_step_queue(self) -> None:
+        """Perform the additions, removals and post step callbacks queued
+        during a step."""
+        timings = self._timings
+        start = perf_counter() if timings is not None else 0.0
         self.add(*self._add_later)
         self._add_later.clear()
         self.discard(*set(self._remove_later))
         self._remove_later.clear()
 
+        if timings is not None:
+            now = perf_counter()
+            timings["deferred"] += now - start
+            start = now
         for key in self._post_step_callbacks:
             self._post_step_callbacks[key](self)
+        if timings is not None:
+            timings["post_step_callbacks"] += perf_counter() - start
 
         self._post_step_callbacks = {}
-        return self
+        self._step_queued[0] = 0
 
     def collision_handler(self, a: ColType, b: ColType, **kwargs) -> CollisionHandler:
         f"""Define the :py:class:`CollisionHandler` for collisions between
@@ -772,7 +1746,7 @@ class Space(MakeShapeMixin, PickleMixin):
             handler = self._handlers[key]
         except KeyError:
             ptr = cp.cpSpaceAddCollisionHandler(self._cffi_ref, a, b)
-            self._handlers[key] = handler = CollisionHandler(ptr, self)
+            self._handlers[key] = handler = CollisionHandler(ptr, self, key)
 
         handler.update(kwargs)
         return handler
@@ -804,7 +1778,7 @@ class Space(MakeShapeMixin, PickleMixin):
             return self._handlers[col_type]
         except KeyError:
             ptr = cp.cpSpaceAddWildcardHandler(self._cffi_ref, col_type)
-            self._handlers[col_type] = handler = CollisionHandler(ptr, self)
+            self._handlers[col_type] = handler = CollisionHandler(ptr, self, col_type)
 
         handler.update(kwargs)
         return handler
@@ -829,6 +1803,172 @@ class Space(MakeShapeMixin, PickleMixin):
         handler.update(kwargs)
         return handler
 
+    def collision_rule(
+        self,
+        a: ColType,
+        b: ColType,
+        *,
+        ignore: bool = False,
+        sensor: bool = False,
+        friction: Optional[float] = None,
+        elasticity: Optional[float] = None,
+        surface_velocity: Optional[VecLike] = None,
+    ) -> CollisionHandler:
+        """Declare how collisions between objects of type "a" and "b" are
+        processed, without Python callbacks.
+
+        The rule is evaluated in C by the handler returned by
+        :py:meth:`Space.collision_handler`, see
+        :py:attr:`CollisionHandler.rule`. It can be used in native spaces.
+
+        >>> space = mk.Space(gravity=(0, -10))
+        >>> ball = mk.Body(1, 1, space=space).create_circle(1, collision_type=1)
+        >>> floor = space.static_body.create_segment((-5, -1.5), (5, -1.5), 0)
+        >>> _ = space.collision_rule(0, 1, ignore=True)
+        >>> _ = space.step_many(0.1, 10)
+        >>> ball.body.position.y < -2
+        True
+
+        Args:
+            a: Collision type a
+            b: Collision type b
+            ignore:
+                Ignore collisions entirely.
+            sensor:
+                Detect contacts, but do not apply a collision response.
+            friction:
+                Friction used instead of the one computed from the shapes.
+            elasticity:
+                Elasticity used instead of the one computed from the shapes.
+            surface_velocity:
+                Surface velocity used instead of the one computed from the
+                shapes.
+        """
+        handler = self.collision_handler(a, b)
+        handler.rule = CollisionRule(
+            ignore, sensor, friction, elasticity, surface_velocity
+        )
+        return handler
+
+    def drain_collision_events(self) -> "numpy.ndarray":
+        """Return and clear the collision events recorded since the last call.
+
+        Events are recorded by collision handlers in C, see
+        :py:attr:`CollisionHandler.recorded_events`. The result is a NumPy
+        structured array with one row per event and the fields:
+
+        * event: 0 for "begin", 1 for "post_solve" and 2 for "separate";
+        * first_contact: True in the first step the shapes touch;
+        * shape_a, shape_b: ids of the shapes, in the order of the collision
+          types of the handler (see :py:meth:`Space.shape_from_id`);
+        * normal: normal of the collision, from shape_a to shape_b;
+        * total_impulse, total_ke: impulse applied and energy lost in the
+          collision, only meaningful in "post_solve" events.
+
+        >>> space = mk.Space(gravity=(0, -10))
+        >>> space.collision_handler(0, 0).recorded_events = ["begin"]
+        >>> ball = mk.Body(1, 1, space=space).create_circle(1)
+        >>> floor = space.static_body.create_segment((-5, -1.5), (5, -1.5), 0)
+        >>> _ = space.step_many(0.05, 10)
+        >>> events = space.drain_collision_events()
+        >>> events["event"].tolist()
+        [0]
+        >>> len(space.drain_collision_events())
+        0
+        """
+        n = cp.cpSpaceCountCollisionEvents(self._cffi_ref)
+        out = out_array(None, (n,), collision_event_dtype())
+        if n:
+            buffer = cffi_buffer(out, "cpCollisionEvent")
+            cp.cpSpaceDrainCollisionEvents(self._cffi_ref, buffer)
+        return out
+
+    def drain_broken_constraints(self) -> List[Constraint]:
+        """Return and clear the list of constraints broken since the last call.
+
+        Constraints break when they exceed :py:attr:`Constraint.max_impulse`
+        or :py:attr:`Constraint.break_force`. They are removed from the space
+        at the end of the step in which they break, in C, and reported in the
+        order they broke.
+        """
+        broken = self._broken_constraints
+        self._broken_constraints = []
+        return broken
+
+    def shape_from_id(self, shape_id: int) -> Shape:
+        """Return the shape of the space with the given id.
+
+        Shape ids are used in the arrays returned by
+        :py:meth:`Space.drain_collision_events` and by the batched queries,
+        such as :py:meth:`Space.segment_query_first_batch`. Raises a KeyError
+        for ids of shapes that are not in the space.
+        """
+        try:
+            return self._shapes[shape_id]
+        except KeyError:
+            return self._removed_shapes[shape_id]
+
+    def add_velocity_hook(
+        self, bodies: Sequence[Body], func: Callable[..., Any]
+    ) -> VelocityHook:
+        """Update the velocities of a group of bodies with a single Python
+        call per step.
+
+        The hook replaces the velocity functions of the bodies. On each step,
+        it is called once as ``func(velocities, positions, masses, gravity,
+        damping, dt)`` with NumPy arrays holding the linear velocities,
+        positions and masses of all bodies in the group. It can modify the
+        velocities array in place or return a new array of shape (n, 2) with
+        the updated velocities, which are written back in C. The velocities
+        passed to the hook already include the forces applied to the bodies,
+        but the hook must apply gravity and damping itself. Angular
+        velocities are integrated as usual.
+
+        >>> space = mk.Space(gravity=(0, -10))
+        >>> bodies = [mk.Body(1, 2, space=space) for _ in range(3)]
+        >>> def half_gravity(velocities, positions, masses, gravity, damping, dt):
+        ...     velocities += gravity * (dt / 2)
+        >>> hook = space.add_velocity_hook(bodies, half_gravity)
+        >>> _ = space.step(1)
+        >>> bodies[0].velocity
+        Vec2d(0.0, -5.0)
+
+        Bodies must be dynamic, belong to the space and cannot be in more than
+        one hook. Do not set their velocity_func while the hook is installed.
+        Bodies removed from the space are also removed from the hook, which
+        is discarded when it becomes empty. Sleeping bodies are passed to the
+        hook, but their velocities are not updated.
+
+        .. Note::
+            Velocity hooks are not included in pickle / copy of the space.
+
+        Returns:
+            The hook, which can be removed with
+            :py:meth:`Space.remove_velocity_hook`.
+        """
+        self._check_native("velocity hooks")
+        hooked = {b for hook in self._velocity_hooks for b in hook.bodies}
+        for body in bodies:
+            if body not in self._bodies or body.body_type != Body.DYNAMIC:
+                raise ValueError(f"{body} is not a dynamic body of the space")
+            if body in hooked:
+                raise ValueError(f"{body} already belongs to a velocity hook")
+        if len(set(bodies)) != len(bodies):
+            raise ValueError("bodies must be distinct")
+
+        hook = VelocityHook(self, bodies, func)
+        hook._attach()
+        self._velocity_hooks.append(hook)
+        return hook
+
+    def remove_velocity_hook(self, hook: VelocityHook) -> None:
+        """Remove a hook created by :py:meth:`Space.add_velocity_hook`.
+
+        The bodies of the hook get back the default velocity function.
+        """
+        self._velocity_hooks.remove(hook)
+        hook._detach()
+
     def add_post_step_callback(
         self,
         callback_function: Callable[..., None],
@@ -865,6 +2005,7 @@ class Space(MakeShapeMixin, PickleMixin):
         :return: True if key was not previously added, False otherwise
         """
 
+        self._check_native("post step callbacks")
         if key in self._post_step_callbacks:
             return False
 
@@ -872,6 +2013,7 @@ class Space(MakeShapeMixin, PickleMixin):
             callback_function(self, key, *args, **kwargs)
 
         self._post_step_callbacks[key] = f
+        self._step_queued[0] = 1
         return True
 
     # noinspection PyShadowingBuiltins
@@ -893,21 +2035,41 @@ class Space(MakeShapeMixin, PickleMixin):
         Result:
             A list of point queries.
         """
-
-        @ffi.callback("cpSpacePointQueryFunc")
-        def cb(shape, pt, dist, gradient, _data):
-            shape = shape_from_cffi(self, shape)
-            if shape:
-                vec = Vec2d(pt.x, pt.y)
-                grad = Vec2d(gradient.x, gradient.y)
-                result.append(PointQueryInfo(shape, vec, dist, grad))
-
+        filter = filter or ShapeFilter()
+        hits, n = self._collect_hits(
+            "cpPointHit", cp.cpSpacePointQueryCollect, point, distance, filter
+        )
         result: List[PointQueryInfo] = []
-        filter_ = filter or ShapeFilter()
-        data = ffi.new_handle(self)
-        cp.cpSpacePointQuery(self._cffi_ref, point, distance, filter_, cb, data)
+        for i in range(n):
+            hit = hits[i]
+            shape = self._shape_from_hit(hit)
+            if shape is not None:
+                vec = Vec2d(hit.point.x, hit.point.y)
+                grad = Vec2d(hit.gradient.x, hit.gradient.y)
+                result.append(PointQueryInfo(shape, vec, hit.distance, grad))
         return result
 
+    # noinspection PyShadowingBuiltins
+    def point_query_array(
+        self, point: VecLike, distance: float = 0, filter: Optional[ShapeFilter] = None
+    ) -> "numpy.ndarray":
+        """Same as :py:meth:`Space.point_query`, but return the hits as a NumPy
+        structured array.
+
+        The array has the same fields as the result of
+        :py:meth:`Space.point_query_nearest_batch`, with one row per hit. Hits
+        are collected in C, so no Python objects are created for them.
+        """
+        filter = filter or ShapeFilter()
+        return self._query_array(
+            "cpPointHit",
+            point_hit_dtype(),
+            cp.cpSpacePointQueryCollect,
+            point,
+            distance,
+            filter,
+        )
+
     # noinspection PyShadowingBuiltins
     def point_query_nearest(
         self, point: VecLike, distance: float = 0.0, filter: ShapeFilter = None
@@ -937,6 +2099,64 @@ class Space(MakeShapeMixin, PickleMixin):
             return PointQueryInfo(shape, pos, info.distance, grad)
         return None
 
+    # noinspection PyShadowingBuiltins
+    def point_query_nearest_batch(
+        self,
+        points: Any,
+        max_distance: float = 0.0,
+        filter: Optional[ShapeFilter] = None,
+        out: Optional["numpy.ndarray"] = None,
+    ) -> "numpy.ndarray":
+        """Run :py:meth:`Space.point_query_nearest` for many points at once.
+
+        All queries run in a single loop in C, without creating Python objects
+        for the results. This is useful to sample the distance field of the
+        space, e.g., as proximity features. The result is a NumPy structured
+        array with one row per point and the fields:
+
+        * point, distance, gradient: as in :py:class:`PointQueryInfo`. Misses
+          report the query point, distance = max_distance and a zero gradient;
+        * shape: id of the nearest shape (see :py:meth:`Space.shape_from_id`),
+          or -1 for misses;
+        * body: slot of the body of the nearest shape (see
+          :py:attr:`Body.slot`), or -1 for misses and for bodies without
+          slots, such as the static body of the space.
+
+        Like :py:meth:`Space.point_query_nearest`, sensor shapes are ignored.
+
+        >>> space = mk.Space()
+        >>> ball = mk.Body(1, 1, space=space).create_circle(1)
+        >>> hits = space.point_query_nearest_batch([(3, 0), (0, 5)], 4)
+        >>> hits["distance"]
+        array([2., 4.])
+        >>> hits["body"].tolist()
+        [0, -1]
+
+        Args:
+            points:
+                Array of shape (n, 2) with the query points.
+            max_distance:
+                Largest distance searched, as in
+                :py:meth:`Space.point_query_nearest`.
+            filter:
+                Shape filter applied to all queries.
+            out:
+                Optional array of dtype ``hits.dtype`` and shape (n,) that
+                receives the result. A new array is allocated if not given.
+        """
+        (points,) = query_arrays(points)
+        n = len(points)
+        out = out_array(out, (n,), point_hit_dtype())
+        cp.cpSpacePointQueryNearestBatch(
+            self._cffi_ref,
+            cffi_buffer(points, "cpVect"),
+            n,
+            max_distance,
+            filter or ShapeFilter(),
+            cffi_buffer(out, "cpPointHit"),
+        )
+        return out
+
     # noinspection PyShadowingBuiltins
     def segment_query(
         self,
@@ -962,20 +2182,53 @@ class Space(MakeShapeMixin, PickleMixin):
             :py:meth:`Space.segment_query_first` they are not)
         """
 
-        @ffi.callback("cpSpaceSegmentQueryFunc")
-        def cb(ptr, point, normal, alpha, _data):
-            shape = shape_from_cffi(self, ptr)
-            if shape:
-                pt = Vec2d(point.x, point.y)
-                normal = Vec2d(normal.x, normal.y)
-                query_hits.append(SegmentQueryInfo(shape, pt, normal, alpha))
-
-        query_hits: List[SegmentQueryInfo] = []
         filter = filter or ShapeFilter()
-        data = ffi.new_handle(self)
-        cp.cpSpaceSegmentQuery(self._cffi_ref, start, end, radius, filter, cb, data)
+        hits, n = self._collect_hits(
+            "cpSegmentHit", cp.cpSpaceSegmentQueryCollect, start, end, radius, filter
+        )
+        query_hits: List[SegmentQueryInfo] = []
+        for i in range(n):
+            hit = hits[i]
+            shape = self._shape_from_hit(hit)
+            if shape is not None:
+                pt = Vec2d(hit.point.x, hit.point.y)
+                normal = Vec2d(hit.normal.x, hit.normal.y)
+                query_hits.append(SegmentQueryInfo(shape, pt, normal, hit.alpha))
         return query_hits
 
+    # noinspection PyShadowingBuiltins
+    def segment_query_array(
+        self,
+        start: VecLike,
+        end: VecLike,
+        radius: float = 0.0,
+        filter: Optional[ShapeFilter] = None,
+    ) -> "numpy.ndarray":
+        """Same as :py:meth:`Space.segment_query`, but return the hits as a
+        NumPy structured array.
+
+        The array has the same fields as the result of
+        :py:meth:`Space.segment_query_first_batch`, with one row per hit. Hits
+        are collected in C, so no Python objects are created for them.
+
+        >>> space = mk.Space()
+        >>> for x in (2, 4, 6):
+        ...     _ = space.static_body.create_circle(0.5, (x, 0))
+        >>> hits = space.segment_query_array((0, 0), (5, 0))
+        >>> sorted(hits["point"][:, 0].round(6).tolist())
+        [1.5, 3.5]
+        """
+        filter = filter or ShapeFilter()
+        return self._query_array(
+            "cpSegmentHit",
+            segment_hit_dtype(),
+            cp.cpSpaceSegmentQueryCollect,
+            start,
+            end,
+            radius,
+            filter,
+        )
+
     # noinspection PyShadowingBuiltins
     def segment_query_first(
         self,
@@ -1003,6 +2256,70 @@ class Space(MakeShapeMixin, PickleMixin):
             return SegmentQueryInfo(shape, pos, normal, info.alpha)
         return None
 
+    # noinspection PyShadowingBuiltins
+    def segment_query_first_batch(
+        self,
+        starts: Any,
+        ends: Any,
+        radius: float = 0.0,
+        filter: Optional[ShapeFilter] = None,
+        out: Optional["numpy.ndarray"] = None,
+    ) -> "numpy.ndarray":
+        """Run :py:meth:`Space.segment_query_first` for many segments at once.
+
+        All queries run in a single loop in C, without creating Python objects
+        for the hits, which makes it suitable for lidar-like sensors that cast
+        many rays per step. The result is a NumPy structured array with one
+        row per segment and the fields:
+
+        * point, normal, alpha: as in :py:class:`SegmentQueryInfo`. Misses
+          report the end point, a zero normal and alpha = 1;
+        * shape: id of the shape hit (see :py:meth:`Space.shape_from_id`), or
+          -1 for misses;
+        * body: slot of the body of the shape hit (see :py:attr:`Body.slot`),
+          or -1 for misses and for bodies without slots, such as the static
+          body of the space.
+
+        >>> space = mk.Space()
+        >>> wall = space.static_body.create_segment((5, -5), (5, 5), 0)
+        >>> hits = space.segment_query_first_batch((0, 0), [(10, 0), (0, 10)])
+        >>> hits["point"]
+        array([[ 5.,  0.],
+               [ 0., 10.]])
+        >>> space.shape_from_id(int(hits["shape"][0])) is wall
+        True
+        >>> hits["shape"].tolist()[1], hits["body"].tolist()
+        (-1, [-1, -1])
+
+        Args:
+            starts:
+                Array of shape (n, 2) with the start of each segment.
+            ends:
+                Array of shape (n, 2) with the end of each segment. Either
+                starts or ends can be a single point, broadcast to all
+                segments.
+            radius:
+                Radius of the segments.
+            filter:
+                Shape filter applied to all queries.
+            out:
+                Optional array of dtype ``hits.dtype`` and shape (n,) that
+                receives the result. A new array is allocated if not given.
+        """
+        starts, ends = query_arrays(starts, ends, name="starts and ends")
+        n = len(starts)
+        out = out_array(out, (n,), segment_hit_dtype())
+        cp.cpSpaceSegmentQueryFirstBatch(
+            self._cffi_ref,
+            cffi_buffer(starts, "cpVect"),
+            cffi_buffer(ends, "cpVect"),
+            n,
+            radius,
+            filter or ShapeFilter(),
+            cffi_buffer(out, "cpSegmentHit"),
+        )
+        return out
+
     # noinspection PyShadowingBuiltins
     def bb_query(self, bb: "BB", filter: ShapeFilter = None) -> List[Shape]:
         """Query space to find all shapes near bb.
@@ -1014,17 +2331,138 @@ class Space(MakeShapeMixin, PickleMixin):
             Sensor shapes are included in the result
         """
 
-        @ffi.callback("cpSpaceBBQueryFunc")
-        def cb(ptr, _):
-            shape = shape_from_cffi(self, ptr)
-            if shape:
-                query_hits.append(shape)
-
+        filter = filter or ShapeFilter()
+        hits, n = self._collect_hits("cpShapeHit", cp.cpSpaceBBQueryCollect, bb, filter)
         query_hits: List[Shape] = []
-        data = ffi.new_handle(self)
-        cp.cpSpaceBBQuery(self._cffi_ref, bb, filter, cb, data)
+        for i in range(n):
+            shape = self._shape_from_hit(hits[i])
+            if shape is not None:
+                query_hits.append(shape)
         return query_hits
 
+    # noinspection PyShadowingBuiltins
+    def bb_query_array(
+        self, bb: "BB", filter: Optional[ShapeFilter] = None
+    ) -> "numpy.ndarray":
+        """Same as :py:meth:`Space.bb_query`, but return the hits as a NumPy
+        structured array.
+
+        The array has the fields "shape" (the shape id, see
+        :py:meth:`Space.shape_from_id`) and "body" (the slot of the body of
+        the shape, or -1 for bodies without slots), with one row per hit.
+        """
+        filter = filter or ShapeFilter()
+        return self._query_array(
+            "cpShapeHit", shape_hit_dtype(), cp.cpSpaceBBQueryCollect, bb, filter
+        )
+
+    # noinspection PyShadowingBuiltins
+    def bb_query_batch(
+        self, bbs: Any, filter: Optional[ShapeFilter] = None
+    ) -> Tuple["numpy.ndarray", "numpy.ndarray"]:
+        """Run :py:meth:`Space.bb_query` for many bounding boxes at once.
+
+        All queries run in a single loop in C and the hits are returned in
+        compressed sparse row format, as a tuple (offsets, hits). The hits of
+        the i-th box are ``hits[offsets[i]:offsets[i + 1]]``, with the same
+        fields as in :py:meth:`Space.bb_query_array`.
+
+        >>> space = mk.Space()
+        >>> a = space.static_body.create_circle(1, (0, 0))
+        >>> b = space.static_body.create_circle(1, (5, 0))
+        >>> offsets, hits = space.bb_query_batch(
+        ...     [(-1, -1, 1, 1), (-10, -10, 10, 10), (20, 20, 21, 21)]
+        ... )
+        >>> offsets.tolist()
+        [0, 1, 3, 3]
+        >>> space.shape_from_id(int(hits["shape"][0])) is a
+        True
+
+        Args:
+            bbs:
+                Array of shape (n, 4) with the left, bottom, right and top
+                coordinates of each box. A sequence of :py:class:`BB` also
+                works.
+            filter:
+                Shape filter applied to all queries.
+        """
+        (bbs,) = query_arrays(bbs, name="bbs", width=4)
+        n = len(bbs)
+        offsets = out_array(None, (n + 1,), "intp")
+        hits = self._query_array(
+            "cpShapeHit",
+            shape_hit_dtype(),
+            cp.cpSpaceBBQueryBatch,
+            cffi_buffer(bbs, "cpBB"),
+            n,
+            filter or ShapeFilter(),
+            cffi_buffer(offsets, "intptr_t"),
+        )
+        return offsets, hits
+
+    # noinspection PyShadowingBuiltins
+    def rasterize(
+        self,
+        bb: "BB",
+        resolution: float,
+        filter: Optional[ShapeFilter] = None,
+        *,
+        margin: float = 0.0,
+        out: Optional["numpy.ndarray"] = None,
+    ) -> "numpy.ndarray":
+        """Return a boolean occupancy grid of the region bb of the space.
+
+        The grid is computed in C. Shapes are found with the spatial index and
+        each shape only tests the cells inside its bounding box, so this is
+        much faster than a :py:meth:`Space.point_query` per cell.
+
+        The cell ``grid[j, i]`` is the square of side resolution with lower
+        left corner at ``(bb.left + i * resolution, bb.bottom + j * resolution)``.
+        It is occupied when its center is inside a shape or, more generally,
+        within margin of a shape. Use a margin of ``resolution / sqrt(2)`` to
+        mark every cell touched by a shape.
+
+        >>> space = mk.Space()
+        >>> disk = space.static_body.create_circle(2)
+        >>> space.rasterize(mk.BB(-4, -4, 4, 4), 2).astype(int)
+        array([[0, 0, 0, 0],
+               [0, 1, 1, 0],
+               [0, 1, 1, 0],
+               [0, 0, 0, 0]])
+
+        Args:
+            bb:
+                Region of the space covered by the grid. The grid is extended
+                to the right and to the top to fit a whole number of cells.
+            resolution:
+                Side of each cell.
+            filter:
+                Only shapes that pass the filter occupy cells.
+            margin:
+                Largest distance from the center of a cell to a shape.
+            out:
+                Optional boolean array of shape (rows, cols) that receives
+                the result. A new array is allocated if not given.
+        """
+        if resolution <= 0:
+            raise ValueError("resolution must be positive")
+        left, bottom, right, top = bb
+        rows = max(0, math.ceil((top - bottom) / resolution))
+        cols = max(0, math.ceil((right - left) / resolution))
+        out = out_array(out, (rows, cols), "bool")
+        if rows and cols:
+            cp.cpSpaceRasterize(
+                self._cffi_ref,
+                bb,
+                resolution,
+                margin,
+                filter or ShapeFilter(),
+                rows,
+                cols,
+                cffi_buffer(out, "uint8_t"),
+            )
+        return out
+
     def shape_query(self, shape: Shape) -> List[ShapeQueryInfo]:
         """Query a space for any shapes overlapping the given shape
 
@@ -1032,18 +2470,68 @@ class Space(MakeShapeMixin, PickleMixin):
             Sensor shapes are included in the result
         """
 
-        @ffi.callback("cpSpaceShapeQueryFunc")
-        def cb(ptr, points, _):
-            obj = shape_from_cffi(self, ptr)
-            if obj:
-                point_set = contact_point_set_from_cffi(points)
-                query_hits.append(ShapeQueryInfo(obj, point_set))
-
+        hits, n = self._collect_hits(
+            "cpShapeQueryHit", cp.cpSpaceShapeQueryCollect, get_cffi_ref(shape)
+        )
         query_hits: List[ShapeQueryInfo] = []
-        data = ffi.new_handle(self)
-        cp.cpSpaceShapeQuery(self._cffi_ref, get_cffi_ref(shape), cb, data)
+        for i in range(n):
+            hit = hits[i]
+            obj = self._shape_from_hit(hit)
+            if obj is not None:
+                point_set = contact_point_set_from_cffi(hit.set)
+                query_hits.append(ShapeQueryInfo(obj, point_set))
         return query_hits
 
+    def shape_query_array(self, shape: Shape) -> "numpy.ndarray":
+        """Same as :py:meth:`Space.shape_query`, but return the hits as a NumPy
+        structured array.
+
+        Each row has the fields "shape" and "body", as in
+        :py:meth:`Space.bb_query_array`, and the contact point set: "count",
+        "normal" and "points". The last has "point_a", "point_b" and
+        "distance" fields for each of the 2 possible contact points, of which
+        only the first count are valid.
+        """
+        return self._query_array(
+            "cpShapeQueryHit",
+            shape_query_hit_dtype(),
+            cp.cpSpaceShapeQueryCollect,
+            get_cffi_ref(shape),
+        )
+
+    def _collect_hits(self, ctype: str, func: Callable, *args: Any) -> Tuple[Any, int]:
+        """Run a query that collects its hits in C and return a pointer to the
+        hits and their number.
+
+        Each query allocates its own buffer, so queries can run from several
+        threads. The buffer is freed when the returned pointer is garbage
+        collected.
+        """
+        buffer = cp.cpQueryBufferNew(ffi.sizeof(ctype))
+        buffer = ffi.gc(buffer, cp.cpQueryBufferFree)
+        func(self._cffi_ref, *args, buffer)
+        hits = ffi.cast(f"{ctype} *", buffer.data)
+        # The destructor holds a reference to the buffer, keeping it alive.
+        return ffi.gc(hits, lambda _: buffer), buffer.count
+
+    def _query_array(
+        self, ctype: str, dtype: Any, func: Callable, *args: Any
+    ) -> "numpy.ndarray":
+        """Run a query with :py:meth:`Space._collect_hits` and copy the hits
+        to a new array."""
+        hits, n = self._collect_hits(ctype, func, *args)
+        out = out_array(None, (n,), dtype)
+        if n:
+            ffi.memmove(cffi_buffer(out, ctype), hits, n * ffi.sizeof(ctype))
+        return out
+
+    def _shape_from_hit(self, hit: Any) -> Optional[Shape]:
+        """Return the shape of a hit collected in C, or None if it is not
+        known by the space."""
+        id_ = hit.shape
+        shape = self._shapes.get(id_)
+        return self._removed_shapes.get(id_) if shape is None else shape
+
     def debug_draw(
         self: S, options: Union["SpaceDebugDrawOptions", str, None] = None
     ) -> S:
@@ -1094,6 +2582,16 @@ def get_debug_options(opt) -> "SpaceDebugDrawOptions":
     raise ValueError(f"invalid debug draw option: {opt}")
 
 
+@lru_cache
+def get_step_executor(pid: int) -> ThreadPoolExecutor:
+    """Thread pool shared by the asynchronous steps of all spaces.
+
+    It is cached by process id, since the threads of the pool do not survive
+    a fork (e.g. in the workers of a SpacePool).
+    """
+    return ThreadPoolExecutor(os.cpu_count() or 1, thread_name_prefix="easymunk")
+
+
 @sk.curry(2)
 def cffi_free_space(free_cb, cp_space):
     logging.debug("spacefree start %s", cp_space)
@@ -1130,6 +2628,7 @@ def cffi_free_space(free_cb, cp_space):
         cp.cpSpaceRemoveBody(cp_space, cp_body)
 
     logging.debug("spacefree free %s", cp_space)
+    cp.cpSpaceFreeData(cp_space)
     free_cb(cp_space)
 
 
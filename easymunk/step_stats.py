@@ -0,0 +1,102 @@
+__docformat__ = "reStructuredText"
+
+from typing import Any, NamedTuple
+
+
+class StepStats(NamedTuple):
+    """StepStats holds the profile of the last call to :py:meth:`Space.step`
+    or :py:meth:`Space.step_many`, see :py:attr:`Space.stats`.
+
+    Times are wall times in seconds, added up over all the steps of the call.
+    The time of Python callbacks is also included in the phase of the step
+    that runs them. Threaded spaces only report the total, the Python
+    callbacks and the counters.
+
+    Counters describe the state of the space after the last step.
+    """
+
+    steps: int
+    """Number of steps taken."""
+
+    total: float
+    """Total time of the call."""
+
+    integrate_positions: float
+    """Time spent updating the positions of bodies."""
+
+    broadphase: float
+    """Time spent updating the bounding boxes of shapes."""
+
+    narrowphase: float
+    """Time spent finding pairs of shapes with overlapping bounding boxes in
+    the spatial index and computing their contacts, including begin and
+    pre_solve collision callbacks. Chipmunk interleaves both tasks, so they
+    are timed together."""
+
+    contact_graph: float
+    """Time spent rebuilding the contact graph and putting bodies to sleep."""
+
+    prestep: float
+    """Time spent preparing arbiters and constraints for the solver,
+    including separate collision callbacks and constraint pre_solve
+    callbacks."""
+
+    integrate_velocities: float
+    """Time spent updating the velocities of bodies."""
+
+    solver: float
+    """Time spent in the impulse solver iterations."""
+
+    post_solve: float
+    """Time spent in constraint and collision post_solve callbacks."""
+
+    collision_callbacks: float
+    """Time spent in Python collision handler callbacks."""
+
+    body_callbacks: float
+    """Time spent in Python velocity and position functions of bodies."""
+
+    constraint_callbacks: float
+    """Time spent in Python pre_solve and post_solve functions of
+    constraints."""
+
+    deferred: float
+    """Time spent adding and removing objects queued during the step."""
+
+    post_step_callbacks: float
+    """Time spent in post step callbacks."""
+
+    contacts: int
+    """Number of contact points."""
+
+    arbiters: int
+    """Number of pairs of colliding shapes."""
+
+    awake_bodies: int
+    """Number of bodies that are not sleeping or static."""
+
+    islands: int
+    """Number of groups of awake bodies linked by contacts or constraints."""
+
+
+class CallbackStats(NamedTuple):
+    """CallbackStats holds the number of calls and the time spent in a Python
+    callback, see :py:meth:`Space.callback_stats`.
+    """
+
+    kind: str
+    """The kind of callback: "begin", "pre_solve", "post_solve" or
+    "separate" for collision handlers, "velocity_func" or "position_func"
+    for bodies and "constraint_pre_solve" or "constraint_post_solve" for
+    constraints."""
+
+    key: Any
+    """Identifies the callback. Collision handlers use the pair of collision
+    types, the collision type of wildcard handlers or None for the default
+    handler. Other callbacks use the qualified name of the function."""
+
+    calls: int
+    """Number of calls."""
+
+    time: float
+    """Total time in seconds."""
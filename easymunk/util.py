@@ -450,6 +450,13 @@ def void(_) -> None:
     """
 
 
+def callback_name(func: Callable) -> str:
+    """
+    Name used to identify a callback function in profiling reports.
+    """
+    return getattr(func, "__qualname__", None) or type(func).__qualname__
+
+
 def set_attrs(obj: T, **kwargs) -> T:
     """
     Set all given named attributes to object.
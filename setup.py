@@ -41,6 +41,7 @@ setup(
     install_requires=["cffi > 1.14.0", "sidekick"],
     cffi_modules=["easymunk/pymunk_extension_build.py:ffibuilder"],
     extras_require={
+        "numpy": ["numpy"],
         "dev": [
             "pyglet",
             "pygame",
@@ -49,6 +50,7 @@ setup(
             "wheel",
             "matplotlib",
             "pyxel",
+            "numpy",
         ]
     },
     test_suite="tests",
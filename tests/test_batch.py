@@ -0,0 +1,113 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from pytest import approx
+
+import easymunk as p
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class UnitTestSpaceBatch(unittest.TestCase):
+    def _template(self) -> p.Space:
+        s = p.Space(gravity=(0, -10))
+        self.body = p.Body(1, 2, space=s)
+        return s
+
+    def testFromTemplate(self) -> None:
+        template = self._template()
+        with p.SpaceBatch.from_template(template, 3, slots=[0]) as batch:
+            assert len(batch) == 3
+            assert batch.action_size == 2
+            assert len({id(s) for s in batch.spaces}) == 3
+            assert all(s is not template for s in batch.spaces)
+
+        with pytest.raises(ValueError):
+            p.SpaceBatch([template, template], slots=[0])
+
+    def testFromTemplateSlotHoles(self) -> None:
+        template = p.Space()
+        a, b, c = [p.Body(1, 2, position=(x, 0), space=template) for x in (1, 2, 3)]
+        template.remove(a)
+        batch = p.SpaceBatch.from_template(template, 2, slots=[b.slot, c.slot])
+        obs = batch.observe()
+        assert obs["position"][:, :, 0].tolist() == [[2, 3], [2, 3]]
+
+    def testStepForce(self) -> None:
+        batch = p.SpaceBatch.from_template(self._template(), 2, slots=[0])
+        obs = batch.step(0.5, actions=[[2, 0], [4, 0]], substeps=2)
+        assert obs.shape == (2, 1)
+        assert obs["velocity"][:, 0].tolist() == [[2, -10], [4, -10]]
+        assert obs["position"][:, 0, 1] == approx([-2.5, -2.5])
+        batch.close()
+
+    def testActionTypes(self) -> None:
+        template = self._template()
+        batch = p.SpaceBatch.from_template(template, 2, slots=[0], action="torque")
+        assert batch.action_size == 1
+        obs = batch.step(1, actions=[[1], [2]])
+        assert obs["angular_velocity"][:, 0] == approx(np.degrees([0.5, 1]))
+
+        batch = p.SpaceBatch([template], slots=[0], action="velocity")
+        obs = batch.step(1, actions=[[1, 2]])
+        assert obs["velocity"][0, 0].tolist() == [1, -8]
+
+        with pytest.raises(ValueError):
+            p.SpaceBatch([template], slots=[0], action="teleport")
+        with pytest.raises(ValueError):
+            batch.step(1, actions=[[1, 2, 3]])
+
+    def testReset(self) -> None:
+        batch = p.SpaceBatch.from_template(self._template(), 2, slots=[0], threads=1)
+        batch.step(1)
+        batch.reset([0])
+        obs = batch.observe()
+        assert obs["velocity"][:, 0].tolist() == [[0, 0], [0, -10]]
+        batch.reset()
+        assert batch.observe()["velocity"].tolist() == [[[0, 0]], [[0, 0]]]
+
+    def testPythonCallbacks(self) -> None:
+        template = self._template()
+        batch = p.SpaceBatch.from_template(template, 2, slots=[0])
+        assert batch.parallel
+        batch.spaces[1].body_at(0).velocity_func = lambda *args: None
+        assert not batch.parallel
+        batch.step(1)
+
+        # Removing callbacks is only seen after an explicit check.
+        batch.spaces[1].remove(batch.spaces[1].body_at(0))
+        assert not batch.parallel
+        assert not batch.spaces[1].has_python_callbacks()
+        assert batch.parallel
+        batch.spaces[0].add_post_step_callback(print, "key")
+        assert not batch.parallel
+
+        calls = []
+        self.body.velocity_func = lambda *args: calls.append(args)
+        assert template.has_python_callbacks()
+        batch = p.SpaceBatch([template], slots=[0])
+        assert not batch.parallel
+        batch.step(1)
+        assert len(calls) == 1
+
+    def testStepParallel(self) -> None:
+        spaces = [self._template() for _ in range(3)]
+        p.step_parallel(spaces, 0.5, 2)
+        for s in spaces:
+            assert s.body_at(0).velocity == (0, -10)
+
+        with ThreadPoolExecutor(2) as executor:
+            p.step_parallel(spaces, 0.5, 2, executor=executor)
+        assert spaces[0].body_at(0).velocity == (0, -20)
+
+        with pytest.raises(ValueError):
+            p.step_parallel([spaces[0], spaces[0]], 0.5)
+        spaces[1].collision_handler(1, 2, begin=None)
+        with pytest.raises(ValueError):
+            p.step_parallel(spaces, 0.5)
+        assert spaces[0].body_at(0).velocity == (0, -20)
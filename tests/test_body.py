@@ -227,6 +227,29 @@ class UnitTestBody(unittest.TestCase):
         s.step(1)
         self.assertEqual(b.velocity.x, 16)
 
+    def testIntegrators(self) -> None:
+        s = p.Space(gravity=(0, -10), native=True)
+        b1 = p.Body(1, 1, space=s)
+        b2 = p.Body(1, 1, space=s, velocity=(10, 0), angular_velocity=90)
+        b3 = p.Body(1, 1, space=s, velocity=(10, 0))
+        b1.velocity_func = p.integrators.gravity_scale(0.5)
+        b2.velocity_func = p.integrators.clamp(max_speed=5, max_angular=45)
+        b3.velocity_func = p.integrators.drag(linear=1)._replace(gravity_scale=0)
+        assert not s.has_python_callbacks()
+
+        s.step(1)
+        self.assertEqual(b1.velocity, (0, -5))
+        self.assertAlmostEqual(b2.velocity.length, 5)
+        self.assertAlmostEqual(b2.angular_velocity, 45)
+        self.assertEqual(b3.velocity, (5, 0))
+
+        b4 = pickle.loads(pickle.dumps(b3))
+        self.assertEqual(b4._velocity_func_base, b3._velocity_func_base)
+
+        b1.velocity_func = p.integrators.zero_gravity()
+        s.step(1)
+        self.assertEqual(b1.velocity, (0, -5))
+
     def testEachArbiters(self) -> None:
         s = p.Space()
         b1 = p.Body(1, 1)
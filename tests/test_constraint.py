@@ -137,6 +137,51 @@ class UnitTestConstraint(unittest.TestCase):
 
         self.assertEqual(actual_order, [1, 2])
 
+    def testBreak(self) -> None:
+        s = p.Space(gravity=(0, -10), native=True)
+        b1, b2 = p.Body(1, 2), p.Body(1, 2)
+        j1 = PivotJoint(s.static_body, b1, (0, 0))
+        j2 = PivotJoint(s.static_body, b2, (0, 0))
+        self.assertEqual(j1.max_impulse, float("inf"))
+        self.assertEqual(j1.break_force, float("inf"))
+        j1.max_impulse = 0.5
+        j2.break_force = 20
+        self.assertEqual(j1.max_impulse, 0.5)
+        self.assertEqual(j1.break_force, float("inf"))
+        s.add(b1, b2, j1, j2)
+
+        s.step_many(0.1, 3)
+        self.assertEqual(s.drain_broken_constraints(), [j1])
+        self.assertEqual(s.drain_broken_constraints(), [])
+        self.assertEqual(set(s.constraints), {j2})
+        self.assertNotIn(j1, s.constraints)
+
+        j2.break_force = 5
+        s.step(0.1)
+        self.assertEqual(s.drain_broken_constraints(), [j2])
+        self.assertEqual(len(s.constraints), 0)
+
+    def testBreakPostSolve(self) -> None:
+        s = p.Space(gravity=(0, -10))
+        b = p.Body(1, 2)
+        j = PivotJoint(s.static_body, b, (0, 0))
+        calls = []
+        j.post_solve = lambda c, space: calls.append(c)
+        j.max_impulse = 2
+        s.add(b, j)
+        s.step(0.1)
+        self.assertEqual(calls, [j])
+
+        j.max_impulse = float("inf")
+        s.step(0.1)
+        self.assertEqual(calls, [j, j])
+
+        j.break_force = 5
+        j.post_solve = None
+        s.step(0.1)
+        self.assertEqual(calls, [j, j])
+        self.assertEqual(s.drain_broken_constraints(), [j])
+
     def testPickle(self) -> None:
         a, b = p.Body(4, 5), p.Body(10, 10)
         a.custom = "a"
@@ -147,6 +192,7 @@ class UnitTestConstraint(unittest.TestCase):
         j.error_bias = 3
         j.max_bias = 4
         j.collide_bodies = False
+        j.max_impulse = 5
 
         j.pre_solve = pre_solve
         j.post_solve = post_solve
@@ -158,6 +204,8 @@ class UnitTestConstraint(unittest.TestCase):
         self.assertEqual(j.error_bias, j2.error_bias)
         self.assertEqual(j.max_bias, j2.max_bias)
         self.assertEqual(j.collide_bodies, j2.collide_bodies)
+        self.assertEqual(j.max_impulse, j2.max_impulse)
+        self.assertEqual(j.break_force, j2.break_force)
         self.assertEqual(j.a.custom, j2.a.custom)
         self.assertEqual(j.b.custom, j2.b.custom)
 
@@ -0,0 +1,109 @@
+import multiprocessing
+import unittest
+
+import pytest
+
+import easymunk as p
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def push(space: p.Space, force) -> int:
+    body = space.body_at(0)
+    body.force = force
+    return body.slot
+
+
+def count_steps(body, gravity, damping, dt) -> None:
+    body.angular_velocity += 1
+
+
+def fail(space: p.Space) -> None:
+    raise ValueError("fail")
+
+
+def fail_to_unpickle() -> None:
+    raise ValueError("cannot unpickle")
+
+
+class Unpicklable:
+    def __call__(self, body, gravity, damping, dt) -> None:
+        pass
+
+    def __reduce__(self):
+        return fail_to_unpickle, ()
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class UnitTestSpacePool(unittest.TestCase):
+    def _template(self) -> p.Space:
+        s = p.Space(gravity=(0, -10))
+        p.Body(1, 2, space=s)
+        return s
+
+    def testSlotHoles(self) -> None:
+        template = p.Space()
+        a, b, c = [p.Body(1, 2, position=(x, 0), space=template) for x in (1, 2, 3)]
+        template.remove(a)
+        with p.SpacePool([template] * 2, processes=1) as pool:
+            assert pool.slots == (1, 2)
+            assert pool.step(1)["position"][:, :, 0].tolist() == [[2, 3]] * 2
+        with p.SpacePool([template] * 2, slots=[b.slot], processes=1) as pool:
+            assert pool.step(1)["position"][:, 0].tolist() == [[2, 0]] * 2
+
+    def testStep(self) -> None:
+        with p.SpacePool([self._template()] * 3, processes=2, depth=2) as pool:
+            assert len(pool) == 3
+            assert pool.observe()["velocity"].tolist() == [[[0, 0]]] * 3
+
+            first = pool.step(0.5, 2)
+            assert first.shape == (3, 1)
+            assert first["velocity"][:, 0].tolist() == [[0, -10]] * 3
+            assert first["position"][:, 0, 1].tolist() == [-2.5] * 3
+
+            second = pool.step(1)
+            assert not np.shares_memory(first, second)
+            assert second["velocity"][:, 0, 1].tolist() == [-20] * 3
+            assert np.shares_memory(pool.step(1), first)
+
+    def testStartupFailure(self) -> None:
+        space = self._template()
+        space.body_at(0).velocity_func = Unpicklable()
+        with pytest.raises(ValueError):
+            p.SpacePool([self._template(), space], processes=2)
+        assert not multiprocessing.active_children()
+
+    def testStepAsync(self) -> None:
+        with p.SpacePool([self._template()] * 2, processes=2) as pool:
+            pool.step_async(1)
+            with pytest.raises(RuntimeError):
+                pool.step_async(1)
+            obs = pool.wait()
+            assert obs["velocity"][:, 0, 1].tolist() == [-10, -10]
+            with pytest.raises(RuntimeError):
+                pool.wait()
+
+    def testCallAndReset(self) -> None:
+        with p.SpacePool([self._template()] * 2, processes=2) as pool:
+            assert pool.call(push, (10, 0)) == [0, 0]
+            obs = pool.step(1)
+            assert obs["velocity"][:, 0].tolist() == [[10, -10], [10, -10]]
+
+            pool.reset([1])
+            obs = pool.step(1)
+            assert obs["velocity"][:, 0].tolist() == [[10, -20], [0, -10]]
+
+            with pytest.raises(ValueError):
+                pool.call(fail)
+        with pytest.raises(RuntimeError):
+            pool.step(1)
+
+    def testPythonCallbacks(self) -> None:
+        s = self._template()
+        s.body_at(0).velocity_func = count_steps
+        with p.SpacePool([s], processes=1) as pool:
+            obs = pool.step(0.1, 3)
+            assert obs["angular_velocity"][0, 0] == pytest.approx(3)
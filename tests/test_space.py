@@ -2,10 +2,14 @@ from __future__ import with_statement
 
 import copy
 import io
+import os
 import pickle
+import struct
 import sys
+import threading
 import unittest
 import warnings
+from math import degrees
 from typing import Any, Callable, Sequence
 
 import pytest
@@ -16,6 +20,11 @@ from easymunk import *
 from easymunk.constraints import *
 from easymunk.vec2d import Vec2d
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 
 class UnitTestSpace(unittest.TestCase):
     def _setUp(self) -> None:
@@ -95,6 +104,52 @@ class UnitTestSpace(unittest.TestCase):
             assert s.threads == 2
         s.step(1)
 
+    def testAutotuneThreads(self) -> None:
+        s = p.Space(threaded=True).autotune_threads(trial_steps=2, interval=5)
+        s.add(p.Body(1, 2))
+        s.step_many(0.01, 3)
+        s.step(0.01)
+        s.step_many(0.01, 10)
+        assert s.threads in (1, 2)
+
+        s.autotune_threads(False)
+        s.threads = 1
+        s.step_many(0.01, 10)
+        assert s.threads == 1
+
+        s = p.Space().autotune_threads()
+        s.step(0.01)
+        assert s.threads == 1
+
+    def testNative(self) -> None:
+        s = p.Space(native=True)
+        assert s.native
+        b1, b2 = p.Body(1, 2), p.Body(1, 2)
+        s.add(b1)
+        with self.assertRaises(ValueError):
+            b1.velocity_func = Body.update_velocity
+        with self.assertRaises(ValueError):
+            s.collision_handler(1, 2, begin=None)
+        with self.assertRaises(ValueError):
+            s.add_post_step_callback(lambda *args: None, 1)
+
+        j = PivotJoint(b1, b2, (0, 0))
+        j.pre_solve = lambda *args: None
+        with self.assertRaises(ValueError):
+            s.add(j)
+        j.pre_solve = None
+        s.add(j)
+        with self.assertRaises(ValueError):
+            j.post_solve = lambda *args: None
+        assert not s.has_python_callbacks()
+        assert copy.deepcopy(s).native
+
+        s.native = False
+        b1.position_func = Body.update_position
+        assert s.has_python_callbacks()
+        with self.assertRaises(ValueError):
+            s.native = True
+
     def testSpatialHash(self) -> None:
         s = p.Space()
         s.use_spatial_hash(10, 100)
@@ -320,6 +375,28 @@ class UnitTestSpace(unittest.TestCase):
         assert s2 in hits
         assert s1 not in hits
 
+    def testBBQueryThreads(self) -> None:
+        s = p.Space()
+        shapes = []
+        for i in range(8):
+            c = p.Circle(1, body=p.Body(1, 1))
+            c.body.position = 10 * i, 0
+            s.add(c.body, c)
+            shapes.append(c)
+        results = {}
+
+        def query(i: int) -> None:
+            bb = p.BB(10 * i - 2, -2, 10 * i + 2, 2)
+            results[i] = [s.bb_query(bb) for _ in range(200)]
+
+        threads = [threading.Thread(target=query, args=(i,)) for i in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for i, c in enumerate(shapes):
+            assert all(hits == [c] for hits in results[i])
+
     def testBBQuerySensor(self) -> None:
         s = p.Space()
         c = p.Circle(10, body=s.static_body)
@@ -767,6 +844,107 @@ class UnitTestSpace(unittest.TestCase):
 
         assert self.calls == 1
 
+    def testStepMany(self) -> None:
+        s1, s2 = p.Space(gravity=(0, -10)), p.Space(gravity=(0, -10))
+        b1, b2 = p.Body(1, 2, space=s1), p.Body(1, 2, space=s2)
+        s1.step_many(0.1, 10)
+        for _ in range(10):
+            s2.step(0.1)
+        assert b1.position == b2.position
+        assert b1.velocity == b2.velocity
+
+        s1.step_many(0.1, 0)
+        assert b1.position == b2.position
+
+    def testStepManyQueued(self) -> None:
+        s = p.Space()
+        b1, b2 = p.Body(1, 3, position=(10, 0)), p.Body(10, 100, position=(20, 0))
+        s1, s2 = p.Circle(5, body=b1), p.Circle(10, body=b2)
+        s.add(b1, b2, s1, s2)
+        steps = []
+
+        def pre_solve(arb: p.Arbiter, space: p.Space, data: Any) -> bool:
+            steps.append(len(steps))
+            space.remove(*arb.shapes)
+            return True
+
+        s.collision_handler(0, 0).pre_solve = pre_solve
+        s.step_many(0.1, 5)
+        assert s.shapes == []
+        assert steps == [0]
+
+    def testStats(self) -> None:
+        s = p.Space()
+        assert not s.collect_stats
+        s.step(0.1)
+        assert s.stats is None
+
+        s.collect_stats = True
+        b1, b2 = p.Body(1, 3, position=(10, 0)), p.Body(10, 100, position=(20, 0))
+        s.add(b1, b2, p.Circle(5, body=b1), p.Circle(10, body=b2))
+        b3 = p.Body(1, 2, position=(100, 0))
+        s.add(b3, p.Circle(1, body=b3))
+        b3.velocity_func = lambda *args: None
+
+        def pre_solve(arb: p.Arbiter, space: p.Space, data: Any) -> bool:
+            space.add_post_step_callback(lambda *args: None, 0)
+            return True
+
+        s.collision_handler(0, 0).pre_solve = pre_solve
+        s.step_many(0.01, 3)
+        stats = s.stats
+        assert stats is not None
+        assert stats.steps == 3
+        assert stats.awake_bodies == 3
+        assert stats.islands == 2
+        assert stats.arbiters == 1
+        assert stats.contacts >= 1
+        assert stats.collision_callbacks > 0
+        assert stats.body_callbacks > 0
+        assert stats.post_step_callbacks > 0
+        assert stats.total >= stats.collision_callbacks
+
+        s.step(0.01)
+        assert s.stats is not None and s.stats.steps == 1
+
+        s.collect_stats = False
+        assert s.stats is None
+        s.step(0.01)
+        assert s.stats is None
+
+    def testCallbackStats(self) -> None:
+        s = p.Space(collect_stats=True)
+        b1, b2 = p.Body(1, 3, position=(10, 0)), p.Body(10, 100, position=(20, 0))
+        c1, c2 = p.Circle(5, body=b1), p.Circle(10, body=b2)
+        c1.collision_type = 1
+        c2.collision_type = 2
+        s.add(b1, b2, c1, c2)
+
+        def pre_solve(arb: p.Arbiter, space: p.Space, data: Any) -> bool:
+            return True
+
+        def spring_pre_solve(constraint: Constraint, space: p.Space) -> None:
+            pass
+
+        s.collision_handler(2, 1).pre_solve = pre_solve
+        b1.position_func = p.Body.update_position
+        joint = p.DampedSpring(b1, b2, (0, 0), (0, 0), 10, 1, 1)
+        joint.pre_solve = spring_pre_solve
+        s.add(joint)
+        s.step_many(0.01, 2)
+
+        stats = {(r.kind, r.key): r for r in s.callback_stats()}
+        assert stats["pre_solve", (1, 2)].calls == 2
+        assert stats["position_func", "Body.update_position"].calls == 2
+        key = "UnitTestSpace.testCallbackStats.<locals>.spring_pre_solve"
+        assert stats["constraint_pre_solve", key].calls == 2
+        assert s.stats is not None
+        assert s.stats.constraint_callbacks > 0
+
+        times = [r.time for r in s.callback_stats(reset=True)]
+        assert times == sorted(times, reverse=True)
+        assert s.callback_stats() == []
+
     def testDebugDraw(self) -> None:
         s = p.Space()
 
@@ -842,6 +1020,80 @@ class UnitTestSpace(unittest.TestCase):
             print("\nActual", actual)
             raise
 
+    def testSnapshotRestore(self) -> None:
+        s = p.Space(gravity=(0, -10))
+        b1 = p.Body(1, 2, position=(0, 5))
+        c1 = p.Circle(1, body=b1)
+        b2 = p.Body(1, 2, position=(10, 0))
+        j = p.PivotJoint(b2, s.static_body, (10, 0))
+        floor = p.Segment((-20, 0), (20, 0), 1, body=s.static_body)
+        s.add(b1, c1, b2, j, floor)
+        s.step(0.1)
+
+        blob = s.snapshot()
+        c1.friction = 0.5
+        for _ in range(10):
+            s.step(0.1)
+        expected = b1.position, b1.velocity, b2.position
+
+        assert s.restore(blob) is s
+        assert c1.friction == 0
+        for _ in range(10):
+            s.step(0.1)
+        assert b1.position == approx(expected[0])
+        assert b1.velocity == approx(expected[1])
+        assert b2.position == approx(expected[2])
+
+    def testSnapshotRestoreSleeping(self) -> None:
+        s = p.Space(gravity=(0, -10), sleep_time_threshold=0.1)
+        b = p.Body(1, 2, position=(0, 1))
+        c = p.Circle(1, body=b)
+        s.add(b, c, p.Segment((-5, 0), (5, 0), 0, body=s.static_body))
+        for _ in range(100):
+            s.step(0.05)
+        assert b.is_sleeping
+
+        blob = s.snapshot()
+        b.activate()
+        b.position = 0, 10
+        s.restore(blob)
+        assert b.is_sleeping
+        assert b.position == approx((0, 1), abs=0.1)
+
+    def testSnapshotMismatch(self) -> None:
+        s = p.Space()
+        b = p.Body(1, 2)
+        s.add(b)
+        blob = s.snapshot()
+
+        with pytest.raises(ValueError):
+            s.restore(blob[:-1])
+        with pytest.raises(ValueError):
+            p.Space().restore(blob)
+
+        s.add(p.Circle(1, body=b))
+        with pytest.raises(ValueError):
+            s.restore(blob)
+
+    def testSnapshotCorrupted(self) -> None:
+        s = p.Space(gravity=(0, -10))
+        b = p.Body(1, 2, position=(0, 1))
+        s.add(b, p.Circle(1, body=b), p.Segment((-5, 0), (5, 0), 0, body=s.static_body))
+        for _ in range(5):
+            s.step(0.1)
+        blob = s.snapshot()
+
+        # Counts of the header, after the magic, version, hash and curr_dt.
+        for i in range(10):
+            for value in [1, 2 ** 61, 2 ** 64 - 1]:
+                offset = 24 + 8 * i
+                (count,) = struct.unpack_from("Q", blob, offset)
+                corrupted = bytearray(blob)
+                struct.pack_into("Q", corrupted, offset, (count + value) % 2 ** 64)
+                with pytest.raises(ValueError):
+                    s.restore(bytes(corrupted))
+        assert s.restore(blob) is s
+
     def testPickleMethods(self) -> None:
         self._testCopyMethod(lambda x: pickle.loads(pickle.dumps(x)))
 
@@ -937,5 +1189,652 @@ class UnitTestSpace(unittest.TestCase):
         self.assertIsNotNone(h2.separate)
 
 
+@unittest.skipIf(np is None, "numpy is not installed")
+class UnitTestSpaceArrays(unittest.TestCase):
+    def testGetBodyStates(self) -> None:
+        s = p.Space()
+        b1 = p.Body(1, 2, position=(1, 2), angle=90, velocity=(3, 4))
+        b2 = p.Body(1, 2, angular_velocity=45)
+        b2.force = 5, 6
+        b2.torque = 7
+        s.add(b1, b2)
+
+        states = s.get_body_states()
+        assert len(states) == 2
+        for body in s.bodies:
+            state = states[body.slot]
+            assert tuple(state["position"]) == body.position
+            assert state["angle"] == approx(body.angle)
+            assert tuple(state["velocity"]) == body.velocity
+            assert state["angular_velocity"] == approx(body.angular_velocity)
+            assert tuple(state["force"]) == body.force
+            assert state["torque"] == body.torque
+
+        states = s.get_body_states(bodies=[b2, b1])
+        assert states["position"].tolist() == [[0, 0], [1, 2]]
+        assert states["torque"].tolist() == [7, 0]
+
+    def testGetBodyStatesCenterOfGravity(self) -> None:
+        s = p.Space()
+        b = p.Body(1, 2, position=(1, 2), angle=90)
+        b.center_of_gravity = 3, 0
+        s.add(b)
+        assert s.get_body_states()["position"][0] == approx(b.position)
+
+    def testGetBodyStatesOut(self) -> None:
+        s = p.Space()
+        s.add(p.Body(1, 2, position=(1, 2)))
+        out = np.zeros(1, dtype=s.get_body_states().dtype)
+        assert s.get_body_states(out) is out
+        assert out["position"].tolist() == [[1, 2]]
+
+        with pytest.raises(ValueError):
+            s.get_body_states(np.zeros(2, dtype=out.dtype))
+        with pytest.raises(TypeError):
+            s.get_body_states(np.zeros(1))
+
+    def testGetBodyStatesTracksBodies(self) -> None:
+        s = p.Space()
+        assert len(s.get_body_states()) == 0
+        b = p.Body(1, 2)
+        s.add(b)
+        assert len(s.get_body_states()) == 1
+        s.remove(b)
+        states = s.get_body_states()
+        assert len(states) == 1
+        assert np.isnan(states["position"]).all()
+        s.compact_slots()
+        assert len(s.get_body_states()) == 0
+
+    def testSetBodyStates(self) -> None:
+        s = p.Space()
+        b1, b2 = p.Body(1, 2), p.Body(1, 2)
+        s.add(b1, b2)
+
+        s.set_body_states([b1, b2], position=[(1, 2), (3, 4)], angle=[90, 45])
+        assert b1.position == (1, 2)
+        assert b2.position == (3, 4)
+        assert b1.angle == approx(90)
+        assert b2.angle == approx(45)
+
+        s.set_body_states(velocity=(1, 1), angular_velocity=30)
+        assert b1.velocity == b2.velocity == (1, 1)
+        assert b1.angular_velocity == approx(30)
+        assert b2.angular_velocity == approx(30)
+
+        s.set_body_states(np.array([b2.slot]), position=[(5, 6)])
+        assert b2.position == (5, 6)
+        assert b1.position == (1, 2)
+
+        with pytest.raises(IndexError):
+            s.set_body_states([2], position=[(5, 6)])
+        s.remove(b1)
+        with pytest.raises(IndexError):
+            s.set_body_states([b1.slot or 0, b2.slot], position=(5, 6))
+        s.set_body_states(position=(7, 8))
+        assert b2.position == (7, 8)
+        with pytest.raises(ValueError):
+            s.set_body_states([b1, b2], position=[(1, 2), (3, 4), (5, 6)])
+
+    def testApplyForces(self) -> None:
+        s = p.Space()
+        b1, b2 = p.Body(1, 2), p.Body(1, 2, position=(10, 0))
+        s.add(b1, b2)
+
+        s.apply_forces([b1.slot, b2.slot], [(1, 0), (0, 1)], torques=[2, 3])
+        assert b1.force == (1, 0)
+        assert b2.force == (0, 1)
+        assert b1.torque == 2
+        assert b2.torque == 3
+
+        s.apply_forces(None, (0, 1), points=[(1, 0), (10, 0)])
+        assert b1.force == (1, 1)
+        assert b1.torque == 3
+        assert b2.force == (0, 2)
+        assert b2.torque == 3
+
+        s.step(1)
+        assert b1.force == (0, 0)
+        assert b1.velocity == (1, 1)
+
+    def testApplyForcesMatchesBody(self) -> None:
+        s = p.Space()
+        b1, b2 = p.Body(1, 2, angle=30), p.Body(1, 2, angle=30)
+        s.add(b1, b2)
+        b1.center_of_gravity = b2.center_of_gravity = (1, 2)
+
+        b1.apply_force_at_world_point((3, 4), (5, 6))
+        s.apply_forces([b2], [(3, 4)], [(5, 6)])
+        assert b1.force == b2.force
+        assert b1.torque == approx(b2.torque)
+
+        b1.apply_impulse_at_world_point((3, 4), (5, 6))
+        s.apply_impulses([b2], [(3, 4)], [(5, 6)])
+        assert b1.velocity == b2.velocity
+        assert b1.angular_velocity == approx(b2.angular_velocity)
+
+    def testApplyImpulses(self) -> None:
+        s = p.Space()
+        b = p.Body(2, 4)
+        s.add(b)
+
+        s.apply_impulses([b.slot], [(2, 0)], angular_impulses=[4])
+        assert b.velocity == (1, 0)
+        assert b.angular_velocity == approx(degrees(1))
+
+        s.remove(b)
+        with pytest.raises(IndexError):
+            s.apply_impulses([0], [(2, 0)])
+
+    def testBodySlots(self) -> None:
+        s = p.Space()
+        b1, b2, b3 = p.Body(1, 2), p.Body(1, 2), p.Body(1, 2)
+        assert b1.slot is None
+
+        s.add(b1)
+        s.add(b2)
+        s.add(b3)
+        assert [b1.slot, b2.slot, b3.slot] == [0, 1, 2]
+        assert s.body_at(1) is b2
+
+        s.remove(b2)
+        assert b2.slot is None
+        with pytest.raises(IndexError):
+            s.body_at(1)
+        with pytest.raises(IndexError):
+            s.body_at(3)
+
+        s.add(b2)
+        assert b2.slot == 1
+
+        s.remove(b1)
+        b3.position = 3, 3
+        states = s.get_body_states()
+        assert s.compact_slots() == [1, 2]
+        assert [b2.slot, b3.slot] == [0, 1]
+        assert s.body_at(1) is b3
+        assert s.get_body_states()["position"].tolist() == [[0, 0], [3, 3]]
+        assert states[[1, 2]]["position"].tolist() == [[0, 0], [3, 3]]
+
+    def testBodySlotsCopy(self) -> None:
+        s = p.Space()
+        bodies = [p.Body(1, 2, position=(i, 0)) for i in range(5)]
+        s.add(*bodies)
+        s2 = copy.deepcopy(s)
+        assert len(s2.get_body_states()) == 5
+        assert s2.get_body_states()["position"].tolist() == [
+            [i, 0] for i in range(5)
+        ]
+        assert [b.slot for b in s2.bodies if b.position.x == 2] == [2]
+
+        s.remove(bodies[1], bodies[4])
+        for copied in [copy.deepcopy(s), pickle.loads(pickle.dumps(s))]:
+            for i in [0, 2, 3]:
+                assert copied.body_at(i).position == s.body_at(i).position
+            for i in [1, 4]:
+                with pytest.raises(IndexError):
+                    copied.body_at(i)
+            copied.add(p.Body(1, 2, position=(10, 0)))
+            assert copied.body_at(1).position == (10, 0)
+
+    def testAdvance(self) -> None:
+        s = p.Space()
+        b = p.Body(1, 2, velocity=(1, 0), angular_velocity=10)
+        s.add(b)
+
+        assert s.advance(0.05, 0.1) == 0
+        assert b.position == (0, 0)
+        assert s.get_interpolated_poses()["position"].tolist() == [[0, 0]]
+
+        assert s.advance(0.1, 0.1) == 1
+        assert b.position.x == approx(0.1)
+        poses = s.get_interpolated_poses()
+        assert poses["position"][0] == approx((0.05, 0))
+        assert poses["angle"][0] == approx(0.5)
+
+        assert s.advance(10, 0.1, max_substeps=4) == 4
+        assert b.position.x == approx(0.5)
+        assert s.get_interpolated_poses()["position"][0] == approx((0.4, 0))
+
+        s = p.Space()
+        assert [s.advance(0.1, 0.1) for _ in range(3)] == [1, 1, 1]
+        assert s.advance(0.3, 0.1) == 3
+        for fixed_dt in [0, -0.1]:
+            with pytest.raises(ValueError):
+                s.advance(0.1, fixed_dt)
+
+    def testStepAsync(self) -> None:
+        s = p.Space(gravity=(0, -10))
+        b = p.Body(1, 2, space=s)
+        assert s.frame_states is None
+
+        future = s.step_async(0.5, 2)
+        states = s.frame_states
+        assert future.result() is s
+        assert states["velocity"].tolist() == [[0, 0]]
+        assert not states.flags.writeable
+        assert b.velocity == (0, -10)
+
+        s.step_async(1).result()
+        assert s.frame_states["velocity"].tolist() == [[0, -10]]
+        assert states["velocity"].tolist() == [[0, 0]]
+        assert b.velocity == (0, -20)
+
+        # Spaces share a thread pool instead of keeping a thread each.
+        threads = threading.active_count()
+        spaces = [p.Space() for _ in range(3 * (os.cpu_count() or 1))]
+        for space in spaces:
+            space.step_async(1).result()
+        assert threading.active_count() <= threads + (os.cpu_count() or 1)
+
+    def testAdvanceSlots(self) -> None:
+        s = p.Space()
+        b1 = p.Body(1, 2, velocity=(1, 0))
+        b2 = p.Body(1, 2, position=(5, 0))
+        s.add(b1, b2)
+        s.advance(0.15, 0.1)
+
+        s.remove(b1)
+        b3 = p.Body(1, 2, position=(10, 0))
+        s.add(b3)
+        assert b3.slot == 0
+        poses = s.get_interpolated_poses()
+        assert poses["position"].tolist() == [[10, 0], [5, 0]]
+
+        s.remove(b3)
+        s.compact_slots()
+        assert s.get_interpolated_poses()["position"].tolist() == [[5, 0]]
+
+    def testSetBodyStatesReindex(self) -> None:
+        s = p.Space()
+        b = p.Body(1, 2)
+        c = p.Circle(1, body=b)
+        s.add(b, c)
+
+        s.set_body_states([b], position=[(10, 0)])
+        assert s.point_query_nearest((10, 0), 0) is None
+
+        s.set_body_states([b], position=[(10, 0)], reindex=True)
+        hit = s.point_query_nearest((10, 0), 0)
+        assert hit is not None and hit.shape is c
+
+    def testCollisionEvents(self) -> None:
+        s = p.Space()
+        b1 = p.Body(1, 1, space=s, velocity=(0, -10))
+        c1 = b1.create_circle(1, collision_type=1)
+        c2 = s.static_body.create_segment((-5, -2), (5, -2), 0, collision_type=2)
+        calls = []
+        s.wildcard_collision_handler(2).begin = lambda *args: calls.append(1) or True
+        s.collision_handler(2, 1).recorded_events = ["begin", "post_solve", "separate"]
+
+        s.step_many(0.01, 20)
+        events = s.drain_collision_events()
+        assert events["event"].tolist()[:2] == [0, 1]
+        assert events["first_contact"][0] and not events["first_contact"][-1]
+        assert events["shape_a"][0] == c2._id
+        assert s.shape_from_id(events["shape_b"][0]) is c1
+        assert events["normal"][0] == approx((0, 1))
+        assert events["total_impulse"][1][1] != 0
+        assert calls == [1]
+        assert len(s.drain_collision_events()) == 0
+
+        s.remove(c1)
+        assert s.drain_collision_events()["event"].tolist() == [2]
+
+        with pytest.raises(ValueError):
+            s.collision_handler(1, 2).recorded_events = ["pre_solve"]
+        s = p.Space(native=True)
+        s.collision_handler(1, 2).recorded_events = ["begin"]
+        assert not s.has_python_callbacks()
+
+    def testCollisionEventsPickle(self) -> None:
+        s = p.Space()
+        s.collision_handler(1, 2, recorded_events=["begin"])
+        s2 = copy.deepcopy(s)
+        handler = s2.collision_handler(1, 2)
+        assert handler.recorded_events == ("begin",)
+        assert handler.begin is None
+        handler.begin = lambda *args: True
+        assert handler.recorded_events == ()
+
+        s = p.Space(native=True)
+        s.collision_handler(1, 2, recorded_events=["begin"])
+        assert copy.deepcopy(s).native
+
+    def testCollisionRule(self) -> None:
+        s = p.Space(gravity=(0, -10), native=True)
+        ball = p.Body(1, 1, space=s).create_circle(1, collision_type=1)
+        _ = s.static_body.create_segment((-5, -1.5), (5, -1.5), 0)
+        handler = s.collision_rule(0, 1, sensor=True)
+        assert handler.rule == p.CollisionRule(sensor=True)
+        assert handler.pre_solve is None
+        assert not s.has_python_callbacks()
+        s.step_many(0.1, 10)
+        assert ball.body.position.y < -2
+
+        s = p.Space(gravity=(0, -10))
+        ball = p.Body(1, 1, space=s, velocity=(0, -10)).create_circle(1)
+        _ = s.static_body.create_segment((-5, -1.5), (5, -1.5), 0)
+        handler = s.collision_rule(
+            0, 0, friction=1.0, elasticity=1.0, surface_velocity=(3, 0)
+        )
+        calls = []
+        s.wildcard_collision_handler(
+            0, pre_solve=lambda *args: calls.append(args) or True
+        )
+        s.step_many(0.05, 10)
+        assert calls
+        assert ball.body.velocity.y > 3
+        assert ball.body.velocity.x != 0
+
+        handler.begin = lambda *args: True
+        assert handler.rule is not None
+        handler.pre_solve = lambda *args: True
+        assert handler.rule is None
+
+        s = p.Space(gravity=(0, -10), native=True)
+        ball = p.Body(1, 1, space=s).create_circle(1)
+        _ = s.static_body.create_segment((-5, -1.5), (5, -1.5), 0)
+        handler = s.collision_rule(0, 0, ignore=True)
+        handler.rule = p.CollisionRule(friction=0.5)
+        handler.rule = None
+        assert handler.begin is None
+        assert not handler.has_callbacks()
+        s.step_many(0.1, 10)
+        assert ball.body.position.y > -1
+
+    def testContactStats(self) -> None:
+        s = p.Space(gravity=(0, -10), track_contacts=True)
+        b1 = p.Body(1, 1, space=s)
+        b1.create_circle(1)
+        b2 = p.Body(1, 1, space=s, position=(20, 0))
+        b2.create_circle(1)
+        s.static_body.create_segment((-5, -1.5), (5, -1.5), 0)
+        s.step(0.05)
+        s.step_many(0.05, 9)
+
+        stats = s.get_contact_stats()
+        assert stats.shape == (2,)
+        assert stats["normal_impulse"][0] > 0
+        assert 0 < stats["max_impulse"][0] <= stats["normal_impulse"][0] + 1e-9
+        assert stats["kinetic_energy"][0] >= 0
+        assert 0 < stats["collisions"][0] <= 10
+        assert stats[1].tolist() == (0, 0, 0, 0)
+
+        stats = s.get_contact_stats(bodies=[b1], reset=False)
+        assert stats["collisions"].tolist() == [0]
+        s.step(0.05)
+        assert s.get_contact_stats(bodies=[b1], reset=False)["collisions"] == [1]
+        assert s.get_contact_stats(bodies=[b1])["collisions"] == [1]
+
+        s.track_contacts = False
+        s.step(0.05)
+        assert s.get_contact_stats()["collisions"].tolist() == [0, 0]
+        assert copy.deepcopy(s).track_contacts is False
+
+    def testCollisionRulePickle(self) -> None:
+        s = p.Space(native=True)
+        s.collision_rule(1, 2, ignore=True)
+        s2 = copy.deepcopy(s)
+        handler = s2.collision_handler(1, 2)
+        assert s2.native
+        assert handler.rule == p.CollisionRule(ignore=True)
+        assert handler.begin is None
+
+        s = p.Space()
+        handler = s.collision_handler(1, 2, recorded_events=["begin", "separate"])
+        handler.rule = p.CollisionRule(ignore=True)
+        assert handler.recorded_events == ("separate",)
+        handler.rule = None
+        assert not handler.has_callbacks()
+        assert handler.recorded_events == ("separate",)
+        assert "rule" not in handler.as_dict()
+
+        handler.recorded_events = ()
+        assert handler.as_dict() == dict.fromkeys(
+            ["begin", "pre_solve", "post_solve", "separate"]
+        )
+
+    def testVelocityHook(self) -> None:
+        s = p.Space(gravity=(0, -10))
+        b1 = p.Body(1, 2, position=(1, 2), velocity=(1, 0), angular_velocity=10)
+        b2 = p.Body(2, 2, position=(3, 4))
+        b3 = p.Body(1, 2)
+        s.add(b1, b2, b3)
+        calls = []
+
+        def hook(velocities, positions, masses, gravity, damping, dt):
+            calls.append((positions.tolist(), masses.tolist(), gravity, dt))
+            return velocities * 2 + (0, 1)
+
+        h = s.add_velocity_hook([b1, b2], hook)
+        assert s.has_python_callbacks()
+        b1.force = 10, 0
+        s.step(0.5)
+        assert calls == [([[1.5, 2], [3, 4]], [1, 2], (0, -10), 0.5)]
+        assert b1.velocity == (12, 1)
+        assert b2.velocity == (0, 1)
+        assert b1.angular_velocity == approx(10)
+        assert b1.force == (0, 0)
+        assert b3.velocity == (0, -5)
+
+        with pytest.raises(ValueError):
+            s.add_velocity_hook([b2, b3], hook)
+        with pytest.raises(ValueError):
+            s.add_velocity_hook([p.Body(1, 2)], hook)
+
+        s.remove_velocity_hook(h)
+        s.step(0.5)
+        assert len(calls) == 1
+        assert b2.velocity == (0, -4)
+        with pytest.raises(ValueError):
+            p.Space(native=True).add_velocity_hook([], hook)
+
+        s = p.Space(sleep_time_threshold=1)
+        b1, b2, b3 = p.Body(1, 2), p.Body(1, 2), p.Body(1, 2)
+        s.add(b1, b2, b3)
+        h = s.add_velocity_hook([b1, b2, b3], lambda v, *args: v + 1)
+        s.remove(b1)
+        assert h.bodies == (b2, b3)
+        b3.sleep()
+        s.step(0.1)
+        assert b1.velocity == (0, 0)
+        assert b2.velocity == (1, 1)
+        assert b3.velocity == (0, 0)
+
+        s.remove(b2, b3)
+        assert not s.has_python_callbacks()
+        s.add(b1)
+        s.step(0.1)
+        assert b1.velocity == (0, 0)
+
+    def testSegmentQueryFirstBatch(self) -> None:
+        s = p.Space()
+        b1 = p.Body(1, 1, position=(19, 0))
+        s1 = p.Circle(10, body=b1)
+        b2 = p.Body(1, 1)
+        s2 = p.Circle(10, body=b2)
+        s.add(b1, s1, b2, s2)
+        sensor = p.Circle(5, body=s.static_body, offset=(0, 50))
+        sensor.sensor = True
+        s.add(sensor)
+
+        starts = [(-13, 0), (-13, 50), (40, 0)]
+        ends = [(131, 0), (131, 50), (-40, 0)]
+        hits = s.segment_query_first_batch(starts, ends)
+        assert hits.shape == (3,)
+        for hit, start, end in zip(hits, starts, ends):
+            info = s.segment_query_first(start, end)
+            if info is None:
+                assert hit["shape"] == -1
+                assert hit["body"] == -1
+                assert tuple(hit["point"]) == end
+                assert hit["alpha"] == 1
+            else:
+                assert s.shape_from_id(hit["shape"]) is info.shape
+                assert hit["body"] == info.shape.body.slot
+                assert tuple(hit["point"]) == approx(info.point)
+                assert tuple(hit["normal"]) == approx(info.normal)
+                assert hit["alpha"] == approx(info.alpha)
+        assert hits["body"].tolist() == [b2.slot, -1, b1.slot]
+
+        hits = s.segment_query_first_batch((0, 30), [(0, 0), (0, 60)], radius=1)
+        assert hits["body"].tolist() == [b2.slot, -1]
+        s2.filter = p.ShapeFilter(categories=0b10)
+        hits = s.segment_query_first_batch(
+            [(-40, 0)], [(40, 0)], filter=p.ShapeFilter(mask=0b1)
+        )
+        assert hits["body"].tolist() == [b1.slot]
+
+        out = np.zeros(1, hits.dtype)
+        assert s.segment_query_first_batch([(-40, 0)], [(40, 0)], out=out) is out
+        with pytest.raises(ValueError):
+            s.segment_query_first_batch([0, 1, 2], [(0, 0)])
+
+    def testPointQueryNearestBatch(self) -> None:
+        s = p.Space()
+        b1 = p.Body(1, 1, position=(19, 0))
+        s1 = p.Circle(10, body=b1)
+        s2 = p.Segment((-5, -20), (5, -20), 1, body=s.static_body)
+        s.add(b1, s1, s2)
+        sensor = p.Circle(5, body=s.static_body, offset=(0, 50))
+        sensor.sensor = True
+        s.add(sensor)
+
+        points = [(0, 0), (19, 5), (0, -30), (0, 52), (100, 100)]
+        hits = s.point_query_nearest_batch(points, 15)
+        assert hits.shape == (5,)
+        for hit, point in zip(hits, points):
+            info = s.point_query_nearest(point, 15)
+            if info is None:
+                assert hit["shape"] == -1
+                assert hit["body"] == -1
+                assert tuple(hit["point"]) == point
+                assert hit["distance"] == 15
+                assert tuple(hit["gradient"]) == (0, 0)
+            else:
+                assert s.shape_from_id(hit["shape"]) is info.shape
+                assert tuple(hit["point"]) == approx(info.point)
+                assert hit["distance"] == approx(info.distance)
+                assert tuple(hit["gradient"]) == approx(info.gradient)
+        assert hits["body"].tolist() == [b1.slot, b1.slot, -1, -1, -1]
+        assert hits["shape"].tolist()[2] != -1
+        assert hits["distance"][1] == approx(-5)
+
+        hits = s.point_query_nearest_batch(points, 15, p.ShapeFilter(mask=0))
+        assert hits["shape"].tolist() == [-1] * 5
+        assert len(s.point_query_nearest_batch(np.zeros((0, 2)))) == 0
+
+    def testQueryArrays(self) -> None:
+        s = p.Space()
+        b1 = p.Body(1, 1)
+        s1 = p.Circle(10, body=b1)
+        s2 = p.Circle(5, body=s.static_body, offset=(12, 0))
+        s.add(b1, s1, s2)
+
+        hits = s.point_query_array((8, 0), 5)
+        infos = {info.shape: info for info in s.point_query((8, 0), 5)}
+        assert len(hits) == len(infos) == 2
+        for hit in hits:
+            info = infos[s.shape_from_id(hit["shape"])]
+            assert tuple(hit["point"]) == approx(info.point)
+            assert hit["distance"] == approx(info.distance)
+        assert sorted(hits["body"].tolist()) == [-1, b1.slot]
+
+        hits = s.segment_query_array((-20, 0), (20, 0))
+        infos = {info.shape: info for info in s.segment_query((-20, 0), (20, 0))}
+        assert len(hits) == len(infos) == 2
+        for hit in hits:
+            info = infos[s.shape_from_id(hit["shape"])]
+            assert tuple(hit["point"]) == approx(info.point)
+            assert tuple(hit["normal"]) == approx(info.normal)
+            assert hit["alpha"] == approx(info.alpha)
+
+        bb = p.BB(-1, -1, 1, 1)
+        hits = s.bb_query_array(bb)
+        assert len(hits) == 1
+        assert s.shape_from_id(hits["shape"][0]) is s1
+        assert hits["body"].tolist() == [b1.slot]
+        assert s.bb_query(bb) == [s1]
+
+        query = p.Circle(3, body=p.Body(body_type=p.Body.KINEMATIC))
+        query.body.position = (9, 0)
+        hits = s.shape_query_array(query)
+        infos = {info.shape: info for info in s.shape_query(query)}
+        assert len(hits) == len(infos) == 2
+        for hit in hits:
+            info = infos[s.shape_from_id(hit["shape"])]
+            assert hit["count"] == len(info.contact_point_set.points)
+            assert tuple(hit["normal"]) == approx(info.contact_point_set.normal)
+            point = info.contact_point_set.points[0]
+            assert tuple(hit["points"]["point_a"][0]) == approx(point.point_a)
+            assert hit["points"]["distance"][0] == approx(point.distance)
+
+        assert len(s.bb_query_array(p.BB(200, 200, 201, 201))) == 0
+
+    def testBBQueryBatch(self) -> None:
+        s = p.Space()
+        b1 = p.Body(1, 1)
+        s1 = p.Circle(5, body=b1)
+        s2 = p.Circle(5, body=s.static_body, offset=(20, 0))
+        s.add(b1, s1, s2)
+
+        bbs = [p.BB(-1, -1, 1, 1), p.BB(-30, -30, 30, 30), p.BB(50, 50, 60, 60)]
+        offsets, hits = s.bb_query_batch(bbs)
+        assert offsets.tolist() == [0, 1, 3, 3]
+        for bb, start, stop in zip(bbs, offsets[:-1], offsets[1:]):
+            ids = hits["shape"][start:stop]
+            assert {s.shape_from_id(id_) for id_ in ids} == set(s.bb_query(bb))
+        assert hits["body"][0] == b1.slot
+
+        offsets, hits = s.bb_query_batch(bbs, p.ShapeFilter(mask=0))
+        assert offsets.tolist() == [0, 0, 0, 0]
+        assert len(hits) == 0
+
+        offsets, hits = s.bb_query_batch(np.zeros((0, 4)))
+        assert offsets.tolist() == [0]
+        with self.assertRaises(ValueError):
+            s.bb_query_batch([(0, 0), (1, 1)])
+
+    def testRasterize(self) -> None:
+        s = p.Space()
+        b1 = p.Body(1, 1, position=(3, 2))
+        s1 = p.Circle(2.5, body=b1)
+        s2 = p.Segment((-10, -8), (10, -8), 1, body=s.static_body)
+        s.add(b1, s1, s2)
+
+        bb = p.BB(-10, -10, 10, 10)
+        grid = s.rasterize(bb, 0.5)
+        assert grid.shape == (40, 40)
+        assert grid.dtype == bool
+        for j in range(0, 40, 3):
+            for i in range(0, 40, 3):
+                center = (-10 + (i + 0.5) * 0.5, -10 + (j + 0.5) * 0.5)
+                expected = any(
+                    info.distance <= 0 for info in s.point_query(center, 0)
+                )
+                assert grid[j, i] == expected, (i, j)
+        assert grid[24, 26] and grid[3, 0] and not grid[20, 20]
+
+        grid = s.rasterize(bb, 0.5, p.ShapeFilter(mask=0))
+        assert not grid.any()
+
+        wide = s.rasterize(bb, 0.5, margin=0.5 / 2 ** 0.5)
+        assert (wide | grid).sum() == wide.sum() > grid.sum()
+
+        out = np.ones((40, 40), dtype=bool)
+        assert s.rasterize(bb, 0.5, out=out) is out
+        assert (out == s.rasterize(bb, 0.5)).all()
+        assert s.rasterize(p.BB(0, 0, 1, 3), 2).shape == (2, 1)
+        with self.assertRaises(ValueError):
+            s.rasterize(bb, 0)
+
+        # Cell indices of huge shapes do not fit in an int
+        s = p.Space()
+        s.add(p.Segment((-1e12, 5), (1e12, 5), 1, body=s.static_body))
+        grid = s.rasterize(bb, 0.5)
+        assert grid[28:32].all() and grid.sum() == 4 * 40
+
+
 def f1(*args: Any, **kwargs: Any) -> None:
     pass